@@ -91,6 +91,19 @@ for x in range(16):
 
 class AnyKeycode:
 
+    """
+        Evaluates keycode expressions such as LCTL(KC_A) | MOD_LSFT
+
+        Parsed expressions are shared by every instance, parsing does not depend on the protocol or on the
+        keycodes. shared() returns one instance per protocol whose names stay valid until the keycodes are
+        regenerated.
+    """
+
+    MAX_EXPRESSIONS = 4096
+    trees = dict()
+    instances = dict()
+    instances_generation = None
+
     def __init__(self):
         self.ops = simpleeval.DEFAULT_OPERATORS.copy()
         self.ops.update({
@@ -100,6 +113,17 @@ class AnyKeycode:
         })
         self.names = dict()
         self.prepare_names()
+        self.evaluator = simpleeval.SimpleEval(operators=self.ops, functions=functions, names=self.names)
+
+    @classmethod
+    def shared(cls):
+        if cls.instances_generation != Keycode.generation:
+            cls.instances.clear()
+            cls.instances_generation = Keycode.generation
+        anykc = cls.instances.get(Keycode.protocol)
+        if anykc is None:
+            anykc = cls.instances[Keycode.protocol] = cls()
+        return anykc
 
     def prepare_names(self):
         for kc in KEYCODES_SPECIAL + KEYCODES_BASIC + KEYCODES_SHIFTED + KEYCODES_ISO + KEYCODES_BACKLIGHT + \
@@ -112,5 +136,15 @@ class AnyKeycode:
             macros[s] = Keycode.resolve(s)
         self.names.update(macros)
 
+    @classmethod
+    def parse(cls, s):
+        tree = cls.trees.get(s)
+        if tree is None:
+            tree = simpleeval.SimpleEval.parse(s)
+            if len(cls.trees) >= cls.MAX_EXPRESSIONS:
+                cls.trees.clear()
+            cls.trees[s] = tree
+        return tree
+
     def decode(self, s):
-        return simpleeval.simple_eval(s, names=self.names, functions=functions, operators=self.ops)
+        return self.evaluator.eval(s, previously_parsed=self.parse(s))
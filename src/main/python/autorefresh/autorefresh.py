@@ -64,21 +64,27 @@ class Autorefresh(QObject):
         self.thread.load_via_stack(data)
 
     def select_device(self, idx):
+        self.set_current_device(idx)
+        if self.current_device is not None:
+            self.current_device.open(self.override_json())
+
+    def set_current_device(self, idx):
+        """ Closes the previously selected device and selects the one at idx, without opening it """
         if self.current_device is not None:
             self.current_device.close()
         self.current_device = None
         if idx >= 0:
             self.current_device = self.devices[idx]
-
-        if self.current_device is not None:
-            if self.current_device.sideload:
-                self.current_device.open(self.thread.sideload_json)
-            elif self.current_device.via_stack:
-                self.current_device.open(self.thread.via_stack_json["definitions"][self.current_device.via_id])
-            else:
-                self.current_device.open(None)
         self.thread.set_device(self.current_device)
 
+    def override_json(self):
+        """ Definition the current device must be opened with, None if it provides its own """
+        if self.current_device.sideload:
+            return self.thread.sideload_json
+        elif self.current_device.via_stack:
+            return self.thread.via_stack_json["definitions"][self.current_device.via_id]
+        return None
+
     def on_devices_updated(self, devices, changed):
         self.devices = devices
         self.devices_updated.emit(devices, changed)
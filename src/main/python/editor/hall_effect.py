@@ -807,7 +807,7 @@ class HallEffect(BasicEditor):
             row = widget.desc.row
             col = widget.desc.col
             
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             # new value in mm
             actuation_point = min(self.convert_to_nearest_10mm(actuation.actuation_point), total_travel - 10)
@@ -819,8 +819,6 @@ class HallEffect(BasicEditor):
             actuation.rt_press = self.convert_to_255(rt_press)
             actuation.rt_release = self.convert_to_255(rt_release)
 
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
             if row == last_row and col == last_col:
                 self.actuation_display_val = actuation_point
                 self.rt_press_display_val = rt_press
@@ -828,6 +826,7 @@ class HallEffect(BasicEditor):
 
                 self.refresh_settings_display()
 
+        self.keyboard.commit_actuation(self.profile)
         self.total_travel_val = total_travel
         
         self.keyboard.switch_option = self.switch_display_val
@@ -863,15 +862,10 @@ class HallEffect(BasicEditor):
         self.temp_actuation_display()
 
     def on_actuation_sld_released(self):
-        for key in self.container.selected_keys:
-            row = key.desc.row
-            col = key.desc.col
-
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
-            actuation.actuation_point = self.convert_to_255(self.actuation_display_val)
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
-            # print(f"Set actuation point: {actuation.actuation_point}")
+        keys = [(key.desc.row, key.desc.col) for key in self.container.selected_keys]
+        self.keyboard.actuation_matrix.assign(self.profile, keys,
+                                              actuation_point=self.convert_to_255(self.actuation_display_val))
+        self.keyboard.commit_actuation(self.profile)
 
         self.refresh_layout_display()
         self.refresh_settings_display()
@@ -893,7 +887,7 @@ class HallEffect(BasicEditor):
             row = key.desc.row
             col = key.desc.col
             
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
             actuation.rt_mode = mode
 
             if mode == 0:
@@ -903,10 +897,7 @@ class HallEffect(BasicEditor):
             elif mode == 1:
                 actuation.rt_press = self.convert_to_255(20)
 
-            self.keyboard.set_actuation_config(self.profile, row, col)
-            
-            # print(f"Set Mode: {self.rt_mode_display_val}")
-
+        self.keyboard.commit_actuation(self.profile)
         self.refresh_layout_display()
         self.refresh_settings_display()
 
@@ -917,15 +908,9 @@ class HallEffect(BasicEditor):
         if self.rt_mode_display_val != 0:
             self.rt_mode_display_val = mode
 
-        for key in self.container.selected_keys:
-            row = key.desc.row
-            col = key.desc.col
-            
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
-            actuation.rt_mode = mode
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
-            # print(f"Set Mode: {self.rt_mode_display_val}")
+        keys = [(key.desc.row, key.desc.col) for key in self.container.selected_keys]
+        self.keyboard.actuation_matrix.assign(self.profile, keys, rt_mode=mode)
+        self.keyboard.commit_actuation(self.profile)
 
         self.refresh_layout_display()
         self.refresh_settings_display()
@@ -944,7 +929,7 @@ class HallEffect(BasicEditor):
             row = key.desc.row
             col = key.desc.col
 
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             actuation.rt_mode = self.rt_mode_display_val
 
@@ -953,10 +938,7 @@ class HallEffect(BasicEditor):
             else:
                 actuation.rt_release = 0
 
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
-            # print(f"Separate sens: {self.rt_mode_display_val}")
-
+        self.keyboard.commit_actuation(self.profile)
         self.refresh_layout_display()
         self.refresh_settings_display()
 
@@ -967,17 +949,10 @@ class HallEffect(BasicEditor):
         self.temp_rt_press_display()
 
     def on_rt_press_sld_released(self):
-        for key in self.container.selected_keys:
-            row = key.desc.row
-            col = key.desc.col
-
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
-            actuation.rt_mode = self.rt_mode_display_val
-            actuation.rt_press = self.convert_to_255(self.rt_press_display_val)
-
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
-            # print(f"Set press sens: {actuation.rt_mode, actuation.rt_press}")
+        keys = [(key.desc.row, key.desc.col) for key in self.container.selected_keys]
+        self.keyboard.actuation_matrix.assign(self.profile, keys, rt_mode=self.rt_mode_display_val,
+                                              rt_press=self.convert_to_255(self.rt_press_display_val))
+        self.keyboard.commit_actuation(self.profile)
 
         self.refresh_layout_display()
         self.refresh_settings_display()
@@ -989,17 +964,10 @@ class HallEffect(BasicEditor):
         self.temp_rt_release_display()
 
     def on_rt_release_sld_released(self):
-        for key in self.container.selected_keys:
-            row = key.desc.row
-            col = key.desc.col
-
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
-            actuation.rt_mode = self.rt_mode_display_val
-            actuation.rt_release = self.convert_to_255(self.rt_release_display_val)
-
-            self.keyboard.set_actuation_config(self.profile, row, col)
-
-            # print(f"Set release sens: {actuation.rt_mode, actuation.rt_release}")
+        keys = [(key.desc.row, key.desc.col) for key in self.container.selected_keys]
+        self.keyboard.actuation_matrix.assign(self.profile, keys, rt_mode=self.rt_mode_display_val,
+                                              rt_release=self.convert_to_255(self.rt_release_display_val))
+        self.keyboard.commit_actuation(self.profile)
 
         self.refresh_layout_display()
         self.refresh_settings_display()
@@ -1203,7 +1171,7 @@ class HallEffect(BasicEditor):
 
             row, col = self.container.last_key.desc.row, self.container.last_key.desc.col
 
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             self.actuation_display_val = self.convert_to_nearest_10mm(actuation.actuation_point)
             self.rt_mode_display_val = actuation.rt_mode
@@ -1354,7 +1322,7 @@ class HallEffect(BasicEditor):
         
         row, col = self.container.last_key.desc.row, self.container.last_key.desc.col
 
-        actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+        actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
         self.actuation_display_val = self.convert_to_nearest_10mm(actuation.actuation_point)
         self.rt_mode_display_val = actuation.rt_mode
@@ -1388,7 +1356,7 @@ class HallEffect(BasicEditor):
             row = key.desc.row
             col = key.desc.col
 
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             rt_release = self.convert_to_nearest_5mm(actuation.rt_release, self.switch_display_val)
 
@@ -1406,7 +1374,7 @@ class HallEffect(BasicEditor):
             row = key.desc.row
             col = key.desc.col
 
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             rt_press = self.convert_to_nearest_5mm(actuation.rt_press, self.switch_display_val)
 
@@ -1524,7 +1492,7 @@ class HallEffect(BasicEditor):
             row = widget.desc.row
             col = widget.desc.col
 
-            actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+            actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
 
             actuation_point = self.convert_to_nearest_10mm(actuation.actuation_point)
             rt_mode = actuation.rt_mode
@@ -1616,7 +1584,7 @@ class HallEffect(BasicEditor):
 
         self.total_travel_val = self.total_travel[self.switch_display_val]
 
-        actuation = self.keyboard.actuation_matrix[self.profile][row][col]
+        actuation = self.keyboard.actuation_matrix.key(self.profile, row, col)
         
         self.actuation_display_val = self.convert_to_nearest_10mm(actuation.actuation_point)
         self.rt_mode_display_val = actuation.rt_mode
@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 import json
+import logging
 
 from PyQt5.QtWidgets import QHBoxLayout, QLabel, QVBoxLayout, QMessageBox, QWidget
 from PyQt5.QtCore import Qt, pyqtSignal
@@ -133,7 +134,7 @@ class KeymapEditor(BasicEditor):
     def save_layout(self):
         return self.keyboard.save_layout()
 
-    def restore_layout(self, data):
+    def restore_layout(self, data, progress=None):
         if json.loads(data.decode("utf-8")).get("uid") != self.keyboard.keyboard_id:
             ret = QMessageBox.question(self.widget(), "",
                                        tr("KeymapEditor", "Saved keymap belongs to a different keyboard,"
@@ -141,7 +142,19 @@ class KeymapEditor(BasicEditor):
                                        QMessageBox.Yes | QMessageBox.No)
             if ret != QMessageBox.Yes:
                 return
-        self.keyboard.restore_layout(data)
+        plan = self.keyboard.plan_restore(data)
+        logging.info("Restoring layout: {}".format(plan))
+        if plan.packets == 0:
+            QMessageBox.information(self.widget(), "", tr("KeymapEditor", "The keyboard already matches the saved "
+                                                                          "layout."))
+            return
+        changes = "\n".join("{}: {}".format(name.replace("_", " "), count) for name, count in plan.report() if count)
+        text = tr("KeymapEditor", "Restoring the layout sends these requests to the keyboard:") + "\n\n" + changes
+        if plan.unlock:
+            text += "\n\n" + tr("KeymapEditor", "The keyboard will have to be unlocked first.")
+        if QMessageBox.question(self.widget(), "", text, QMessageBox.Ok | QMessageBox.Cancel) != QMessageBox.Ok:
+            return
+        self.keyboard.execute_restore(plan, progress)
         self.refresh_layer_display()
 
     def on_any_keycode(self):
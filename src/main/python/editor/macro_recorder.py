@@ -1,4 +1,5 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
+import logging
 import sys
 
 from PyQt5.QtWidgets import QPushButton, QHBoxLayout, QWidget, QLabel
@@ -26,6 +27,8 @@ class MacroRecorder(BasicEditor):
         self.keystrokes = []
         self.macro_tabs = []
         self.macro_tab_w = []
+        # keyboard.macro split into single macros, see saved_macros
+        self.saved_buffer = self.saved_split = None
 
         self.recorder = None
 
@@ -93,13 +96,23 @@ class MacroRecorder(BasicEditor):
 
         self.on_change()
 
+    def saved_macros(self):
+        """ Macros as stored on the keyboard, split again only when keyboard.macro is replaced """
+        if self.saved_buffer is not self.keyboard.macro:
+            self.saved_buffer = self.keyboard.macro
+            self.saved_split = self.keyboard.macro.split(b"\x00")
+        return self.saved_split
+
     def update_tab_titles(self):
-        macros = self.keyboard.macro.split(b"\x00")
+        macros = self.saved_macros()
+        dirty = False
         for x, w in enumerate(self.macro_tab_w[:self.keyboard.macro_count]):
             title = "M{}".format(x)
-            if macros[x] != self.keyboard.macro_serialize(self.macro_tabs[x].actions()):
+            if macros[x] != self.macro_tabs[x].serialize():
                 title += "*"
+                dirty = True
             self.tabs.setTabText(x, title)
+        return dirty
 
     def on_record(self, tab, append):
         self.recording_tab = tab
@@ -148,18 +161,16 @@ class MacroRecorder(BasicEditor):
         if self.suppress_change:
             return
 
-        data = self.serialize()
-        memory = len(data)
+        tabs = self.macro_tabs[:self.keyboard.macro_count]
+        # every macro is followed by a NUL
+        memory = sum(len(t.serialize()) + 1 for t in tabs)
         self.lbl_memory.setText("Memory used by macros: {}/{}".format(memory, self.keyboard.macro_memory))
-        self.btn_save.setEnabled(data != self.keyboard.macro and memory <= self.keyboard.macro_memory)
         self.lbl_memory.setStyleSheet("QLabel { color: red; }" if memory > self.keyboard.macro_memory else "")
-        self.update_tab_titles()
+        dirty = self.update_tab_titles()
+        self.btn_save.setEnabled(dirty and memory <= self.keyboard.macro_memory)
 
     def serialize(self):
-        macros = []
-        for x, t in enumerate(self.macro_tabs[:self.keyboard.macro_count]):
-            macros.append(t.actions())
-        return self.keyboard.macros_serialize(macros)
+        return b"".join(t.serialize() + b"\x00" for t in self.macro_tabs[:self.keyboard.macro_count])
 
     def deserialize(self, data):
         self.suppress_change = True
@@ -177,5 +188,6 @@ class MacroRecorder(BasicEditor):
 
     def on_save(self):
         Unlocker.unlock(self.device.keyboard)
-        self.keyboard.set_macro(self.serialize())
+        written = self.keyboard.set_macro(self.serialize())
+        logging.info("Saved macros, {} bytes written".format(written))
         self.on_change()
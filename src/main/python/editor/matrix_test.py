@@ -21,6 +21,7 @@ class MatrixTest(BasicEditor):
 
         self.keyboardWidget = KeyboardWidget(layout_editor)
         self.keyboardWidget.set_enabled(False)
+        layout_editor.changed.connect(self.keyboardWidget.update_layout)
 
         self.unlock_btn = QPushButton("Unlock")
         self.reset_btn = QPushButton("Reset")
@@ -127,20 +128,22 @@ class MatrixTest(BasicEditor):
                 # write to matrix array
                 matrix[row][col] = (row_data[col_byte] >> col_mod) & 1
 
-        # write matrix state to keyboard widget
+        # write matrix state to keyboard widget, only repainting keys which changed
+        changed = []
         for w in self.keyboardWidget.widgets:
             if w.desc.row is not None and w.desc.col is not None:
                 row = w.desc.row
                 col = w.desc.col
 
                 if row < len(matrix) and col < len(matrix[row]):
-                    w.setPressed(matrix[row][col])
-                    if matrix[row][col]:
+                    pressed = bool(matrix[row][col])
+                    if w.pressed != pressed or (pressed and not w.on):
+                        changed.append(w)
+                    w.setPressed(pressed)
+                    if pressed:
                         w.setOn(True)
 
-        self.keyboardWidget.update_layout()
-        self.keyboardWidget.update()
-        self.keyboardWidget.updateGeometry()
+        self.keyboardWidget.update_keys(changed)
 
     def unlock(self):
         Unlocker.unlock(self.keyboard)
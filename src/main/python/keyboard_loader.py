@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import sys
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal, Qt
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class KeyboardLoader(QObject):
+    """
+        Opens a device and loads its state on a worker thread
+
+        Progress and every completed stage of Keyboard.reload are reported through signals, which are delivered
+        on the GUI thread. Exactly one of loaded, failed or cancelled is emitted at the end. The loader must be
+        created on the GUI thread, steps which replace state the GUI reads are run there through run_on_gui.
+    """
+
+    progress = pyqtSignal(int, int)
+    stage_loaded = pyqtSignal(str)
+    loaded = pyqtSignal()
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    # (fn, errors) for run_on_gui, delivered on the GUI thread while the worker waits
+    gui_call = pyqtSignal(object)
+
+    def __init__(self, device, override_json=None):
+        super().__init__()
+
+        self.device = device
+        self.override_json = override_json
+        self.cancel_requested = False
+        self.thread = None
+
+        self.gui_call.connect(self.on_gui_call, Qt.BlockingQueuedConnection)
+
+    def start(self):
+        # there are no threads in the browser, load synchronously
+        if sys.platform == "emscripten":
+            self.run()
+            return
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """ Asks the loader to stop after the current step, cancelled is emitted once it has """
+        self.cancel_requested = True
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def on_progress(self, done, total, stage):
+        if self.cancel_requested:
+            raise LoadCancelled()
+        self.progress.emit(done, total)
+        if stage is not None:
+            self.stage_loaded.emit(stage)
+
+    def run_on_gui(self, fn):
+        """ Runs fn on the GUI thread and waits for it to finish, exceptions are raised again on the worker """
+
+        if self.thread is None or threading.current_thread() is not self.thread:
+            fn()
+            return
+        errors = []
+        self.gui_call.emit((fn, errors))
+        if errors:
+            raise errors[0]
+
+    def on_gui_call(self, call):
+        fn, errors = call
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+
+    def run(self):
+        try:
+            self.device.open(self.override_json, progress=self.on_progress, run_on_gui=self.run_on_gui)
+        except LoadCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(e)
+        else:
+            self.loaded.emit()
@@ -3,9 +3,17 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import sys
+from collections import OrderedDict
 
-from keycodes.keycodes_v5 import keycodes_v5
-from keycodes.keycodes_v6 import keycodes_v6
+
+def protocol_keycodes(protocol):
+    """ Returns keycodes_v6 or keycodes_v5 depending on the protocol, only the one in use gets imported """
+
+    if protocol == 6:
+        from keycodes.keycodes_v6 import keycodes_v6
+        return keycodes_v6
+    from keycodes.keycodes_v5 import keycodes_v5
+    return keycodes_v5
 
 
 class Keycode:
@@ -13,6 +21,9 @@ class Keycode:
     masked_keycodes = set()
     recorder_alias_to_keycode = dict()
     qmk_id_to_keycode = dict()
+    codecs = dict()
+    # bumped every time the keycodes are regenerated, tables derived from them are rebuilt when it changes
+    generation = 0
     protocol = 0
     hidden = False
 
@@ -104,42 +115,30 @@ class Keycode:
             tooltip = "{}: {}".format(tooltip, keycode.tooltip)
         return tooltip
 
+    @classmethod
+    def codec(cls):
+        """ Returns the KeycodeCodec for the current protocol, built on first use after the keycodes were regenerated """
+        codec = Keycode.codecs.get(cls.protocol)
+        if codec is None:
+            codec = Keycode.codecs[cls.protocol] = KeycodeCodec(cls.protocol)
+        return codec
+
+    @classmethod
+    def invalidate_codecs(cls):
+        Keycode.codecs.clear()
+
     @classmethod
     def serialize(cls, code):
         """ Converts integer keycode to string """
-        if cls.protocol == 6:
-            masked = keycodes_v6.masked
-        else:
-            masked = keycodes_v5.masked
-
-        if (code & 0xFF00) not in masked:
-            kc = RAWCODES_MAP.get(code)
-            if kc is not None:
-                return kc.qmk_id
-        else:
-            outer = RAWCODES_MAP.get(code & 0xFF00)
-            inner = RAWCODES_MAP.get(code & 0x00FF)
-            if outer is not None and inner is not None:
-                return outer.qmk_id.replace("kc", inner.qmk_id)
-        return hex(code)
+        return cls.codec().serialize(code)
 
     @classmethod
     def deserialize(cls, val, reraise=False):
         """ Converts string keycode to integer """
 
-        from any_keycode import AnyKeycode
-
         if isinstance(val, int):
             return val
-        if val in cls.qmk_id_to_keycode:
-            return cls.resolve(cls.qmk_id_to_keycode[val].qmk_id)
-        anykc = AnyKeycode()
-        try:
-            return anykc.decode(val)
-        except Exception:
-            if reraise:
-                raise
-        return 0
+        return cls.codec().deserialize(val, reraise)
 
     @classmethod
     def normalize(cls, code):
@@ -150,11 +149,7 @@ class Keycode:
     @classmethod
     def resolve(cls, qmk_constant):
         """ Translates a qmk_constant into firmware-specific integer keycode or macro constant """
-        if cls.protocol == 6:
-            kc = keycodes_v6.kc
-        else:
-            kc = keycodes_v5.kc
-
+        kc = cls.codec().kc
         if qmk_constant not in kc:
             raise RuntimeError("unable to resolve qmk_id={}".format(qmk_constant))
         return kc[qmk_constant]
@@ -166,6 +161,72 @@ class Keycode:
       return self.requires_feature in keyboard.supported_features
 
 
+class KeycodeCodec:
+
+    """
+        Converts keycodes between integers and strings for one protocol
+
+        Serialized names are kept in a table indexed by the 16-bit keycode, deserialized strings in dicts; the
+        values of expressions AnyKeycode had to evaluate are only remembered up to MAX_EXPRESSIONS at a time. A codec is
+        only valid until the keycodes are regenerated, recreate_keycodes drops it through Keycode.invalidate_codecs.
+    """
+
+    MAX_EXPRESSIONS = 4096
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        keycodes = protocol_keycodes(protocol)
+        self.kc = keycodes.kc
+        self.masked = keycodes.masked
+        self.names = [None] * 0x10000
+        self.qmk_ids = dict()
+        self.expressions = dict()
+
+    def serialize(self, code):
+        if not 0 <= code <= 0xFFFF:
+            return self.name(code)
+        name = self.names[code]
+        if name is None:
+            name = self.names[code] = self.name(code)
+        return name
+
+    def name(self, code):
+        if (code & 0xFF00) not in self.masked:
+            kc = RAWCODES_MAP.get(code)
+            if kc is not None:
+                return kc.qmk_id
+        else:
+            outer = RAWCODES_MAP.get(code & 0xFF00)
+            inner = RAWCODES_MAP.get(code & 0x00FF)
+            if outer is not None and inner is not None:
+                return outer.qmk_id.replace("kc", inner.qmk_id)
+        return hex(code)
+
+    def deserialize(self, val, reraise=False):
+        code = self.qmk_ids.get(val)
+        if code is not None:
+            return code
+        keycode = Keycode.qmk_id_to_keycode.get(val)
+        if keycode is not None:
+            code = self.qmk_ids[val] = Keycode.resolve(keycode.qmk_id)
+            return code
+
+        code = self.expressions.get(val)
+        if code is not None:
+            return code
+        from any_keycode import AnyKeycode
+        try:
+            code = AnyKeycode.shared().decode(val)
+        except Exception:
+            if reraise:
+                raise
+            return 0
+        if len(self.expressions) >= self.MAX_EXPRESSIONS:
+            self.expressions.clear()
+        self.expressions[val] = code
+        return code
+
+
 K = Keycode
 
 KEYCODES_SPECIAL = [
@@ -794,6 +855,9 @@ KEYCODES_HIDDEN = []
 for x in range(256):
     KEYCODES_HIDDEN.append(K("TD({})".format(x), "TD({})".format(x)))
 
+# qmk_ids of the keycodes which exist regardless of the keyboard, generated ones are registered on top of these
+STATIC_QMK_IDS = dict(Keycode.qmk_id_to_keycode)
+
 KEYCODES = []
 KEYCODES_MAP = dict()
 RAWCODES_MAP = dict()
@@ -804,6 +868,9 @@ K = None
 def recreate_keycodes():
     """ Regenerates global KEYCODES array """
 
+    Keycode.generation += 1
+    Keycode.invalidate_codecs()
+    register_generated_keycodes()
     KEYCODES.clear()
     KEYCODES.extend(KEYCODES_SPECIAL + KEYCODES_BASIC + KEYCODES_SHIFTED + KEYCODES_ISO + KEYCODES_LAYERS +
                     KEYCODES_BOOT + KEYCODES_MODIFIERS + KEYCODES_QUANTUM + KEYCODES_BACKLIGHT + KEYCODES_MEDIA +
@@ -815,6 +882,16 @@ def recreate_keycodes():
         RAWCODES_MAP[Keycode.deserialize(keycode.qmk_id)] = keycode
 
 
+def register_generated_keycodes():
+    """ Makes qmk_id_to_keycode hold the static keycodes and only those generated for the current keyboard """
+
+    Keycode.qmk_id_to_keycode.clear()
+    Keycode.qmk_id_to_keycode.update(STATIC_QMK_IDS)
+    for keycodes in KEYCODES_GENERATED:
+        for keycode in keycodes:
+            Keycode.qmk_id_to_keycode[keycode.qmk_id] = keycode
+
+
 def create_user_keycodes():
     KEYCODES_USER.clear()
     for x in range(16):
@@ -850,11 +927,87 @@ def create_midi_keycodes(midiSettingLevel):
         KEYCODES_MIDI.extend(KEYCODES_MIDI_ADVANCED)
 
 
+class KeycodeTables:
+
+    """ Keycodes generated for one keyboard configuration, along with the lookup tables built from them """
+
+    def __init__(self):
+        self.generated = tuple(tuple(keycodes) for keycodes in KEYCODES_GENERATED)
+        self.keycodes = tuple(KEYCODES)
+        self.keycodes_map = dict(KEYCODES_MAP)
+        self.rawcodes_map = dict(RAWCODES_MAP)
+
+    def install(self):
+        """ Makes these tables current again, e.g. after another keyboard was connected in between """
+
+        Keycode.generation += 1
+        Keycode.invalidate_codecs()
+        for target, keycodes in zip(KEYCODES_GENERATED, self.generated):
+            target[:] = keycodes
+        # another keyboard may have generated keycodes under the same qmk_id since
+        register_generated_keycodes()
+        KEYCODES[:] = self.keycodes
+        KEYCODES_MAP.clear()
+        KEYCODES_MAP.update(self.keycodes_map)
+        RAWCODES_MAP.clear()
+        RAWCODES_MAP.update(self.rawcodes_map)
+
+
+class KeycodeRegistry:
+
+    """ Remembers the KeycodeTables of the last MAX_ENTRIES keyboard configurations """
+
+    MAX_ENTRIES = 16
+
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def configuration(keyboard):
+        custom_keycodes = tuple((c.get("name"), c.get("shortName"), c.get("title"))
+                                for c in keyboard.custom_keycodes or [])
+        return (keyboard.vial_protocol, keyboard.layers, keyboard.macro_count, keyboard.tap_dance_count,
+                custom_keycodes, keyboard.midi)
+
+    def get(self, configuration):
+        tables = self.entries.get(configuration)
+        if tables is not None:
+            self.entries.move_to_end(configuration)
+        return tables
+
+    def put(self, configuration, tables):
+        self.entries[configuration] = tables
+        while len(self.entries) > self.MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+
+# lists recreate_keyboard_keycodes fills in, in the order KeycodeTables stores them
+KEYCODES_GENERATED = [KEYCODES_LAYERS, KEYCODES_MACRO, KEYCODES_TAP_DANCE, KEYCODES_USER, KEYCODES_MIDI]
+KEYCODE_REGISTRY = KeycodeRegistry()
+
+
 def recreate_keyboard_keycodes(keyboard):
-    """ Generates keycodes based on information the keyboard provides (e.g. layer keycodes, macros) """
+    """ Sets up keycodes based on information the keyboard provides, reusing them for a known configuration """
 
     Keycode.protocol = keyboard.vial_protocol
 
+    configuration = KeycodeRegistry.configuration(keyboard)
+    tables = KEYCODE_REGISTRY.get(configuration)
+    if tables is None:
+        generate_keyboard_keycodes(keyboard)
+        recreate_keycodes()
+        KEYCODE_REGISTRY.put(configuration, KeycodeTables())
+    else:
+        tables.install()
+
+    # Hide keycodes where .requires_feature isn't supported by the keyboard.
+    for kc in KEYCODES:
+        kc.hidden = not kc.is_supported_by(keyboard)
+
+
+def generate_keyboard_keycodes(keyboard):
+    """ Generates keycodes based on information the keyboard provides (e.g. layer keycodes, macros) """
+
     layers = keyboard.layers
 
     def generate_keycodes_for_mask(label, description, requires_feature=None):
@@ -920,11 +1073,5 @@ def recreate_keyboard_keycodes(keyboard):
 
     create_midi_keycodes(keyboard.midi)
 
-    recreate_keycodes()
-
-    # Hide keycodes where .requires_feature isn't supported by the keyboard.
-    for kc in KEYCODES:
-        kc.hidden = not kc.is_supported_by(keyboard)
-
 
 recreate_keycodes()
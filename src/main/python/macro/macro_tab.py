@@ -27,6 +27,9 @@ class MacroTab(QVBoxLayout):
         self.parent = parent
 
         self.lines = []
+        # serialized actions, dropped whenever they change; connected first so no one else sees a stale one
+        self.serialized = None
+        self.changed.connect(self.invalidate)
 
         self.container = QGridLayout()
 
@@ -172,3 +175,11 @@ class MacroTab(QVBoxLayout):
 
     def actions(self):
         return [line.action.act for line in self.lines]
+
+    def invalidate(self):
+        self.serialized = None
+
+    def serialize(self):
+        if self.serialized is None:
+            self.serialized = self.parent.keyboard.macro_serialize(self.actions())
+        return self.serialized
@@ -3,9 +3,9 @@ import logging
 import platform
 from json import JSONDecodeError
 
-from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QTimer, QRect, QT_VERSION_STR
+from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QTimer, QRect, QT_VERSION_STR, QCoreApplication
 from PyQt5.QtWidgets import QWidget, QComboBox, QToolButton, QHBoxLayout, QVBoxLayout, QMainWindow, QAction, qApp, \
-    QFileDialog, QDialog, QTabWidget, QActionGroup, QMessageBox, QLabel
+    QFileDialog, QDialog, QTabWidget, QActionGroup, QMessageBox, QLabel, QProgressBar
 
 import os
 import sys
@@ -18,15 +18,19 @@ from constants import WINDOW_WIDTH, WINDOW_HEIGHT
 from widgets.editor_container import EditorContainer
 from editor.firmware_flasher import FirmwareFlasher
 from editor.key_override import KeyOverride
-from protocol.keyboard_comm import ProtocolError
+from keyboard_loader import KeyboardLoader
+from protocol.definition_cache import DefinitionCache
+from protocol.keyboard_comm import ProtocolError, RELOAD_STAGES, STAGE_LAYOUT, STAGE_KEYMAP, STAGE_MACROS, \
+    STAGE_DYNAMIC, STAGE_HALL_EFFECT
 from editor.keymap_editor import KeymapEditor
-from keymaps import KEYMAPS
+from keymaps import KEYMAPS, load_keymap
 from editor.layout_editor import LayoutEditor
 from editor.macro_recorder import MacroRecorder
 from editor.qmk_settings import QmkSettings
 from editor.rgb_configurator import RGBConfigurator
 from tabbed_keycodes import TabbedKeycodes
 from editor.tap_dance import TapDance
+from telemetry_dialog import TelemetryDialog
 from unlocker import Unlocker
 from util import tr, EXAMPLE_KEYBOARDS, KeycodeDisplay, EXAMPLE_KEYBOARD_PREFIX
 from vial_device import VialKeyboard
@@ -42,6 +46,11 @@ class MainWindow(QMainWindow):
         self.appctx = appctx
 
         self.ui_lock_count = 0
+        self.device_lock_count = 0
+
+        # loads the selected device in the background, None when idle
+        self.loader = None
+        self.loaded_stages = set()
 
         self.settings = QSettings("Vial", "Vial")
         if self.settings.value("size", None):
@@ -73,6 +82,19 @@ class MainWindow(QMainWindow):
         if sys.platform != "emscripten":
             layout_combobox.addWidget(self.btn_refresh_devices)
 
+        self.progress_loading = QProgressBar()
+        self.progress_loading.setTextVisible(False)
+        self.progress_loading.hide()
+        self.btn_cancel_loading = QToolButton()
+        self.btn_cancel_loading.setToolButtonStyle(Qt.ToolButtonTextOnly)
+        self.btn_cancel_loading.setText(tr("MainWindow", "Cancel"))
+        self.btn_cancel_loading.clicked.connect(self.on_cancel_loading)
+        self.btn_cancel_loading.hide()
+
+        layout_loading = QHBoxLayout()
+        layout_loading.addWidget(self.progress_loading)
+        layout_loading.addWidget(self.btn_cancel_loading)
+
         self.layout_editor = LayoutEditor()
         self.keymap_editor = KeymapEditor(self.layout_editor)
         self.firmware_flasher = FirmwareFlasher(self)
@@ -93,6 +115,15 @@ class MainWindow(QMainWindow):
                         (self.qmk_settings, "QMK Settings"), (self.matrix_tester, "Matrix tester"),
                         (self.firmware_flasher, "Firmware updater"), (self.hall_effect, "Hall Effect")]
 
+        # stage of the keyboard reload after which each editor has everything it needs, in the order of rebuilding
+        # the chosen layout options are only read along with the keymap, so whatever places keys waits for it
+        self.editor_stages = [(self.layout_editor, STAGE_KEYMAP), (self.keymap_editor, STAGE_KEYMAP),
+                              (self.firmware_flasher, STAGE_LAYOUT), (self.macro_recorder, STAGE_MACROS),
+                              (self.tap_dance, STAGE_DYNAMIC), (self.combos, STAGE_DYNAMIC),
+                              (self.key_override, STAGE_DYNAMIC), (self.alt_repeat_key, STAGE_DYNAMIC),
+                              (self.qmk_settings, STAGE_LAYOUT), (self.matrix_tester, STAGE_KEYMAP),
+                              (self.rgb_configurator, STAGE_LAYOUT), (self.hall_effect, STAGE_HALL_EFFECT)]
+
         Unlocker.global_layout_editor = self.layout_editor
         Unlocker.global_main_window = self
 
@@ -113,6 +144,7 @@ class MainWindow(QMainWindow):
 
         layout = QVBoxLayout()
         layout.addLayout(layout_combobox)
+        layout.addLayout(layout_loading)
         layout.addWidget(self.tabs, 1)
         layout.addWidget(self.lbl_no_devices)
         layout.setAlignment(self.lbl_no_devices, Qt.AlignHCenter)
@@ -133,6 +165,7 @@ class MainWindow(QMainWindow):
         self.cache_path = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
         if not os.path.exists(self.cache_path):
             os.makedirs(self.cache_path)
+        VialKeyboard.definition_cache = DefinitionCache(os.path.join(self.cache_path, "definitions"))
 
         # check if the via defitions already exist
         if os.path.isfile(os.path.join(self.cache_path, "via_keyboards.json")):
@@ -152,13 +185,13 @@ class MainWindow(QMainWindow):
             QTimer.singleShot(100, vialglue.notify_ready)
 
     def init_menu(self):
-        layout_load_act = QAction(tr("MenuFile", "Load saved layout..."), self)
-        layout_load_act.setShortcut("Ctrl+O")
-        layout_load_act.triggered.connect(self.on_layout_load)
+        self.layout_load_act = QAction(tr("MenuFile", "Load saved layout..."), self)
+        self.layout_load_act.setShortcut("Ctrl+O")
+        self.layout_load_act.triggered.connect(self.on_layout_load)
 
-        layout_save_act = QAction(tr("MenuFile", "Save current layout..."), self)
-        layout_save_act.setShortcut("Ctrl+S")
-        layout_save_act.triggered.connect(self.on_layout_save)
+        self.layout_save_act = QAction(tr("MenuFile", "Save current layout..."), self)
+        self.layout_save_act.setShortcut("Ctrl+S")
+        self.layout_save_act.triggered.connect(self.on_layout_save)
 
         sideload_json_act = QAction(tr("MenuFile", "Sideload VIA JSON..."), self)
         sideload_json_act.triggered.connect(self.on_sideload_json)
@@ -174,8 +207,8 @@ class MainWindow(QMainWindow):
         exit_act.triggered.connect(self.close)
 
         file_menu = self.menuBar().addMenu(tr("Menu", "File"))
-        file_menu.addAction(layout_load_act)
-        file_menu.addAction(layout_save_act)
+        file_menu.addAction(self.layout_load_act)
+        file_menu.addAction(self.layout_save_act)
 
         if sys.platform != "emscripten":
             file_menu.addSeparator()
@@ -213,6 +246,10 @@ class MainWindow(QMainWindow):
         if keymap_group.checkedAction() is None:
             keymap_group.actions()[0].setChecked(True)
 
+        # actions which talk to the keyboard, see restore_layout
+        self.keyboard_actions = [self.layout_load_act, self.layout_save_act, sideload_json_act, download_via_stack_act,
+                                 load_dummy_act, keyboard_unlock_act, keyboard_lock_act, keyboard_reset_act]
+
         self.security_menu = self.menuBar().addMenu(tr("Menu", "Security"))
         self.security_menu.addAction(keyboard_unlock_act)
         self.security_menu.addAction(keyboard_lock_act)
@@ -238,8 +275,11 @@ class MainWindow(QMainWindow):
         about_vial_act.triggered.connect(self.about_vial)
         self.about_keyboard_act = QAction("", self)
         self.about_keyboard_act.triggered.connect(self.about_keyboard)
+        self.hid_statistics_act = QAction(tr("MenuAbout", "HID statistics..."), self)
+        self.hid_statistics_act.triggered.connect(self.hid_statistics)
         self.about_menu = self.menuBar().addMenu(tr("Menu", "About"))
         self.about_menu.addAction(self.about_keyboard_act)
+        self.about_menu.addAction(self.hid_statistics_act)
         self.about_menu.addAction(about_vial_act)
 
     def on_layout_loaded(self, layout):
@@ -247,8 +287,7 @@ class MainWindow(QMainWindow):
         Receives a message from the JS bridge when a layout has
         been loaded via the JS File System API.
         """
-        self.keymap_editor.restore_layout(layout)
-        self.rebuild()
+        self.restore_layout(layout)
 
     def on_layout_load(self):
         if sys.platform == "emscripten":
@@ -264,8 +303,36 @@ class MainWindow(QMainWindow):
             if dialog.exec_() == QDialog.Accepted:
                 with open(dialog.selectedFiles()[0], "rb") as inf:
                     data = inf.read()
-                self.keymap_editor.restore_layout(data)
-                self.rebuild()
+                self.restore_layout(data)
+
+    def restore_layout(self, data):
+        # events are handled between the batches of the restore, so nothing else may start talking to the
+        # keyboard meanwhile: the current editor stops polling and the actions which send requests are disabled
+        editor = self.current_tab.editor if self.current_tab is not None else None
+        if editor is not None:
+            editor.deactivate()
+        actions = [(act, act.isEnabled()) for act in self.keyboard_actions]
+        for act, enabled in actions:
+            act.setEnabled(False)
+
+        self.progress_loading.setValue(0)
+        self.progress_loading.show()
+        self.lock_ui()
+        try:
+            self.keymap_editor.restore_layout(data, progress=self.on_restore_progress)
+        finally:
+            self.unlock_ui()
+            self.progress_loading.hide()
+            for act, enabled in actions:
+                act.setEnabled(enabled)
+        self.rebuild()
+        if editor is not None:
+            editor.activate()
+
+    def on_restore_progress(self, done, total, section):
+        # only called between batches, when no request is in flight
+        self.on_loading_progress(done, total)
+        QCoreApplication.processEvents()
 
     def on_layout_save(self):
         if sys.platform == "emscripten":
@@ -308,39 +375,118 @@ class MainWindow(QMainWindow):
             self.on_device_selected()
 
     def on_device_selected(self):
-        try:
-            self.autorefresh.select_device(self.combobox_devices.currentIndex())
-        except ProtocolError:
-            QMessageBox.warning(self, "", "Unsupported protocol version!\n"
-                                          "Please download latest Vial from https://get.vial.today/")
+        if self.loader is not None:
+            return
 
-        if isinstance(self.autorefresh.current_device, VialKeyboard):
-            keyboard_id = self.autorefresh.current_device.keyboard.keyboard_id
+        self.autorefresh.set_current_device(self.combobox_devices.currentIndex())
+        self.loaded_stages = set()
+        self.rebuild()
+        self.refresh_tabs()
+
+        if self.autorefresh.current_device is None:
+            return
+
+        self.loader = KeyboardLoader(self.autorefresh.current_device, self.autorefresh.override_json())
+        self.loader.progress.connect(self.on_loading_progress)
+        self.loader.stage_loaded.connect(self.on_stage_loaded)
+        self.loader.loaded.connect(self.on_loaded)
+        self.loader.failed.connect(self.on_loading_failed)
+        self.loader.cancelled.connect(self.on_loading_cancelled)
+        self.set_loading(True)
+        self.loader.start()
+
+    def set_loading(self, loading):
+        self.progress_loading.setValue(0)
+        self.progress_loading.setVisible(loading)
+        self.btn_cancel_loading.setEnabled(True)
+        self.btn_cancel_loading.setVisible(loading)
+        self.layout_load_act.setEnabled(not loading)
+        self.layout_save_act.setEnabled(not loading)
+        if loading:
+            self.lock_device_selection()
+        else:
+            self.unlock_device_selection()
+
+    def on_loading_progress(self, done, total):
+        self.progress_loading.setRange(0, total)
+        self.progress_loading.setValue(done)
+
+    def on_stage_loaded(self, stage):
+        self.loaded_stages.add(stage)
+        self.rebuild_editors([stage])
+        self.add_ready_tabs()
+
+    def on_loaded(self):
+        self.loader = None
+        self.set_loading(False)
+
+        # a device which doesn't go through the staged reload, e.g. the bootloader, is ready all at once
+        pending = [stage for stage in RELOAD_STAGES if stage not in self.loaded_stages]
+        self.loaded_stages = set(RELOAD_STAGES)
+        self.rebuild_menus()
+
+        device = self.autorefresh.current_device
+        if isinstance(device, VialKeyboard):
+            # if unlock process was interrupted, we must finish it first
+            if device.keyboard.get_unlock_in_progress():
+                Unlocker.unlock(device.keyboard)
+                device.keyboard.reload()
+                pending = RELOAD_STAGES
+
+            keyboard_id = device.keyboard.keyboard_id
             if (keyboard_id in EXAMPLE_KEYBOARDS) or ((keyboard_id & 0xFFFFFFFFFFFFFF) == EXAMPLE_KEYBOARD_PREFIX):
                 QMessageBox.warning(self, "", "An example keyboard UID was detected.\n"
                                               "Please change your keyboard UID to be unique before you ship!")
 
+        self.rebuild_editors(pending)
+        self.add_ready_tabs()
+
+    def on_loading_failed(self, e):
+        self.on_loading_cancelled()
+        if isinstance(e, ProtocolError):
+            QMessageBox.warning(self, "", "Unsupported protocol version!\n"
+                                          "Please download latest Vial from https://get.vial.today/")
+        else:
+            logging.exception("Failed to load the device", exc_info=e)
+            QMessageBox.warning(self, "", tr("MainWindow", "Failed to load the device: {}").format(e))
+
+    def on_loading_cancelled(self):
+        self.loader = None
+        self.set_loading(False)
+        # a half-loaded keyboard can't be edited safely, deselect it; "Refresh" starts over
+        self.autorefresh.set_current_device(-1)
+        self.loaded_stages = set()
         self.rebuild()
         self.refresh_tabs()
 
+    def on_cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.btn_cancel_loading.setEnabled(False)
+
     def rebuild(self):
+        self.rebuild_menus()
+        self.rebuild_editors(RELOAD_STAGES)
+
+    def rebuild_menus(self):
+        device = self.autorefresh.current_device
+        loaded = isinstance(device, VialKeyboard) and self.loaded_stages.issuperset(RELOAD_STAGES)
+
         # don't show "Security" menu for bootloader mode, as the bootloader is inherently insecure
-        self.security_menu.menuAction().setVisible(isinstance(self.autorefresh.current_device, VialKeyboard))
+        self.security_menu.menuAction().setVisible(loaded)
 
         self.about_keyboard_act.setVisible(False)
-        if isinstance(self.autorefresh.current_device, VialKeyboard):
-            self.about_keyboard_act.setText("About {}...".format(self.autorefresh.current_device.title()))
+        self.hid_statistics_act.setVisible(False)
+        if loaded:
+            self.about_keyboard_act.setText("About {}...".format(device.title()))
             self.about_keyboard_act.setVisible(True)
+            self.hid_statistics_act.setVisible(True)
 
-        # if unlock process was interrupted, we must finish it first
-        if isinstance(self.autorefresh.current_device, VialKeyboard) and self.autorefresh.current_device.keyboard.get_unlock_in_progress():
-            Unlocker.unlock(self.autorefresh.current_device.keyboard)
-            self.autorefresh.current_device.keyboard.reload()
-
-        for e in [self.layout_editor, self.keymap_editor, self.firmware_flasher, self.macro_recorder,
-                  self.tap_dance, self.combos, self.key_override, self.alt_repeat_key,
-                  self.qmk_settings, self.matrix_tester, self.rgb_configurator, self.hall_effect]:
-            e.rebuild(self.autorefresh.current_device)
+    def rebuild_editors(self, stages):
+        """ Rebuilds editors depending on the given stages, those whose stage isn't loaded yet are cleared """
+        for e, stage in self.editor_stages:
+            if stage in stages:
+                e.rebuild(self.autorefresh.current_device if stage in self.loaded_stages else None)
 
     def refresh_tabs(self):
         self.tabs.clear()
@@ -351,6 +497,24 @@ class MainWindow(QMainWindow):
             c = EditorContainer(container)
             self.tabs.addTab(c, tr("MainWindow", lbl))
 
+    def add_ready_tabs(self):
+        """ Adds tabs for editors which became valid since the last refresh, leaving the others alone """
+        shown = [self.tabs.widget(x).editor for x in range(self.tabs.count())]
+        idx = 0
+        for container, lbl in self.editors:
+            if container in shown:
+                idx += 1
+                continue
+            if not container.valid():
+                continue
+
+            # the first tab stays selected unless the user has switched to another one
+            select = idx == 0 and self.tabs.currentIndex() == 0
+            self.tabs.insertTab(idx, EditorContainer(container), tr("MainWindow", lbl))
+            if select:
+                self.tabs.setCurrentIndex(0)
+            idx += 1
+
     def load_via_stack_json(self):
         from urllib.request import urlopen
 
@@ -384,16 +548,26 @@ class MainWindow(QMainWindow):
     def lock_ui(self):
         self.ui_lock_count += 1
         if self.ui_lock_count == 1:
-            self.autorefresh._lock()
             self.tabs.setEnabled(False)
-            self.combobox_devices.setEnabled(False)
-            self.btn_refresh_devices.setEnabled(False)
+        self.lock_device_selection()
 
     def unlock_ui(self):
         self.ui_lock_count -= 1
         if self.ui_lock_count == 0:
-            self.autorefresh._unlock()
             self.tabs.setEnabled(True)
+        self.unlock_device_selection()
+
+    def lock_device_selection(self):
+        self.device_lock_count += 1
+        if self.device_lock_count == 1:
+            self.autorefresh._lock()
+            self.combobox_devices.setEnabled(False)
+            self.btn_refresh_devices.setEnabled(False)
+
+    def unlock_device_selection(self):
+        self.device_lock_count -= 1
+        if self.device_lock_count == 0:
+            self.autorefresh._unlock()
             self.combobox_devices.setEnabled(True)
             self.btn_refresh_devices.setEnabled(True)
 
@@ -412,7 +586,7 @@ class MainWindow(QMainWindow):
 
     def change_keyboard_layout(self, index):
         self.settings.setValue("keymap", KEYMAPS[index][0])
-        KeycodeDisplay.set_keymap_override(KEYMAPS[index][1])
+        KeycodeDisplay.set_keymap_override(load_keymap(index))
 
     def get_theme(self):
         return self.settings.value("theme", "Dark")
@@ -460,7 +634,14 @@ class MainWindow(QMainWindow):
         self.about_dialog.setModal(True)
         self.about_dialog.show()
 
+    def hid_statistics(self):
+        self.telemetry_dialog = TelemetryDialog(self.autorefresh.current_device)
+        self.telemetry_dialog.show()
+
     def closeEvent(self, e):
+        if self.loader is not None:
+            self.loader.cancel()
+
         self.settings.setValue("size", self.size())
         self.settings.setValue("pos", self.pos())
         self.settings.setValue("maximized", self.isMaximized())
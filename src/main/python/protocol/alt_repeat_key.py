@@ -92,9 +92,13 @@ class ProtocolAltRepeatKey(BaseProtocol):
     def save_alt_repeat_key(self):
         return [e.save() for e in self.alt_repeat_key_entries]
 
-    def restore_alt_repeat_key(self, data):
-        for x, e in enumerate(data):
-            if x < self.alt_repeat_key_count:
-                ko = AltRepeatKeyEntry()
-                ko.restore(e)
-                self.alt_repeat_key_set(x, ko)
+    def plan_restore_alt_repeat_key(self, data):
+        entries = []
+        for e in data:
+            ark = AltRepeatKeyEntry()
+            ark.restore(e)
+            entries.append(ark)
+        return self._plan_dynamic_entries(
+            "alt_repeat_key", DYNAMIC_VIAL_ALT_REPEAT_KEY_SET, self.alt_repeat_key_entries, entries,
+            AltRepeatKeyEntry.serialize, lambda e: RESET_KEYCODE in [e.keycode, e.alt_keycode]
+        )
@@ -2,11 +2,13 @@
 import struct
 
 from protocol.constants import CMD_VIA_VIAL_PREFIX, CMD_VIAL_DYNAMIC_ENTRY_OP
+from protocol.restore_plan import RestoreSection
 
 
 class BaseProtocol:
     vial_protocol = None
     usb_send = NotImplemented
+    transport = None
     dev = None
 
     macro_count = 0
@@ -15,13 +17,36 @@ class BaseProtocol:
 
     def _retrieve_dynamic_entries(self, cmd, count, fmt):
         out = []
-        for x in range(count):
-            data = self.usb_send(
-                self.dev,
-                struct.pack("BBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_DYNAMIC_ENTRY_OP, cmd, x),
-                retries=20
-            )
+        responses = self.transport.send_many(
+            self.dev,
+            [struct.pack("BBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_DYNAMIC_ENTRY_OP, cmd, x) for x in range(count)],
+            retries=20
+        )
+        for x, data in enumerate(responses):
             if data[0] != 0:
                 raise RuntimeError("failed retrieving dynamic={} entry {} from the device".format(cmd, x))
             out.append(struct.unpack(fmt, data[1:1 + struct.calcsize(fmt)]))
         return out
+
+    @staticmethod
+    def _plan_dynamic_entries(name, cmd, entries, saved, serialize, needs_unlock):
+        """
+            Plans writing the saved dynamic entries which differ from entries, compared in their wire format
+
+            needs_unlock(entry) tells whether the firmware only accepts the entry while unlocked.
+        """
+
+        changed = [(idx, entry) for idx, entry in enumerate(saved[:len(entries)])
+                   if serialize(entry) != serialize(entries[idx])]
+
+        def apply(responses):
+            for idx, entry in changed:
+                entries[idx] = entry
+
+        return RestoreSection(
+            name,
+            [struct.pack("BBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_DYNAMIC_ENTRY_OP, cmd, idx) + serialize(entry)
+             for idx, entry in changed],
+            unlock=any(needs_unlock(entry) for idx, entry in changed),
+            apply=apply
+        )
@@ -40,7 +40,11 @@ class ProtocolCombo(BaseProtocol):
             combo.append((entry[0], entry[1], entry[2], entry[3], entry[4]))
         return combo
 
-    def restore_combo(self, data):
-        for x, e in enumerate(data):
-            if x < self.combo_count:
-                self.combo_set(x, e)
+    def plan_restore_combo(self, data):
+        entries = [tuple(Keycode.serialize(Keycode.deserialize(kc)) for kc in e) for e in data]
+        return self._plan_dynamic_entries(
+            "combo", DYNAMIC_VIAL_COMBO_SET, self.combo_entries, entries,
+            lambda e: struct.pack("<HHHHH", *(Keycode.deserialize(kc) for kc in e)),
+            # for the replacement key
+            lambda e: e[-1] == RESET_KEYCODE
+        )
@@ -14,6 +14,7 @@ CMD_VIA_MACRO_GET_BUFFER = 0x0E
 CMD_VIA_MACRO_SET_BUFFER = 0x0F
 CMD_VIA_GET_LAYER_COUNT = 0x11
 CMD_VIA_KEYMAP_GET_BUFFER = 0x12
+CMD_VIA_KEYMAP_SET_BUFFER = 0x13
 CMD_VIA_VIAL_PREFIX = 0xFE
 VIA_LAYOUT_OPTIONS = 0x02
 VIA_SWITCH_MATRIX_STATE = 0x03
@@ -50,6 +51,8 @@ CMD_VIAL_SET_HE_SWITCH = 0x13
 CMD_VIAL_HE_RESET = 0x14
 CMD_VIAL_GET_HE_SPECIAL_LAYER = 0x15
 CMD_VIAL_SET_HE_SPECIAL_LAYER = 0x16
+CMD_VIAL_GET_HE_ACTUATION_BULK = 0x17
+CMD_VIAL_SET_HE_ACTUATION_BULK = 0x18
 DYNAMIC_VIAL_GET_NUMBER_OF_ENTRIES = 0x00
 DYNAMIC_VIAL_TAP_DANCE_GET = 0x01
 DYNAMIC_VIAL_TAP_DANCE_SET = 0x02
@@ -62,6 +65,14 @@ DYNAMIC_VIAL_ALT_REPEAT_KEY_SET = 0x08
 
 # how much of a macro/keymap buffer we can read/write per packet
 BUFFER_FETCH_CHUNK = 28
+# hall-effect actuation profiles every key has
+HE_PROFILES = 2
+# input priority pair slots, unused ones are filled with 255
+HE_INPUT_PRIORITY_PAIRS = 8
+# actuation configs per bulk read, a status byte and 7 packed 4-byte records fill one report
+HE_ACTUATION_BULK_CHUNK = 7
+# actuation configs per bulk write, what fits after the 6-byte request header
+HE_ACTUATION_WRITE_CHUNK = 6
 
 # When did we get support for advanced macros (including delays in macros)
 VIAL_PROTOCOL_ADVANCED_MACROS = 2
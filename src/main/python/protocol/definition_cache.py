@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import os
+
+from util import EXAMPLE_KEYBOARDS, EXAMPLE_KEYBOARD_PREFIX
+
+DEFAULT_MAX_ENTRIES = 64
+
+
+def cacheable(keyboard_id):
+    """ Example keyboard UIDs are shared by unrelated firmware, so their definitions can't be cached """
+    return keyboard_id not in EXAMPLE_KEYBOARDS and (keyboard_id & 0xFFFFFFFFFFFFFF) != EXAMPLE_KEYBOARD_PREFIX
+
+
+class DefinitionCache:
+    """
+        On-disk LRU cache of compressed keyboard definitions, keyed by keyboard UID and definition size
+
+        Every entry is a file holding the definition exactly as the keyboard sends it. Using an entry bumps its
+        modification time, and the least recently used entries are evicted once there are more than max_entries.
+        An entry loaded from disk has to be validated against the keyboard the first time it is used in a session.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        # entries which were checked against a keyboard or written during this session
+        self.validated = set()
+
+    def entry_path(self, keyboard_id, size):
+        return os.path.join(self.path, "{:016X}-{}.xz".format(keyboard_id & 0xFFFFFFFFFFFFFFFF, size))
+
+    def get(self, keyboard_id, size):
+        """ Returns the cached definition or None """
+
+        path = self.entry_path(keyboard_id, size)
+        try:
+            with open(path, "rb") as inf:
+                data = inf.read()
+        except OSError:
+            return None
+
+        if len(data) != size:
+            self.discard(keyboard_id, size)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, keyboard_id, size, data):
+        path = self.entry_path(keyboard_id, size)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # write to a temporary file first so that a crash can't leave a truncated entry behind
+            with open(path + ".tmp", "wb") as outf:
+                outf.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            return
+        self.validated.add((keyboard_id, size))
+        self.evict()
+
+    def discard(self, keyboard_id, size):
+        self.validated.discard((keyboard_id, size))
+        try:
+            os.remove(self.entry_path(keyboard_id, size))
+        except OSError:
+            pass
+
+    def needs_validation(self, keyboard_id, size):
+        return (keyboard_id, size) not in self.validated
+
+    def mark_valid(self, keyboard_id, size):
+        self.validated.add((keyboard_id, size))
+
+    def evict(self):
+        try:
+            entries = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".xz")]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=os.path.getmtime)
+            for path in entries[:len(entries) - self.max_entries]:
+                os.remove(path)
+        except OSError:
+            pass
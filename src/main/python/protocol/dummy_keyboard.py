@@ -11,6 +11,8 @@ class DummyKeyboard(Keyboard):
         self.layers = 4
 
     def reload_keymap(self):
+        # KC_NO is all zeroes
+        self.keymap_buffer = bytearray(self.layers * self.rows * self.cols * 2)
         for layer in range(self.layers):
             for row, col in self.rowcol.keys():
                 self.layout[(layer, row, col)] = "KC_NO"
@@ -28,11 +30,16 @@ class DummyKeyboard(Keyboard):
         self.macro_memory = 900
 
     def reload_macros_late(self):
-        self.macro = b"\x00" * self.macro_count
+        self.macro = self.macro_raw = b"\x00" * self.macro_count
 
     def set_key(self, layer, row, col, code):
         self.layout[(layer, row, col)] = code
 
+    def execute_restore(self, plan, progress=None):
+        for section in plan.sections:
+            section.apply([None] * len(section.requests))
+        return plan.packets
+
     def set_encoder(self, layer, index, direction, code):
         self.encoder_layout[(layer, index, direction)] = code
 
@@ -43,7 +50,7 @@ class DummyKeyboard(Keyboard):
     def set_macro(self, data):
         if len(data) > self.macro_memory:
             raise RuntimeError("the macro is too big: got {} max {}".format(len(data), self.macro_memory))
-        self.macro = data
+        self.macro = self.macro_raw = data
 
     def reset(self):
         pass
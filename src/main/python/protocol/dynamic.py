@@ -19,6 +19,7 @@ class ProtocolDynamic(BaseProtocol):
             self.key_override_count = 0
             self.key_override_entries = []
             self.alt_repeat_key_count = 0
+            self.alt_repeat_key_entries = []
             return
         data = self.usb_send(self.dev, struct.pack("BBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_DYNAMIC_ENTRY_OP,
                                                    DYNAMIC_VIAL_GET_NUMBER_OF_ENTRIES), retries=20)
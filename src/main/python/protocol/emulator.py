@@ -0,0 +1,465 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import json
+import lzma
+import random
+import struct
+import time
+from collections import deque
+
+from keycodes.keycodes import RESET_KEYCODE, Keycode
+from protocol.constants import CMD_VIA_GET_PROTOCOL_VERSION, CMD_VIA_GET_KEYBOARD_VALUE, CMD_VIA_SET_KEYBOARD_VALUE, \
+    CMD_VIA_GET_KEYCODE, CMD_VIA_SET_KEYCODE, CMD_VIA_LIGHTING_SET_VALUE, CMD_VIA_LIGHTING_GET_VALUE, \
+    CMD_VIA_LIGHTING_SAVE, CMD_VIA_MACRO_GET_COUNT, CMD_VIA_MACRO_GET_BUFFER_SIZE, CMD_VIA_MACRO_GET_BUFFER, \
+    CMD_VIA_MACRO_SET_BUFFER, CMD_VIA_GET_LAYER_COUNT, CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_KEYMAP_SET_BUFFER, \
+    CMD_VIA_VIAL_PREFIX, VIA_LAYOUT_OPTIONS, VIA_SWITCH_MATRIX_STATE, QMK_BACKLIGHT_BRIGHTNESS, QMK_BACKLIGHT_EFFECT, \
+    QMK_RGBLIGHT_BRIGHTNESS, QMK_RGBLIGHT_EFFECT, QMK_RGBLIGHT_EFFECT_SPEED, QMK_RGBLIGHT_COLOR, VIALRGB_GET_INFO, \
+    VIALRGB_GET_MODE, VIALRGB_GET_SUPPORTED, VIALRGB_SET_MODE, CMD_VIAL_GET_KEYBOARD_ID, CMD_VIAL_GET_SIZE, \
+    CMD_VIAL_GET_DEFINITION, CMD_VIAL_GET_ENCODER, CMD_VIAL_SET_ENCODER, CMD_VIAL_GET_UNLOCK_STATUS, \
+    CMD_VIAL_UNLOCK_START, CMD_VIAL_UNLOCK_POLL, CMD_VIAL_LOCK, CMD_VIAL_QMK_SETTINGS_QUERY, \
+    CMD_VIAL_QMK_SETTINGS_GET, CMD_VIAL_QMK_SETTINGS_SET, CMD_VIAL_QMK_SETTINGS_RESET, CMD_VIAL_DYNAMIC_ENTRY_OP, \
+    CMD_VIAL_GET_HE_ACTUATION_CONFIG, CMD_VIAL_SET_HE_ACTUATION_CONFIG, CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR, \
+    CMD_VIAL_SET_HE_INPUT_PRIORITY_PAIR, CMD_VIAL_GET_HE_SWITCH, CMD_VIAL_SET_HE_SWITCH, CMD_VIAL_HE_RESET, \
+    CMD_VIAL_GET_HE_SPECIAL_LAYER, CMD_VIAL_SET_HE_SPECIAL_LAYER, CMD_VIAL_GET_HE_ACTUATION_BULK, \
+    CMD_VIAL_SET_HE_ACTUATION_BULK, HE_ACTUATION_BULK_CHUNK, HE_ACTUATION_WRITE_CHUNK, HE_PROFILES, \
+    HE_INPUT_PRIORITY_PAIRS, DYNAMIC_VIAL_GET_NUMBER_OF_ENTRIES, \
+    DYNAMIC_VIAL_TAP_DANCE_GET, DYNAMIC_VIAL_TAP_DANCE_SET, DYNAMIC_VIAL_COMBO_GET, DYNAMIC_VIAL_COMBO_SET, \
+    DYNAMIC_VIAL_KEY_OVERRIDE_GET, DYNAMIC_VIAL_KEY_OVERRIDE_SET, DYNAMIC_VIAL_ALT_REPEAT_KEY_GET, \
+    DYNAMIC_VIAL_ALT_REPEAT_KEY_SET
+from util import MSG_LEN
+
+# reply QMK sends for commands it doesn't know
+ID_UNHANDLED = 0xFF
+CMD_VIA_BOOTLOADER_JUMP = 0x0B
+
+HE_DEFAULT_ACTUATION = (128, 0, 0, 0)
+
+# (get, set, size of one entry) for every kind of dynamic entry
+DYNAMIC_ENTRIES = {
+    "tap_dance": (DYNAMIC_VIAL_TAP_DANCE_GET, DYNAMIC_VIAL_TAP_DANCE_SET, 10),
+    "combo": (DYNAMIC_VIAL_COMBO_GET, DYNAMIC_VIAL_COMBO_SET, 10),
+    "key_override": (DYNAMIC_VIAL_KEY_OVERRIDE_GET, DYNAMIC_VIAL_KEY_OVERRIDE_SET, 10),
+    "alt_repeat_key": (DYNAMIC_VIAL_ALT_REPEAT_KEY_GET, DYNAMIC_VIAL_ALT_REPEAT_KEY_SET, 6),
+}
+
+
+class FirmwareEmulator:
+    """
+        Stateful in-process model of a Vial keyboard answering raw 32-byte protocol packets
+
+        All of the keyboard state lives here: the dynamic keymap and encoders, the macro buffer, dynamic entries,
+        QMK settings, lighting, hall-effect configuration, the switch matrix and the unlock state machine.
+        Requests the real firmware would refuse while locked are refused the same way.
+    """
+
+    def __init__(self, definition, layers=4, vial_protocol=6, via_protocol=9, keyboard_id=0x1122334455667788,
+                 macro_count=16, macro_memory=900, dynamic_counts=None, qmk_settings=None, unlock_keys=None,
+                 unlock_counter=50, hall_effect=True, hall_effect_bulk=True):
+        if isinstance(definition, str):
+            definition = json.loads(definition)
+        self.definition = definition
+        self.compressed_definition = lzma.compress(json.dumps(definition).encode("utf-8"))
+
+        self.rows = definition["matrix"]["rows"]
+        self.cols = definition["matrix"]["cols"]
+        self.layers = layers
+        self.vial_protocol = vial_protocol
+        self.via_protocol = via_protocol
+        self.keyboard_id = keyboard_id
+
+        self.keymap = bytearray(layers * self.rows * self.cols * 2)
+        self.encoders = dict()
+        self.layout_options = 0
+
+        self.macro_count = macro_count
+        self.macro_buffer = bytearray(macro_memory)
+
+        if dynamic_counts is None:
+            dynamic_counts = {"tap_dance": 8, "combo": 8, "key_override": 8, "alt_repeat_key": 8}
+        self.dynamic = {kind: [bytes(DYNAMIC_ENTRIES[kind][2])] * dynamic_counts.get(kind, 0)
+                        for kind in DYNAMIC_ENTRIES}
+        self.dynamic_features = 0b11
+
+        # qsid -> raw little-endian value
+        self.qmk_settings = {qsid: bytes(4) for qsid in (qmk_settings or [])}
+
+        lighting = definition.get("lighting", "none")
+        self.lighting = {
+            QMK_RGBLIGHT_BRIGHTNESS: 128, QMK_RGBLIGHT_EFFECT: 1, QMK_RGBLIGHT_EFFECT_SPEED: 0,
+            QMK_BACKLIGHT_BRIGHTNESS: 128, QMK_BACKLIGHT_EFFECT: 0,
+        }
+        self.rgblight_color = (0, 255)
+        self.vialrgb = lighting == "vialrgb"
+        self.vialrgb_mode = (1, 128, 0, 255, 128)
+        self.vialrgb_effects = list(range(1, 20))
+        self.lighting_saves = 0
+
+        self.hall_effect = hall_effect
+        # firmware older than the bulk actuation commands doesn't know them
+        self.hall_effect_bulk = hall_effect_bulk
+        self.actuation = bytearray(HE_DEFAULT_ACTUATION * (HE_PROFILES * self.rows * self.cols))
+        self.input_priority_pairs = [b"\xFF" * 6] * HE_INPUT_PRIORITY_PAIRS
+        self.he_switch = 0
+        self.he_special_layer = 0
+
+        self.pressed = set()
+        self.unlock_keys = list(unlock_keys or [])
+        self.unlock_counter_start = unlock_counter
+        self.unlocked = not self.unlock_keys
+        self.unlock_in_progress = False
+        self.unlock_counter = 0
+        self.bootloader_jumps = 0
+
+    # keyboard-side helpers for tests and benchmarks
+
+    def press(self, row, col):
+        self.pressed.add((row, col))
+
+    def release(self, row, col):
+        self.pressed.discard((row, col))
+
+    def keycode(self, layer, row, col):
+        offset = (layer * self.rows * self.cols + row * self.cols + col) * 2
+        return struct.unpack_from(">H", self.keymap, offset)[0]
+
+    def actuation_config(self, profile, row, col):
+        offset = ((profile * self.rows + row) * self.cols + col) * 4
+        return tuple(self.actuation[offset:offset + 4])
+
+    # protocol
+
+    def process(self, msg):
+        """ Handles one request, returns the 32-byte response """
+
+        msg = bytes(msg) + b"\x00" * (MSG_LEN - len(msg))
+        if msg[0] == CMD_VIA_VIAL_PREFIX:
+            if self.vial_protocol < 0:
+                out = self.unhandled(msg)
+            else:
+                out = self.vial_cmd(msg)
+        else:
+            out = self.via_cmd(msg)
+        return bytes(out[:MSG_LEN]) + b"\x00" * (MSG_LEN - len(out))
+
+    @staticmethod
+    def unhandled(msg):
+        return bytes([ID_UNHANDLED]) + msg[1:]
+
+    def via_cmd(self, msg):
+        cmd = msg[0]
+        if cmd == CMD_VIA_GET_PROTOCOL_VERSION:
+            return struct.pack(">BH", cmd, self.via_protocol)
+        elif cmd == CMD_VIA_GET_KEYBOARD_VALUE:
+            if msg[1] == VIA_LAYOUT_OPTIONS:
+                return msg[0:2] + struct.pack(">I", self.layout_options)
+            elif msg[1] == VIA_SWITCH_MATRIX_STATE:
+                return msg[0:2] + self.matrix_state()
+        elif cmd == CMD_VIA_SET_KEYBOARD_VALUE:
+            if msg[1] == VIA_LAYOUT_OPTIONS:
+                self.layout_options = struct.unpack_from(">I", msg, 2)[0]
+                return msg
+        elif cmd == CMD_VIA_GET_KEYCODE:
+            layer, row, col = msg[1:4]
+            return msg[0:4] + struct.pack(">H", self.keycode(layer, row, col))
+        elif cmd == CMD_VIA_SET_KEYCODE:
+            layer, row, col, kc = struct.unpack_from(">BBBH", msg, 1)
+            if layer < self.layers and row < self.rows and col < self.cols and self.keycode_allowed(kc):
+                struct.pack_into(">H", self.keymap, (layer * self.rows * self.cols + row * self.cols + col) * 2, kc)
+            return msg
+        elif cmd == CMD_VIA_LIGHTING_GET_VALUE:
+            return self.lighting_get(msg)
+        elif cmd == CMD_VIA_LIGHTING_SET_VALUE:
+            return self.lighting_set(msg)
+        elif cmd == CMD_VIA_LIGHTING_SAVE:
+            self.lighting_saves += 1
+            return msg
+        elif cmd == CMD_VIA_MACRO_GET_COUNT:
+            return struct.pack("BB", cmd, self.macro_count)
+        elif cmd == CMD_VIA_MACRO_GET_BUFFER_SIZE:
+            return struct.pack(">BH", cmd, len(self.macro_buffer))
+        elif cmd == CMD_VIA_MACRO_GET_BUFFER:
+            offset, size = struct.unpack_from(">HB", msg, 1)
+            return msg[0:4] + self.read_buffer(self.macro_buffer, offset, size)
+        elif cmd == CMD_VIA_MACRO_SET_BUFFER:
+            offset, size = struct.unpack_from(">HB", msg, 1)
+            self.write_buffer(self.macro_buffer, offset, msg[4:4 + size])
+            return msg
+        elif cmd == CMD_VIA_GET_LAYER_COUNT:
+            return struct.pack("BB", cmd, self.layers)
+        elif cmd == CMD_VIA_KEYMAP_GET_BUFFER:
+            offset, size = struct.unpack_from(">HB", msg, 1)
+            return msg[0:4] + self.read_buffer(self.keymap, offset, size)
+        elif cmd == CMD_VIA_KEYMAP_SET_BUFFER:
+            offset, size = struct.unpack_from(">HB", msg, 1)
+            data = bytearray(msg[4:4 + size])
+            # the keycode firewall applies per key, a refused keycode leaves that key as it was
+            for x in range(0, len(data) - 1, 2):
+                if not self.keycode_allowed(struct.unpack_from(">H", data, x)[0]):
+                    data[x:x + 2] = self.read_buffer(self.keymap, offset + x, 2)
+            self.write_buffer(self.keymap, offset, data)
+            return msg
+        elif cmd == CMD_VIA_BOOTLOADER_JUMP:
+            if self.unlocked:
+                self.bootloader_jumps += 1
+            return msg
+        return self.unhandled(msg)
+
+    def vial_cmd(self, msg):
+        cmd = msg[1]
+        if cmd == CMD_VIAL_GET_KEYBOARD_ID:
+            return struct.pack("<IQ", self.vial_protocol, self.keyboard_id)
+        elif cmd == CMD_VIAL_GET_SIZE:
+            return struct.pack("<I", len(self.compressed_definition))
+        elif cmd == CMD_VIAL_GET_DEFINITION:
+            page = struct.unpack_from("<I", msg, 2)[0]
+            return self.compressed_definition[page * MSG_LEN:(page + 1) * MSG_LEN]
+        elif cmd == CMD_VIAL_GET_ENCODER:
+            layer, idx = msg[2:4]
+            return struct.pack(">HH", *self.encoders.get((layer, idx), (0, 0)))
+        elif cmd == CMD_VIAL_SET_ENCODER:
+            layer, idx, direction, kc = struct.unpack_from(">BBBH", msg, 2)
+            if self.keycode_allowed(kc):
+                value = list(self.encoders.get((layer, idx), (0, 0)))
+                value[direction] = kc
+                self.encoders[(layer, idx)] = tuple(value)
+            return msg
+        elif cmd == CMD_VIAL_GET_UNLOCK_STATUS:
+            keys = b"".join(struct.pack("BB", row, col) for row, col in self.unlock_keys[:15])
+            keys += b"\xFF" * (30 - len(keys))
+            return struct.pack("BB", int(self.unlocked), int(self.unlock_in_progress)) + keys
+        elif cmd == CMD_VIAL_UNLOCK_START:
+            self.unlock_in_progress = True
+            self.unlock_counter = self.unlock_counter_start
+            return msg
+        elif cmd == CMD_VIAL_UNLOCK_POLL:
+            if self.unlock_in_progress:
+                if all(key in self.pressed for key in self.unlock_keys):
+                    self.unlock_counter = max(0, self.unlock_counter - 1)
+                else:
+                    self.unlock_counter = self.unlock_counter_start
+                if self.unlock_counter == 0:
+                    self.unlocked = True
+                    self.unlock_in_progress = False
+            return struct.pack("BBB", int(self.unlocked), int(self.unlock_in_progress), self.unlock_counter)
+        elif cmd == CMD_VIAL_LOCK:
+            if self.unlock_keys:
+                self.unlocked = False
+            return msg
+        elif cmd == CMD_VIAL_QMK_SETTINGS_QUERY:
+            cur = struct.unpack_from("<H", msg, 2)[0]
+            qsids = sorted(qsid for qsid in self.qmk_settings if qsid > cur)[:16]
+            return b"".join(struct.pack("<H", qsid) for qsid in qsids) + b"\xFF" * (32 - 2 * len(qsids))
+        elif cmd == CMD_VIAL_QMK_SETTINGS_GET:
+            qsid = struct.unpack_from("<H", msg, 2)[0]
+            if qsid not in self.qmk_settings:
+                return b"\x01"
+            return b"\x00" + self.qmk_settings[qsid]
+        elif cmd == CMD_VIAL_QMK_SETTINGS_SET:
+            qsid = struct.unpack_from("<H", msg, 2)[0]
+            if qsid not in self.qmk_settings:
+                return b"\x01"
+            self.qmk_settings[qsid] = msg[4:8]
+            return b"\x00"
+        elif cmd == CMD_VIAL_QMK_SETTINGS_RESET:
+            for qsid in self.qmk_settings:
+                self.qmk_settings[qsid] = bytes(4)
+            return msg
+        elif cmd == CMD_VIAL_DYNAMIC_ENTRY_OP:
+            return self.dynamic_cmd(msg)
+        elif self.hall_effect:
+            return self.hall_effect_cmd(msg)
+        # vial leaves the request untouched for commands it doesn't know
+        return msg
+
+    def dynamic_cmd(self, msg):
+        op = msg[2]
+        if op == DYNAMIC_VIAL_GET_NUMBER_OF_ENTRIES:
+            counts = bytes(len(self.dynamic[kind]) for kind in DYNAMIC_ENTRIES)
+            return counts + bytes(31 - len(counts)) + bytes([self.dynamic_features])
+        for kind, (get, set_, size) in DYNAMIC_ENTRIES.items():
+            entries = self.dynamic[kind]
+            if op == get:
+                if msg[3] >= len(entries):
+                    return b"\x01"
+                return b"\x00" + entries[msg[3]]
+            elif op == set_:
+                if msg[3] >= len(entries):
+                    return b"\x01"
+                entries[msg[3]] = msg[4:4 + size]
+                return b"\x00"
+        return b"\x01"
+
+    def hall_effect_cmd(self, msg):
+        cmd = msg[1]
+        if cmd == CMD_VIAL_GET_HE_ACTUATION_CONFIG:
+            offset = self.actuation_offset(*msg[2:5])
+            if offset is None:
+                return b"\x01"
+            return b"\x00" + self.actuation[offset:offset + 4]
+        elif cmd == CMD_VIAL_SET_HE_ACTUATION_CONFIG:
+            offset = self.actuation_offset(*msg[2:5])
+            if offset is None:
+                return b"\x01"
+            self.actuation[offset:offset + 4] = msg[5:9]
+            return b"\x00"
+        elif cmd == CMD_VIAL_GET_HE_ACTUATION_BULK and self.hall_effect_bulk:
+            profile, start, count = struct.unpack_from("<BHB", msg, 2)
+            if profile >= HE_PROFILES or count > HE_ACTUATION_BULK_CHUNK or start + count > self.rows * self.cols:
+                return b"\x01"
+            offset = (profile * self.rows * self.cols + start) * 4
+            return b"\x00" + self.actuation[offset:offset + count * 4]
+        elif cmd == CMD_VIAL_SET_HE_ACTUATION_BULK and self.hall_effect_bulk:
+            profile, start, count = struct.unpack_from("<BHB", msg, 2)
+            if profile >= HE_PROFILES or count > HE_ACTUATION_WRITE_CHUNK or start + count > self.rows * self.cols:
+                return b"\x01"
+            offset = (profile * self.rows * self.cols + start) * 4
+            self.actuation[offset:offset + count * 4] = msg[6:6 + count * 4]
+            return b"\x00"
+        elif cmd == CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR:
+            if msg[2] >= HE_INPUT_PRIORITY_PAIRS:
+                return b"\x01"
+            return b"\x00" + self.input_priority_pairs[msg[2]]
+        elif cmd == CMD_VIAL_SET_HE_INPUT_PRIORITY_PAIR:
+            if msg[2] >= HE_INPUT_PRIORITY_PAIRS:
+                return b"\x01"
+            self.input_priority_pairs[msg[2]] = msg[3:9]
+            return b"\x00"
+        elif cmd == CMD_VIAL_GET_HE_SWITCH:
+            return struct.pack("BB", 0, self.he_switch)
+        elif cmd == CMD_VIAL_SET_HE_SWITCH:
+            self.he_switch = msg[2]
+            return b"\x00"
+        elif cmd == CMD_VIAL_HE_RESET:
+            self.actuation[:] = bytes(HE_DEFAULT_ACTUATION * (HE_PROFILES * self.rows * self.cols))
+            return b"\x00"
+        elif cmd == CMD_VIAL_GET_HE_SPECIAL_LAYER:
+            return struct.pack("BB", 0, self.he_special_layer)
+        elif cmd == CMD_VIAL_SET_HE_SPECIAL_LAYER:
+            self.he_special_layer = msg[2]
+            return b"\x00"
+        return msg
+
+    def actuation_offset(self, profile, row, col):
+        if profile >= HE_PROFILES or row >= self.rows or col >= self.cols:
+            return None
+        return ((profile * self.rows + row) * self.cols + col) * 4
+
+    def lighting_get(self, msg):
+        value = msg[1]
+        if self.vialrgb:
+            if value == VIALRGB_GET_INFO:
+                return msg[0:2] + struct.pack("<HB", 1, 255)
+            elif value == VIALRGB_GET_MODE:
+                return msg[0:2] + struct.pack("<HBBBB", *self.vialrgb_mode)
+            elif value == VIALRGB_GET_SUPPORTED:
+                start = struct.unpack_from("<H", msg, 2)[0]
+                effects = [x for x in self.vialrgb_effects if x > start][:15]
+                return msg[0:2] + b"".join(struct.pack("<H", x) for x in effects) + \
+                    b"\xFF" * (30 - 2 * len(effects))
+        if value == QMK_RGBLIGHT_COLOR:
+            return msg[0:2] + bytes(self.rgblight_color)
+        if value in self.lighting:
+            return msg[0:2] + bytes([self.lighting[value]])
+        return self.unhandled(msg)
+
+    def lighting_set(self, msg):
+        value = msg[1]
+        if self.vialrgb and value == VIALRGB_SET_MODE:
+            self.vialrgb_mode = struct.unpack_from("<HBBBB", msg, 2)
+        elif value == QMK_RGBLIGHT_COLOR:
+            self.rgblight_color = (msg[2], msg[3])
+        elif value in self.lighting:
+            self.lighting[value] = msg[2]
+        else:
+            return self.unhandled(msg)
+        return msg
+
+    def matrix_state(self):
+        if not self.unlocked:
+            return b""
+        row_size = (self.cols + 7) // 8
+        out = b""
+        for row in range(self.rows):
+            value = 0
+            for col in range(self.cols):
+                if (row, col) in self.pressed:
+                    value |= 1 << col
+            out += value.to_bytes(row_size, byteorder="big")
+        return out
+
+    def keycode_allowed(self, kc):
+        # the firmware won't let a locked keyboard be given a way into the bootloader
+        return self.unlocked or kc != Keycode.deserialize(RESET_KEYCODE)
+
+    @staticmethod
+    def read_buffer(buffer, offset, size):
+        return bytes(buffer[offset:offset + size]) + b"\x00" * max(0, offset + size - max(len(buffer), offset))
+
+    @staticmethod
+    def write_buffer(buffer, offset, data):
+        data = data[:max(0, len(buffer) - offset)]
+        buffer[offset:offset + len(data)] = data
+
+
+class EmulatedDevice:
+    """
+        hidapi-compatible device in front of a FirmwareEmulator
+
+        Every response arrives latency_ms (plus up to jitter_ms) after its request was written, while the firmware
+        itself handles one packet at a time, each taking service_ms. Responses queue up like they do in the OS
+        input buffer, so pipelining works exactly as against real hardware. drop_rate is
+        the chance that a request is lost without an answer and corrupt_rate the chance that one byte of a response
+        is flipped; both are drawn from a seeded generator so runs are reproducible.
+    """
+
+    def __init__(self, firmware, latency_ms=0, jitter_ms=0, service_ms=0, drop_rate=0, corrupt_rate=0, seed=0):
+        self.firmware = firmware
+        self.latency_ms = latency_ms
+        self.service_ms = service_ms
+        self.jitter_ms = jitter_ms
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.random = random.Random(seed)
+
+        self.responses = deque()
+        self.busy_until = 0
+        self.writes = self.drops = self.corruptions = 0
+
+    def open_path(self, path):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        self.writes += 1
+        # drop the hidapi report id
+        response = self.firmware.process(bytes(data[1:]))
+
+        if self.random.random() < self.drop_rate:
+            self.drops += 1
+            return len(data)
+        if self.random.random() < self.corrupt_rate:
+            self.corruptions += 1
+            pos = self.random.randrange(len(response))
+            response = response[:pos] + bytes([response[pos] ^ 0xFF]) + response[pos + 1:]
+
+        self.busy_until = max(time.monotonic(), self.busy_until) + self.service_ms / 1000
+        delay = (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+        # responses can't overtake each other
+        ready = max(self.busy_until + delay, self.responses[-1][0] if self.responses else 0)
+        self.responses.append((ready, response))
+        return len(data)
+
+    def read(self, length, timeout_ms=0):
+        now = time.monotonic()
+        if self.responses:
+            ready, response = self.responses[0]
+            # a zero timeout blocks in hidapi, anything queued will eventually arrive
+            if timeout_ms <= 0 or ready <= now + timeout_ms / 1000:
+                if ready > now:
+                    time.sleep(ready - now)
+                self.responses.popleft()
+                return response[:length]
+        if timeout_ms > 0:
+            time.sleep(timeout_ms / 1000)
+        return b""
@@ -5,68 +5,212 @@ from keycodes.keycodes import Keycode, RESET_KEYCODE
 from protocol.base_protocol import BaseProtocol
 from protocol.constants import CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG, CMD_VIAL_SET_HE_ACTUATION_CONFIG, \
                                 CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR, CMD_VIAL_SET_HE_INPUT_PRIORITY_PAIR, \
-                                CMD_VIAL_GET_HE_SWITCH, CMD_VIAL_SET_HE_SWITCH, CMD_VIAL_HE_RESET, CMD_VIAL_GET_HE_SPECIAL_LAYER, CMD_VIAL_SET_HE_SPECIAL_LAYER
+                                CMD_VIAL_GET_HE_SWITCH, CMD_VIAL_SET_HE_SWITCH, CMD_VIAL_HE_RESET, CMD_VIAL_GET_HE_SPECIAL_LAYER, CMD_VIAL_SET_HE_SPECIAL_LAYER, \
+                                CMD_VIAL_GET_HE_ACTUATION_BULK, CMD_VIAL_SET_HE_ACTUATION_BULK, HE_ACTUATION_BULK_CHUNK, \
+                                HE_ACTUATION_WRITE_CHUNK, HE_PROFILES, HE_INPUT_PRIORITY_PAIRS
+from protocol.restore_plan import RestoreSection
 from unlocker import Unlocker
+from util import changed_runs
+
+ACTUATION_FIELDS = ["actuation_point", "rt_mode", "rt_press", "rt_release"]
+ACTUATION_RECORD = struct.Struct("BBBB")
+DEFAULT_ACTUATION = (128, 0, 0, 0)
+
+
+def actuation_field(index):
+    def get(self):
+        return self.buffer[self.offset + index]
+
+    def set(self, value):
+        self.buffer[self.offset + index] = value
+
+    return property(get, set)
+
 
 class ActuationConfig:
-    
+    """ Actuation settings of a single key, either standalone or a view into an ActuationMatrix """
+
+    __slots__ = ["buffer", "offset"]
+
+    actuation_point = actuation_field(0)
+    rt_mode = actuation_field(1)
+    rt_press = actuation_field(2)
+    rt_release = actuation_field(3)
+
     def __init__(self, actuation_point=0, rt_mode=0, rt_press=0, rt_release=0):
-        self.actuation_point = actuation_point
-        self.rt_mode = rt_mode
-        self.rt_press = rt_press
-        self.rt_release = rt_release
+        self.buffer = bytearray((actuation_point, rt_mode, rt_press, rt_release))
+        self.offset = 0
+
+    @classmethod
+    def view(cls, buffer, offset):
+        config = cls.__new__(cls)
+        config.buffer = buffer
+        config.offset = offset
+        return config
 
     def to_tuple(self):
-        return (self.actuation_point, self.rt_mode, self.rt_press, self.rt_release)
-    
+        return tuple(self.buffer[self.offset:self.offset + ACTUATION_RECORD.size])
+
+    def to_bytes(self):
+        return memoryview(self.buffer)[self.offset:self.offset + ACTUATION_RECORD.size]
+
     def to_dict(self):
-        return {
-            "actuation_point": self.actuation_point,
-            "rt_mode": self.rt_mode,
-            "rt_press": self.rt_press,
-            "rt_release": self.rt_release
-        }
-    
+        return dict(zip(ACTUATION_FIELDS, self.to_tuple()))
+
     @classmethod
     def from_dict(cls, data):
-        return cls(
-            actuation_point=data["actuation_point"],
-            rt_mode=data["rt_mode"],
-            rt_press=data["rt_press"],
-            rt_release=data["rt_release"]
-        )
+        return cls(*(data[field] for field in ACTUATION_FIELDS))
+
+
+class ActuationRow:
+
+    __slots__ = ["matrix", "offset"]
+
+    def __init__(self, matrix, offset):
+        self.matrix = matrix
+        self.offset = offset
+
+    def __getitem__(self, col):
+        if not 0 <= col < self.matrix.cols:
+            raise IndexError(col)
+        return ActuationConfig.view(self.matrix.data, self.offset + col * ACTUATION_RECORD.size)
+
+    def __len__(self):
+        return self.matrix.cols
+
+
+class ActuationProfile:
+
+    __slots__ = ["matrix", "profile"]
+
+    def __init__(self, matrix, profile):
+        self.matrix = matrix
+        self.profile = profile
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.matrix.rows:
+            raise IndexError(row)
+        return ActuationRow(self.matrix, self.matrix.offset(self.profile, row, 0))
+
+    def __len__(self):
+        return self.matrix.rows
+
+
+class ActuationMatrix:
+    """
+        Actuation configs of every key in every profile, held in one buffer laid out exactly like the wire format
+
+        matrix[profile][row][col] (or matrix.key(profile, row, col)) returns an ActuationConfig view, so changes
+        made through it land in the buffer directly. Records of a profile are stored row by row, 4 bytes each.
+    """
+
+    def __init__(self, profiles, rows, cols, data=None):
+        self.profiles = profiles
+        self.rows = rows
+        self.cols = cols
+        if data is None:
+            data = bytes(DEFAULT_ACTUATION) * (profiles * rows * cols)
+        if len(data) != profiles * rows * cols * ACTUATION_RECORD.size:
+            raise ValueError("actuation data doesn't match a {}x{}x{} matrix".format(profiles, rows, cols))
+        self.data = bytearray(data)
+
+    def offset(self, profile, row, col):
+        return ((profile * self.rows + row) * self.cols + col) * ACTUATION_RECORD.size
+
+    def key(self, profile, row, col):
+        return ActuationConfig.view(self.data, self.offset(profile, row, col))
+
+    def __getitem__(self, profile):
+        if not 0 <= profile < self.profiles:
+            raise IndexError(profile)
+        return ActuationProfile(self, profile)
+
+    def __len__(self):
+        return self.profiles
+
+    def __eq__(self, other):
+        return isinstance(other, ActuationMatrix) and (self.profiles, self.rows, self.cols, self.data) == \
+            (other.profiles, other.rows, other.cols, other.data)
+
+    def profile_bytes(self, profile):
+        """ Raw records of a profile without copying them """
+        size = self.rows * self.cols * ACTUATION_RECORD.size
+        return memoryview(self.data)[profile * size:(profile + 1) * size]
+
+    def assign(self, profile, keys, **fields):
+        """ Sets fields (e.g. rt_mode=1) of every (row, col) in keys, None selects every key of the profile """
+
+        if keys is None:
+            start = self.offset(profile, 0, 0)
+            end = self.offset(profile + 1, 0, 0)
+            count = self.rows * self.cols
+            for field, value in fields.items():
+                index = ACTUATION_FIELDS.index(field)
+                self.data[start + index:end:ACTUATION_RECORD.size] = bytes([value]) * count
+            return
+
+        updates = [(ACTUATION_FIELDS.index(field), value) for field, value in fields.items()]
+        for row, col in keys:
+            offset = self.offset(profile, row, col)
+            for index, value in updates:
+                self.data[offset + index] = value
+
+    def fill(self, profile, config=DEFAULT_ACTUATION):
+        """ Sets every key of a profile to the same config """
+        start = self.offset(profile, 0, 0)
+        self.data[start:start + self.rows * self.cols * ACTUATION_RECORD.size] = \
+            bytes(config) * (self.rows * self.cols)
+
+    def plan_writes(self, committed, profile, chunk):
+        """ Yields (start, count) runs of keys of a profile which differ from the committed buffer (see changed_runs) """
+
+        size = ACTUATION_RECORD.size
+        base = self.offset(profile, 0, 0)
+        end = self.offset(profile + 1, 0, 0)
+        old = None if committed is None else committed[base:end]
+        for offset, length in changed_runs(old, self.data[base:end], size, chunk * size):
+            yield offset // size, length // size
+
+    def to_list(self):
+        """ Nested profile/row/col lists of dicts, the representation used in saved layouts """
+        records = ACTUATION_RECORD.iter_unpack(self.data)
+        return [[[dict(zip(ACTUATION_FIELDS, next(records))) for col in range(self.cols)]
+                 for row in range(self.rows)] for profile in range(self.profiles)]
+
+    @classmethod
+    def from_list(cls, profiles, rows, cols, data):
+        """ Inverse of to_list """
+        buffer = bytearray()
+        for profile_list in data:
+            for row_list in profile_list:
+                for config in row_list:
+                    buffer += ACTUATION_RECORD.pack(*(config[field] for field in ACTUATION_FIELDS))
+        return cls(profiles, rows, cols, buffer)
+
 
 class ProtocolHallEffect(BaseProtocol):
 
     def reload_hall_effect(self):
-        self.actuation_matrix = []
+        self.actuation_matrix = None
+        self.actuation_committed = None
         error_occurred = False
         self.firmware_updated = True
 
-        for profile in range(2):
-            profile_data = []
-            for row in range(self.rows):
-
-                r = []
-                for col in range(self.cols):
-                    data = self.usb_send(
-                        self.dev,
-                        struct.pack("BBBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG, profile, row, col),
-                        retries=20
-                    )
-                    if data and data[0] == 0:
-                        actuation_tuple = struct.unpack("<BBBB", data[1:1 + struct.calcsize("<BBBB")])
-                        actuation_object = ActuationConfig(*actuation_tuple) 
-                        r.append(actuation_object)
-                    else:
-                        error_occurred = True
-
-                profile_data.append(r)
-
-            self.actuation_matrix.append(profile_data)
-        
+        self.he_bulk = self.probe_he_bulk()
+        if self.he_bulk:
+            actuation = self.read_actuation_bulk()
+        else:
+            actuation = self.read_actuation_per_key()
+
+        if actuation is None:
+            error_occurred = True
+        else:
+            self.actuation_matrix = ActuationMatrix(HE_PROFILES, self.rows, self.cols, actuation)
+            # what the keyboard holds, commit_actuation only sends keys which differ from it
+            self.actuation_committed = bytearray(actuation)
+
         self.input_priority_pairs = []
-        for index in range(8):
+        for index in range(HE_INPUT_PRIORITY_PAIRS):
             data = self.usb_send(
                 self.dev,
                 struct.pack("BBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR, index),
@@ -110,12 +254,46 @@ class ProtocolHallEffect(BaseProtocol):
         if any(x == -1 for x in [self.actuation_matrix, self.switch_option, self.special_layer]):
             self.firmware_updated = False
 
-    def set_actuation_config(self, profile, row, col):
-        actuation_to_send = self.actuation_matrix[profile][row][col]
-
-        data_tuple = actuation_to_send.to_tuple() 
+    def probe_he_bulk(self):
+        """ Firmware without bulk actuation commands echoes the request back, which fails the status check """
+        data = self.usb_send(
+            self.dev,
+            struct.pack("<BBBHB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_BULK, 0, 0, 1),
+            retries=20
+        )
+        return bool(data) and data[0] == 0
+
+    def read_actuation_bulk(self):
+        """ Reads raw actuation configs of both profiles, HE_ACTUATION_BULK_CHUNK keys per request """
+
+        keys = self.rows * self.cols
+        chunks = [(profile, start, min(HE_ACTUATION_BULK_CHUNK, keys - start))
+                  for profile in range(HE_PROFILES) for start in range(0, keys, HE_ACTUATION_BULK_CHUNK)]
+        actuation = bytearray()
+        for (profile, start, count), data in zip(chunks, self.transport.iter_many(
+                self.dev, (struct.pack("<BBBHB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_BULK,
+                                       profile, start, count) for profile, start, count in chunks), retries=20)):
+            if not data or data[0] != 0:
+                return None
+            actuation += data[1:1 + count * 4]
+        return actuation
+
+    def read_actuation_per_key(self):
+        """ Reads raw actuation configs of both profiles one key at a time, for firmware without bulk reads """
+
+        actuation = bytearray()
+        for data in self.transport.iter_many(
+                self.dev,
+                (struct.pack("BBBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG, profile, row, col)
+                 for profile in range(HE_PROFILES) for row in range(self.rows) for col in range(self.cols)),
+                retries=20):
+            if not data or data[0] != 0:
+                return None
+            actuation += data[1:5]
+        return actuation
 
-        serialized = struct.pack("BBBB", *data_tuple)
+    def set_actuation_config(self, profile, row, col):
+        serialized = self.actuation_matrix.key(profile, row, col).to_bytes()
         command_header = struct.pack("BBBBB", 
                                     CMD_VIA_VIAL_PREFIX, 
                                     CMD_VIAL_SET_HE_ACTUATION_CONFIG, 
@@ -124,29 +302,60 @@ class ProtocolHallEffect(BaseProtocol):
                                     col)
         
         data_to_send = command_header + serialized
-        self.usb_send(self.dev, data_to_send, retries=20)
+        if self.usb_send(self.dev, data_to_send, retries=20) and self.actuation_committed is not None:
+            offset = self.actuation_matrix.offset(profile, row, col)
+            self.actuation_committed[offset:offset + ACTUATION_RECORD.size] = serialized
+
+    def commit_actuation(self, profile=None):
+        """
+            Writes the keys of actuation_matrix which differ from what the keyboard holds, all profiles if profile
+            is None. Contiguous keys go out in bulk writes where the firmware supports them.
+            Returns the number of requests sent.
+        """
+
+        runs, requests = self.plan_actuation_writes(self.actuation_matrix, profile)
+        self.actuation_written(self.actuation_matrix, runs, requests,
+                               self.transport.iter_many(self.dev, requests, retries=20))
+        return len(requests)
+
+    def plan_actuation_writes(self, matrix, profile=None):
+        """ Returns the (profile, start, count) runs of matrix which differ from the keyboard and their requests """
+
+        profiles = range(HE_PROFILES) if profile is None else [profile]
+        size = ACTUATION_RECORD.size
+        runs = [(p, start, count) for p in profiles
+                for start, count in matrix.plan_writes(self.actuation_committed, p,
+                                                       HE_ACTUATION_WRITE_CHUNK if self.he_bulk else 1)]
+
+        def request(p, start, count):
+            offset = matrix.offset(p, 0, 0) + start * size
+            records = matrix.data[offset:offset + count * size]
+            if self.he_bulk:
+                return struct.pack("<BBBHB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_HE_ACTUATION_BULK,
+                                   p, start, count) + records
+            row, col = divmod(start, self.cols)
+            return struct.pack("BBBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_HE_ACTUATION_CONFIG, p, row, col) + records
+
+        return runs, [request(*run) for run in runs]
+
+    def actuation_written(self, matrix, runs, requests, responses):
+        """ Records the runs the keyboard accepted as committed """
+
+        size = ACTUATION_RECORD.size
+        if self.actuation_committed is None:
+            # the keyboard state couldn't be read so every key was planned, only what gets written is known
+            self.actuation_committed = bytearray(len(matrix.data))
+
+        for (p, start, count), msg, data in zip(runs, requests, responses):
+            # per-key writes never reported a status, any answer means the keyboard got it
+            if not data or (self.he_bulk and data[0] != 0):
+                continue
+            offset = matrix.offset(p, 0, 0) + start * size
+            self.actuation_committed[offset:offset + count * size] = msg[-count * size:]
 
     def reset_actuation_profile(self, profile):
-        data_tuple = (
-            128,
-            0,
-            0,
-            0,
-        )
-        for row in range(self.rows):
-            for col in range(self.cols):
-                self.actuation_matrix[profile][row][col] = ActuationConfig(*data_tuple) 
-
-                serialized = struct.pack("BBBB", *data_tuple)
-                command_header = struct.pack("BBBBB", 
-                                            CMD_VIA_VIAL_PREFIX, 
-                                            CMD_VIAL_SET_HE_ACTUATION_CONFIG, 
-                                            profile, 
-                                            row, 
-                                            col)
-                
-                data_to_send = command_header + serialized
-                self.usb_send(self.dev, data_to_send, retries=20)
+        self.actuation_matrix.fill(profile, DEFAULT_ACTUATION)
+        self.commit_actuation(profile)
 
     def set_input_priority_pair(self, index):
         if index == -1:
@@ -238,22 +447,8 @@ class ProtocolHallEffect(BaseProtocol):
         self.usb_send(self.dev, data_to_send, retries=20)
 
     def save_hall_effect(self):
-        serialized_matrix = []
-        
-        profiles = len(self.actuation_matrix)
-        
-        for p in range(profiles):
-            profile_list = []
-            for r in range(self.rows):
-                row_list = []
-                for c in range(self.cols):
-                    config_obj = self.actuation_matrix[p][r][c]
-                    row_list.append(config_obj.to_dict())
-                profile_list.append(row_list)
-            serialized_matrix.append(profile_list)
-        
         he_config = {
-            "actuation_matrix": serialized_matrix,
+            "actuation_matrix": self.actuation_matrix.to_list(),
             "input_priority_pairs": self.input_priority_pairs,
             "switch_option": self.switch_option,
             "special_layer": self.special_layer
@@ -261,38 +456,38 @@ class ProtocolHallEffect(BaseProtocol):
         
         return he_config
     
-    def restore_hall_effect(self, hall_effect_data):
-        self.input_priority_pairs = hall_effect_data["input_priority_pairs"]
-        self.switch_option = hall_effect_data["switch_option"]
-        self.special_layer = hall_effect_data["special_layer"]
-
-        loaded_matrix = hall_effect_data["actuation_matrix"]
-        deserialized_matrix = []
-        
-        for profile_list in loaded_matrix:
-            new_profile = []
-            for row_list in profile_list:
-                new_row = []
-                for config_dict in row_list:
-                    config_obj = ActuationConfig.from_dict(config_dict)
-                    new_row.append(config_obj)
-                new_profile.append(new_row)
-            deserialized_matrix.append(new_profile)
-            
-        self.actuation_matrix = deserialized_matrix
-
-        for p in range(2):
-            profile_list = []
-            for r in range(self.rows):
-                row_list = []
-                for c in range(self.cols):
-                    self.set_actuation_config(p, r, c)
-
-        for i in range(len(self.input_priority_pairs)):
-            self.set_input_priority_pair(i)
-
-        for i in range(len(self.input_priority_pairs), 8):
-            self.set_empty_input_priority_pair(i)
-
-        self.set_switch_option()
-        self.set_special_layer()
\ No newline at end of file
+    def plan_restore_hall_effect(self, hall_effect_data):
+        if not hall_effect_data:
+            return RestoreSection("hall_effect")
+
+        matrix = ActuationMatrix.from_list(HE_PROFILES, self.rows, self.cols, hall_effect_data["actuation_matrix"])
+        runs, requests = self.plan_actuation_writes(matrix)
+        actuation_requests = len(requests)
+
+        # pairs are stored from the first slot on and every slot after the last one is kept empty
+        def slots(pairs):
+            return [tuple(pair) for pair in pairs] + [(255,) * 6] * (HE_INPUT_PRIORITY_PAIRS - len(pairs))
+
+        pairs = [tuple(pair) for pair in hall_effect_data["input_priority_pairs"]]
+        current = slots(self.input_priority_pairs) if isinstance(self.input_priority_pairs, list) else None
+        for index, pair in enumerate(slots(pairs)):
+            if current is None or current[index] != pair:
+                requests.append(struct.pack("BBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_HE_INPUT_PRIORITY_PAIR, index)
+                                + struct.pack("BBBBBB", *pair))
+
+        switch_option = hall_effect_data["switch_option"]
+        if switch_option != self.switch_option:
+            requests.append(struct.pack("BBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_HE_SWITCH, switch_option))
+
+        special_layer = hall_effect_data["special_layer"]
+        if special_layer != self.special_layer:
+            requests.append(struct.pack("BBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_HE_SPECIAL_LAYER, special_layer))
+
+        def apply(responses):
+            self.actuation_matrix = matrix
+            self.actuation_written(matrix, runs, requests[:actuation_requests], responses[:actuation_requests])
+            self.input_priority_pairs = pairs
+            self.switch_option = switch_option
+            self.special_layer = special_layer
+
+        return RestoreSection("hall_effect", requests, apply=apply)
@@ -105,9 +105,13 @@ class ProtocolKeyOverride(BaseProtocol):
     def save_key_override(self):
         return [e.save() for e in self.key_override_entries]
 
-    def restore_key_override(self, data):
-        for x, e in enumerate(data):
-            if x < self.key_override_count:
-                ko = KeyOverrideEntry()
-                ko.restore(e)
-                self.key_override_set(x, ko)
+    def plan_restore_key_override(self, data):
+        entries = []
+        for e in data:
+            ko = KeyOverrideEntry()
+            ko.restore(e)
+            entries.append(ko)
+        return self._plan_dynamic_entries(
+            "key_override", DYNAMIC_VIAL_KEY_OVERRIDE_SET, self.key_override_entries, entries,
+            KeyOverrideEntry.serialize, lambda e: e.replacement == RESET_KEYCODE
+        )
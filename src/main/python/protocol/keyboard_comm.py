@@ -10,24 +10,41 @@ from protocol.alt_repeat_key import ProtocolAltRepeatKey
 from protocol.combo import ProtocolCombo
 from protocol.constants import CMD_VIA_GET_PROTOCOL_VERSION, CMD_VIA_GET_KEYBOARD_VALUE, CMD_VIA_SET_KEYBOARD_VALUE, \
     CMD_VIA_SET_KEYCODE, CMD_VIA_LIGHTING_SET_VALUE, CMD_VIA_LIGHTING_GET_VALUE, CMD_VIA_LIGHTING_SAVE, \
-    CMD_VIA_GET_LAYER_COUNT, CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_VIAL_PREFIX, VIA_LAYOUT_OPTIONS, \
+    CMD_VIA_GET_LAYER_COUNT, CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_KEYMAP_SET_BUFFER, CMD_VIA_VIAL_PREFIX, VIA_LAYOUT_OPTIONS, \
     VIA_SWITCH_MATRIX_STATE, QMK_BACKLIGHT_BRIGHTNESS, QMK_BACKLIGHT_EFFECT, QMK_RGBLIGHT_BRIGHTNESS, \
     QMK_RGBLIGHT_EFFECT, QMK_RGBLIGHT_EFFECT_SPEED, QMK_RGBLIGHT_COLOR, VIALRGB_GET_INFO, VIALRGB_GET_MODE, \
     VIALRGB_GET_SUPPORTED, VIALRGB_SET_MODE, CMD_VIAL_GET_KEYBOARD_ID, CMD_VIAL_GET_SIZE, CMD_VIAL_GET_DEFINITION, \
     CMD_VIAL_GET_ENCODER, CMD_VIAL_SET_ENCODER, CMD_VIAL_GET_UNLOCK_STATUS, CMD_VIAL_UNLOCK_START, CMD_VIAL_UNLOCK_POLL, \
     CMD_VIAL_LOCK, CMD_VIAL_QMK_SETTINGS_QUERY, CMD_VIAL_QMK_SETTINGS_GET, CMD_VIAL_QMK_SETTINGS_SET, \
     CMD_VIAL_QMK_SETTINGS_RESET, BUFFER_FETCH_CHUNK, VIAL_PROTOCOL_QMK_SETTINGS
+from protocol.definition_cache import cacheable
 from protocol.dynamic import ProtocolDynamic
 from protocol.key_override import ProtocolKeyOverride
+from protocol.restore_plan import RestorePlan, RestoreSection
 from protocol.macro import ProtocolMacro
 from protocol.tap_dance import ProtocolTapDance
 from protocol.hall_effect import ProtocolHallEffect
+from protocol.transport import HidTransport, DEFAULT_WINDOW
 from unlocker import Unlocker
-from util import MSG_LEN, hid_send
+from util import MSG_LEN, hid_send, changed_runs
 
 SUPPORTED_VIA_PROTOCOL = [-1, 9]
 SUPPORTED_VIAL_PROTOCOL = [-1, 0, 1, 2, 3, 4, 5, 6]
 
+# bytes at the end of a cached definition which are checked against the keyboard before it is trusted
+DEFINITION_VALIDATION_TAIL = 64
+
+# stages of Keyboard.reload, in the order they complete
+STAGE_LAYOUT = "layout"
+STAGE_KEYMAP = "keymap"
+STAGE_MACROS = "macros"
+STAGE_DYNAMIC = "dynamic"
+STAGE_HALL_EFFECT = "hall_effect"
+RELOAD_STAGES = [STAGE_LAYOUT, STAGE_KEYMAP, STAGE_MACROS, STAGE_DYNAMIC, STAGE_HALL_EFFECT]
+
+# requests execute_restore pipelines before reporting progress, nothing is in flight while progress is reported
+RESTORE_BATCH = 64
+
 
 class ProtocolError(Exception):
     pass
@@ -36,10 +53,12 @@ class ProtocolError(Exception):
 class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo, ProtocolKeyOverride, ProtocolAltRepeatKey, ProtocolHallEffect):
     """ Low-level communication with a vial-enabled keyboard """
 
-    def __init__(self, dev, usb_send=hid_send):
+    def __init__(self, dev, usb_send=hid_send, window=DEFAULT_WINDOW, policy=None, definition_cache=None):
         self.dev = dev
-        self.usb_send = usb_send
+        self.transport = HidTransport(usb_send, window=window, policy=policy)
+        self.usb_send = self.transport.send
         self.definition = None
+        self.definition_cache = definition_cache
 
         # n.b. using OrderedDict here to make order of layout requests consistent for tests
         self.rowcol = OrderedDict()
@@ -47,6 +66,7 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
         self.encoder_count = 0
         self.layout = dict()
         self.encoder_layout = dict()
+        self.keymap_buffer = bytearray()
         self.rows = self.cols = self.layers = 0
         self.layout_labels = None
         self.layout_options = -1
@@ -70,35 +90,49 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
 
         self.via_protocol = self.vial_protocol = self.keyboard_id = -1
 
-    def reload(self, sideload_json=None):
-        """ Load information about the keyboard: number of layers, physical key layout """
+    def reload(self, sideload_json=None, progress=None, run_on_gui=None):
+        """
+            Load information about the keyboard: number of layers, physical key layout
+
+            The state is loaded in stages (see RELOAD_STAGES). If progress is given, it is called as
+            progress(done, total, stage) after every step; stage names the stage which that step completed,
+            or is None. The callback may raise to abort the reload.
+
+            When reloading away from the GUI thread, run_on_gui(fn) must run fn on the GUI thread and wait for it.
+            It is used for replacing the global keycode tables, which the GUI reads at any time.
+        """
+
+        if run_on_gui is None:
+            run_on_gui = lambda fn: fn()
 
         self.rowcol = OrderedDict()
         self.encoderpos = OrderedDict()
         self.layout = dict()
         self.encoder_layout = dict()
 
-        self.reload_layout(sideload_json)
-        self.reload_layers()
-
-        self.reload_macros_early()
-        self.reload_persistent_rgb()
-        self.reload_rgb()
-        self.reload_settings()
-
-        self.reload_dynamic()
-
-        # based on the number of macros, tapdance, etc, this will generate global keycode arrays
-        recreate_keyboard_keycodes(self)
-
-        # at this stage we have correct keycode info and can reload everything that depends on keycodes
-        self.reload_keymap()
-        self.reload_macros_late()
-        self.reload_tap_dance()
-        self.reload_combo()
-        self.reload_key_override()
-        self.reload_alt_repeat_key()
-        self.reload_hall_effect()
+        steps = [
+            (lambda: self.reload_layout(sideload_json), None),
+            (self.reload_layers, None),
+            (self.reload_macros_early, None),
+            (self.reload_persistent_rgb, None),
+            (self.reload_rgb, None),
+            (self.reload_settings, None),
+            (self.reload_dynamic, None),
+            # based on the number of macros, tapdance, etc, this will generate global keycode arrays
+            (lambda: run_on_gui(lambda: recreate_keyboard_keycodes(self)), STAGE_LAYOUT),
+            # at this stage we have correct keycode info and can reload everything that depends on keycodes
+            (self.reload_keymap, STAGE_KEYMAP),
+            (self.reload_macros_late, STAGE_MACROS),
+            (self.reload_tap_dance, None),
+            (self.reload_combo, None),
+            (self.reload_key_override, None),
+            (self.reload_alt_repeat_key, STAGE_DYNAMIC),
+            (self.reload_hall_effect, STAGE_HALL_EFFECT),
+        ]
+        for x, (step, stage) in enumerate(steps):
+            step()
+            if progress is not None:
+                progress(x + 1, len(steps), stage)
 
     def reload_layers(self):
         """ Get how many layers the keyboard has """
@@ -131,19 +165,12 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
             data = self.usb_send(self.dev, struct.pack("BB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_SIZE), retries=20)
             sz = struct.unpack("<I", data[0:4])[0]
 
-            # get the payload
-            payload = b""
-            block = 0
-            while sz > 0:
-                data = self.usb_send(self.dev, struct.pack("<BBI", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_DEFINITION, block),
-                                     retries=20)
-                if sz < MSG_LEN:
-                    data = data[:sz]
-                payload += data
-                block += 1
-                sz -= MSG_LEN
-
-            payload = json.loads(lzma.decompress(payload))
+            payload = self.load_cached_definition(sz)
+            if payload is None:
+                compressed, payload = self.download_definition(sz)
+                payload = json.loads(payload)
+                if self.definition_cache is not None and cacheable(self.keyboard_id):
+                    self.definition_cache.put(self.keyboard_id, sz, compressed)
 
         self.check_protocol_version()
 
@@ -195,34 +222,94 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
                 idx, opt = key.labels[8].split(",")
                 key.layout_index, key.layout_option = int(idx), int(opt)
 
+    def definition_blocks(self, blocks, sz):
+        """ Requests the given blocks of the compressed definition, yields them in order """
+
+        for block, data in zip(blocks, self.transport.iter_many(
+                self.dev, (struct.pack("<BBI", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_DEFINITION, block)
+                           for block in blocks), retries=20)):
+            yield data[:min(MSG_LEN, sz - block * MSG_LEN)]
+
+    def download_definition(self, sz):
+        """
+            Downloads the compressed definition, returns it together with the decompressed one
+
+            Blocks are decompressed as they arrive, so that decompression overlaps the transfer. Like
+            lzma.decompress, anything following the end of the xz stream is ignored.
+        """
+
+        compressed = bytearray(sz)
+        decompressor = lzma.LZMADecompressor()
+        out = []
+        offset = 0
+        for data in self.definition_blocks(range((sz + MSG_LEN - 1) // MSG_LEN), sz):
+            compressed[offset:offset + len(data)] = data
+            offset += len(data)
+            if not decompressor.eof:
+                out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise lzma.LZMAError("keyboard definition is truncated")
+        return bytes(compressed), b"".join(out)
+
+    def load_cached_definition(self, sz):
+        """ Returns the parsed definition from the cache, None if it has to be downloaded """
+
+        cache = self.definition_cache
+        if cache is None or not cacheable(self.keyboard_id):
+            return None
+        compressed = cache.get(self.keyboard_id, sz)
+        if compressed is None:
+            return None
+
+        if cache.needs_validation(self.keyboard_id, sz):
+            # the tail of an xz stream holds the checksum of the whole uncompressed definition, so comparing
+            # the blocks covering it catches a reflashed keyboard at the cost of a few requests
+            blocks = range(max(0, sz - DEFINITION_VALIDATION_TAIL) // MSG_LEN, (sz + MSG_LEN - 1) // MSG_LEN)
+            for block, data in zip(blocks, self.definition_blocks(blocks, sz)):
+                if data != compressed[block * MSG_LEN:block * MSG_LEN + len(data)]:
+                    cache.discard(self.keyboard_id, sz)
+                    return None
+
+        try:
+            payload = json.loads(lzma.decompress(compressed))
+        except (lzma.LZMAError, ValueError):
+            cache.discard(self.keyboard_id, sz)
+            return None
+        cache.mark_valid(self.keyboard_id, sz)
+        return payload
+
     def reload_keymap(self):
         """ Load current key mapping from the keyboard """
 
         keymap = b""
         # calculate what the size of keymap will be and retrieve the entire binary buffer
         size = self.layers * self.rows * self.cols * 2
-        for x in range(0, size, BUFFER_FETCH_CHUNK):
-            offset = x
+        offsets = range(0, size, BUFFER_FETCH_CHUNK)
+        responses = self.transport.send_many(
+            self.dev, [struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, offset, min(size - offset, BUFFER_FETCH_CHUNK))
+                       for offset in offsets], retries=20)
+        for offset, data in zip(offsets, responses):
             sz = min(size - offset, BUFFER_FETCH_CHUNK)
-            data = self.usb_send(self.dev, struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, offset, sz), retries=20)
             keymap += data[4:4+sz]
+        # raw copy of what the keyboard holds, write_keymap only sends the parts which differ from it
+        self.keymap_buffer = bytearray(keymap)
 
         for layer in range(self.layers):
             for row, col in self.rowcol.keys():
                 if row >= self.rows or col >= self.cols:
                     raise RuntimeError("malformed vial.json, key references {},{} but matrix declares rows={} cols={}"
                                        .format(row, col, self.rows, self.cols))
-                # determine where this (layer, row, col) will be located in keymap array
-                offset = layer * self.rows * self.cols * 2 + row * self.cols * 2 + col * 2
+                offset = self.keymap_offset(layer, row, col)
                 keycode = Keycode.serialize(struct.unpack(">H", keymap[offset:offset+2])[0])
                 self.layout[(layer, row, col)] = keycode
 
-        for layer in range(self.layers):
-            for idx in self.encoderpos:
-                data = self.usb_send(self.dev, struct.pack("BBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_ENCODER, layer, idx),
-                                     retries=20)
-                self.encoder_layout[(layer, idx, 0)] = Keycode.serialize(struct.unpack(">H", data[0:2])[0])
-                self.encoder_layout[(layer, idx, 1)] = Keycode.serialize(struct.unpack(">H", data[2:4])[0])
+        positions = [(layer, idx) for layer in range(self.layers) for idx in self.encoderpos]
+        responses = self.transport.send_many(
+            self.dev, [struct.pack("BBBB", CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_ENCODER, layer, idx)
+                       for layer, idx in positions], retries=20)
+        for (layer, idx), data in zip(positions, responses):
+            self.encoder_layout[(layer, idx, 0)] = Keycode.serialize(struct.unpack(">H", data[0:2])[0])
+            self.encoder_layout[(layer, idx, 1)] = Keycode.serialize(struct.unpack(">H", data[2:4])[0])
 
         if self.layout_labels:
             data = self.usb_send(self.dev, struct.pack("BB", CMD_VIA_GET_KEYBOARD_VALUE, VIA_LAYOUT_OPTIONS),
@@ -301,26 +388,68 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
                 if qsid != 0xFFFF:
                     self.supported_settings.add(qsid)
 
-        for qsid in self.supported_settings:
-            from editor.qmk_settings import QmkSettings
-
-            if not QmkSettings.is_qsid_supported(qsid):
-                continue
+        from editor.qmk_settings import QmkSettings
 
-            data = self.usb_send(self.dev, struct.pack("<BBH", CMD_VIA_VIAL_PREFIX, CMD_VIAL_QMK_SETTINGS_GET, qsid),
-                                 retries=20)
+        qsids = [qsid for qsid in self.supported_settings if QmkSettings.is_qsid_supported(qsid)]
+        responses = self.transport.send_many(
+            self.dev, [struct.pack("<BBH", CMD_VIA_VIAL_PREFIX, CMD_VIAL_QMK_SETTINGS_GET, qsid) for qsid in qsids],
+            retries=20)
+        for qsid, data in zip(qsids, responses):
             if data[0] == 0:
                 self.settings[qsid] = QmkSettings.qsid_deserialize(qsid, data[1:])
 
+    def keymap_offset(self, layer, row, col):
+        """ Where (layer, row, col) is located in the keymap buffer """
+        return (layer * self.rows * self.cols + row * self.cols + col) * 2
+
     def set_key(self, layer, row, col, code):
         key = (layer, row, col)
         if self.layout[key] != code:
             if code == RESET_KEYCODE:
                 Unlocker.unlock(self)
 
-            self.usb_send(self.dev, struct.pack(">BBBBH", CMD_VIA_SET_KEYCODE, layer, row, col,
-                                                Keycode.deserialize(code)), retries=20)
+            kc = Keycode.deserialize(code)
+            self.usb_send(self.dev, struct.pack(">BBBBH", CMD_VIA_SET_KEYCODE, layer, row, col, kc), retries=20)
             self.layout[key] = code
+            struct.pack_into(">H", self.keymap_buffer, self.keymap_offset(layer, row, col), kc)
+
+    def set_keys(self, keys):
+        """ Sets many keys at once, keys maps (layer, row, col) to a keycode. Returns the number of requests sent """
+
+        keymap = bytearray(self.keymap_buffer)
+        for (layer, row, col), code in keys.items():
+            struct.pack_into(">H", keymap, self.keymap_offset(layer, row, col), Keycode.deserialize(code))
+        return self.write_keymap(keymap)
+
+    def write_keymap(self, keymap):
+        """
+            Writes a raw keymap buffer, only the ranges which differ from what the keyboard holds are sent,
+            up to BUFFER_FETCH_CHUNK bytes per request. Returns the number of requests sent.
+        """
+
+        return self.execute_restore(RestorePlan([self.plan_keymap_write(keymap)]))
+
+    def plan_keymap_write(self, keymap):
+        runs = list(changed_runs(self.keymap_buffer, keymap, 2, BUFFER_FETCH_CHUNK))
+        reset = struct.pack(">H", Keycode.deserialize(RESET_KEYCODE))
+        return RestoreSection(
+            "keymap",
+            [struct.pack(">BHB", CMD_VIA_KEYMAP_SET_BUFFER, offset, size) + keymap[offset:offset + size]
+             for offset, size in runs],
+            unlock=any(keymap[x:x + 2] == reset for offset, size in runs for x in range(offset, offset + size, 2)),
+            apply=lambda responses: self.apply_keymap(keymap, runs)
+        )
+
+    def apply_keymap(self, keymap, runs):
+        """ Updates keymap_buffer and layout with the ranges of keymap which were written """
+
+        for offset, size in runs:
+            self.keymap_buffer[offset:offset + size] = keymap[offset:offset + size]
+            for x in range(offset, offset + size, 2):
+                layer, pos = divmod(x // 2, self.rows * self.cols)
+                key = (layer,) + divmod(pos, self.cols)
+                if key in self.layout:
+                    self.layout[key] = Keycode.serialize(struct.unpack_from(">H", keymap, x)[0])
 
     def set_encoder(self, layer, index, direction, code):
         key = (layer, index, direction)
@@ -409,39 +538,114 @@ class Keyboard(ProtocolMacro, ProtocolDynamic, ProtocolTapDance, ProtocolCombo,
 
         return json.dumps(data).encode("utf-8")
 
-    def restore_layout(self, data):
-        """ Restores saved layout """
+    def plan_restore(self, data):
+        """ Works out the requests restoring a saved layout takes, without sending any of them """
 
         data = json.loads(data.decode("utf-8"))
 
-        # restore keymap
+        keymap = bytearray(self.keymap_buffer)
         for l, layer in enumerate(data["layout"]):
             for r, row in enumerate(layer):
                 for c, code in enumerate(row):
                     if (l, r, c) in self.layout:
-                        self.set_key(l, r, c, Keycode.serialize(Keycode.deserialize(code)))
-
-        # restore encoders
-        for l, layer in enumerate(data["encoder_layout"]):
+                        struct.pack_into(">H", keymap, self.keymap_offset(l, r, c), Keycode.deserialize(code))
+
+        return RestorePlan([
+            self.plan_keymap_write(keymap),
+            self.plan_restore_encoders(data["encoder_layout"]),
+            self.plan_restore_layout_options(data["layout_options"]),
+            self.plan_restore_macros(data.get("macro")),
+            self.plan_restore_tap_dance(data.get("tap_dance", [])),
+            self.plan_restore_combo(data.get("combo", [])),
+            self.plan_restore_key_override(data.get("key_override", [])),
+            self.plan_restore_alt_repeat_key(data.get("alt_repeat_key", [])),
+            self.plan_restore_hall_effect(data.get("hall_effect")),
+            self.plan_restore_settings(data.get("settings", dict())),
+        ])
+
+    def plan_restore_encoders(self, encoder_layout):
+        changed = []
+        for l, layer in enumerate(encoder_layout):
             for e, encoder in enumerate(layer):
-                self.set_encoder(l, e, 0, Keycode.serialize(Keycode.deserialize(encoder[0])))
-                self.set_encoder(l, e, 1, Keycode.serialize(Keycode.deserialize(encoder[1])))
+                for direction in range(2):
+                    key = (l, e, direction)
+                    code = Keycode.serialize(Keycode.deserialize(encoder[direction]))
+                    if key in self.encoder_layout and self.encoder_layout[key] != code:
+                        changed.append((key, code))
+
+        def apply(responses):
+            for key, code in changed:
+                self.encoder_layout[key] = code
+
+        return RestoreSection(
+            "encoders",
+            [struct.pack(">BBBBBH", CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_ENCODER, *key, Keycode.deserialize(code))
+             for key, code in changed],
+            unlock=any(code == RESET_KEYCODE for key, code in changed),
+            apply=apply
+        )
+
+    def plan_restore_layout_options(self, options):
+        if self.layout_options == -1 or self.layout_options == options:
+            return RestoreSection("layout_options")
+
+        def apply(responses):
+            self.layout_options = options
+
+        return RestoreSection("layout_options",
+                              [struct.pack(">BBI", CMD_VIA_SET_KEYBOARD_VALUE, VIA_LAYOUT_OPTIONS, options)],
+                              apply=apply)
+
+    def plan_restore_settings(self, settings):
+        from editor.qmk_settings import QmkSettings
 
-        self.set_layout_options(data["layout_options"])
-        self.restore_macros(data.get("macro"))
+        changed = [(int(qsid), value) for qsid, value in settings.items()
+                   if QmkSettings.is_qsid_supported(int(qsid)) and self.settings.get(int(qsid)) != value]
 
-        self.restore_tap_dance(data.get("tap_dance", []))
-        self.restore_combo(data.get("combo", []))
-        self.restore_key_override(data.get("key_override", []))
-        self.restore_alt_repeat_key(data.get("alt_repeat_key", []))
-        self.restore_hall_effect(data.get("hall_effect"))
+        def apply(responses):
+            for qsid, value in changed:
+                self.settings[qsid] = value
 
-        for qsid, value in data.get("settings", dict()).items():
-            from editor.qmk_settings import QmkSettings
+        return RestoreSection(
+            "settings",
+            [struct.pack("<BBH", CMD_VIA_VIAL_PREFIX, CMD_VIAL_QMK_SETTINGS_SET, qsid)
+             + QmkSettings.qsid_serialize(qsid, value) for qsid, value in changed],
+            apply=apply
+        )
 
-            qsid = int(qsid)
-            if QmkSettings.is_qsid_supported(qsid):
-                self.qmk_settings_set(qsid, value)
+    def execute_restore(self, plan, progress=None):
+        """
+            Sends every request of a RestorePlan in pipelined batches of RESTORE_BATCH, unlocking the keyboard
+            first if any of them needs it. progress(done, total, section) is called for every request once its
+            batch was answered, section is the name of the section which just completed or None. Returns the
+            number of requests sent.
+        """
+
+        if plan.unlock:
+            Unlocker.unlock(self)
+
+        sections = plan.sections
+        requests = [(section, msg) for section in sections for msg in section.requests]
+        responses = {section: [] for section in sections}
+        for section in sections:
+            if not section.requests:
+                section.apply([])
+
+        for start in range(0, len(requests), RESTORE_BATCH):
+            batch = requests[start:start + RESTORE_BATCH]
+            answers = self.transport.send_many(self.dev, [msg for section, msg in batch], retries=20)
+            for done, ((section, msg), data) in enumerate(zip(batch, answers), start=start + 1):
+                responses[section].append(data)
+                completed = len(responses[section]) == len(section.requests)
+                if completed:
+                    section.apply(responses[section])
+                if progress is not None:
+                    progress(done, len(requests), section.name if completed else None)
+        return len(requests)
+
+    def restore_layout(self, data, progress=None):
+        """ Restores saved layout """
+        return self.execute_restore(self.plan_restore(data), progress)
 
     def reset(self):
         self.usb_send(self.dev, struct.pack("B", 0xB))
@@ -1,3 +1,4 @@
+import re
 import struct
 
 from keycodes.keycodes import Keycode
@@ -7,8 +8,44 @@ from macro.macro_action_ui import tag_to_action
 from protocol.base_protocol import BaseProtocol
 from protocol.constants import CMD_VIA_MACRO_GET_COUNT, CMD_VIA_MACRO_GET_BUFFER_SIZE, CMD_VIA_MACRO_GET_BUFFER, \
     CMD_VIA_MACRO_SET_BUFFER, BUFFER_FETCH_CHUNK, VIAL_PROTOCOL_ADVANCED_MACROS
-from unlocker import Unlocker
-from util import chunks
+from protocol.restore_plan import RestoreSection
+from util import changed_runs
+
+
+# a run of plain text, up to the next byte which starts an action
+TEXT_RUN_V1 = re.compile(b"[^" + bytes([SS_TAP_CODE, SS_DOWN_CODE, SS_UP_CODE]) + b"]+")
+TEXT_RUN_V2 = re.compile(b"[^" + bytes([SS_QMK_PREFIX]) + b"]+")
+
+KEY_ACTIONS = {SS_TAP_CODE: ActionTap, SS_DOWN_CODE: ActionDown, SS_UP_CODE: ActionUp}
+EXT_KEY_ACTIONS = {VIAL_MACRO_EXT_TAP: SS_TAP_CODE, VIAL_MACRO_EXT_DOWN: SS_DOWN_CODE, VIAL_MACRO_EXT_UP: SS_UP_CODE}
+
+
+def append_key(sequence, act, kc):
+    """ Appends to the previous *_CODE entry if it's the same type, otherwise creates a new entry """
+    if sequence and isinstance(sequence[-1], list) and sequence[-1][0] == act:
+        sequence[-1][1].append(kc)
+    else:
+        sequence.append([act, [kc]])
+
+
+def append_text(sequence, text):
+    """ Appends to the previous text entry if there is one, otherwise creates a new entry """
+    if sequence and isinstance(sequence[-1], bytearray):
+        sequence[-1] += text
+    else:
+        sequence.append(bytearray(text))
+
+
+def sequence_to_actions(sequence):
+    out = []
+    for s in sequence:
+        if isinstance(s, bytearray):
+            out.append(ActionText(s.decode("latin-1")))
+        elif s[0] == SS_DELAY_CODE:
+            out.append(ActionDelay(s[1]))
+        else:
+            out.append(KEY_ACTIONS[s[0]]([Keycode.serialize(kc) for kc in s[1]]))
+    return out
 
 
 def macro_deserialize_v1(data):
@@ -16,39 +53,20 @@ def macro_deserialize_v1(data):
     Deserialize a single macro, protocol version 1
     """
 
-    out = []
     sequence = []
-    data = bytearray(data)
-    while len(data) > 0:
-        if data[0] in [SS_TAP_CODE, SS_DOWN_CODE, SS_UP_CODE]:
-            if len(data) < 2:
+    data = memoryview(bytes(data))
+    pos, end = 0, len(data)
+    while pos < end:
+        if data[pos] in KEY_ACTIONS:
+            if end - pos < 2:
                 break
-
-            # append to previous *_CODE if it's the same type, otherwise create a new entry
-            if len(sequence) > 0 and isinstance(sequence[-1], list) and sequence[-1][0] == data[0]:
-                sequence[-1][1].append(data[1])
-            else:
-                sequence.append([data[0], [data[1]]])
-
-            data.pop(0)
-            data.pop(0)
-        else:
-            # append to previous string if it is a string, otherwise create a new entry
-            ch = chr(data[0])
-            if len(sequence) > 0 and isinstance(sequence[-1], str):
-                sequence[-1] += ch
-            else:
-                sequence.append(ch)
-            data.pop(0)
-    for s in sequence:
-        if isinstance(s, str):
-            out.append(ActionText(s))
+            append_key(sequence, data[pos], data[pos + 1])
+            pos += 2
         else:
-            keycodes = s[1]
-            cls = {SS_TAP_CODE: ActionTap, SS_DOWN_CODE: ActionDown, SS_UP_CODE: ActionUp}[s[0]]
-            keycodes = [Keycode.serialize(kc) for kc in keycodes]
-            out.append(cls(keycodes))
-    return out
+            run = TEXT_RUN_V1.match(data, pos)
+            append_text(sequence, data[pos:run.end()])
+            pos = run.end()
+    return sequence_to_actions(sequence)
 
 
 def macro_deserialize_v2(data):
@@ -56,83 +74,43 @@ def macro_deserialize_v2(data):
     Deserialize a single macro, protocol version 2
     """
 
-    out = []
     sequence = []
-    data = bytearray(data)
-    while len(data) > 0:
-        if data[0] == SS_QMK_PREFIX:
-            if len(data) < 2:
+    data = memoryview(bytes(data))
+    pos, end = 0, len(data)
+    while pos < end:
+        if data[pos] == SS_QMK_PREFIX:
+            if end - pos < 2:
                 break
 
-            act = data[1]
-            if act in [SS_TAP_CODE, SS_DOWN_CODE, SS_UP_CODE,
-                       VIAL_MACRO_EXT_TAP, VIAL_MACRO_EXT_DOWN, VIAL_MACRO_EXT_UP]:
-                if act in [SS_TAP_CODE, SS_DOWN_CODE, SS_UP_CODE]:
-                    if len(data) < 3:
-                        break
-                    length = 3
-                    kc = data[2]
-                else:
-                    remap = {VIAL_MACRO_EXT_TAP: SS_TAP_CODE,
-                             VIAL_MACRO_EXT_DOWN: SS_DOWN_CODE,
-                             VIAL_MACRO_EXT_UP: SS_UP_CODE}
-                    act = remap[act]
-                    if len(data) < 4:
-                        break
-                    length = 4
-                    kc = struct.unpack("<H", data[2:4])[0]
-                    # see decode_keycode() in qmk
-                    if kc > 0xFF00:
-                        kc = (kc & 0xFF) << 8
-
-                # append to previous *_CODE if it's the same type, otherwise create a new entry
-                if len(sequence) > 0 and isinstance(sequence[-1], list) and sequence[-1][0] == act:
-                    sequence[-1][1].append(kc)
-                else:
-                    sequence.append([act, [kc]])
-
-                for x in range(length):
-                    data.pop(0)
+            act = data[pos + 1]
+            if act in KEY_ACTIONS:
+                if end - pos < 3:
+                    break
+                append_key(sequence, act, data[pos + 2])
+                pos += 3
+            elif act in EXT_KEY_ACTIONS:
+                if end - pos < 4:
+                    break
+                kc = data[pos + 2] | data[pos + 3] << 8
+                # see decode_keycode() in qmk
+                if kc > 0xFF00:
+                    kc = (kc & 0xFF) << 8
+                append_key(sequence, EXT_KEY_ACTIONS[act], kc)
+                pos += 4
             elif act == SS_DELAY_CODE:
-                if len(data) < 4:
+                if end - pos < 4:
                     break
-
                 # decode the delay
-                delay = (data[2] - 1) + (data[3] - 1) * 255
-                sequence.append([SS_DELAY_CODE, delay])
-
-                for x in range(4):
-                    data.pop(0)
+                sequence.append([SS_DELAY_CODE, (data[pos + 2] - 1) + (data[pos + 3] - 1) * 255])
+                pos += 4
             else:
                 # it is clearly malformed, just skip this byte and hope for the best
-                data.pop(0)
-                data.pop(0)
+                pos += 2
         else:
-            # append to previous string if it is a string, otherwise create a new entry
-            ch = chr(data[0])
-            if len(sequence) > 0 and isinstance(sequence[-1], str):
-                sequence[-1] += ch
-            else:
-                sequence.append(ch)
-            data.pop(0)
-    for s in sequence:
-
-        if isinstance(s, str):
-            out.append(ActionText(s))
-        else:
-            args = None
-            if s[0] in [SS_TAP_CODE, SS_DOWN_CODE, SS_UP_CODE]:
-                args = s[1]
-                if args is not None:
-                    args = [Keycode.serialize(kc) for kc in args]
-            elif s[0] == SS_DELAY_CODE:
-                args = s[1]
-
-            if args is not None:
-                cls = {SS_TAP_CODE: ActionTap, SS_DOWN_CODE: ActionDown, SS_UP_CODE: ActionUp,
-                       SS_DELAY_CODE: ActionDelay}[s[0]]
-                out.append(cls(args))
-    return out
+            run = TEXT_RUN_V2.match(data, pos)
+            append_text(sequence, data[pos:run.end()])
+            pos = run.end()
+    return sequence_to_actions(sequence)
 
 
 class ProtocolMacro(BaseProtocol):
@@ -147,14 +125,19 @@ class ProtocolMacro(BaseProtocol):
     def reload_macros_late(self):
         """ Load actual keycodes """
         self.macro = b""
+        # the buffer as read, what writes are diffed against
+        self.macro_raw = b""
         if self.macro_memory:
             # now retrieve the entire buffer, MACRO_CHUNK bytes at a time, as that is what fits into a packet
-            for x in range(0, self.macro_memory, BUFFER_FETCH_CHUNK):
+            offsets = range(0, self.macro_memory, BUFFER_FETCH_CHUNK)
+            requests = (struct.pack(">BHB", CMD_VIA_MACRO_GET_BUFFER, x, min(BUFFER_FETCH_CHUNK, self.macro_memory - x))
+                        for x in offsets)
+            for x, data in zip(offsets, self.transport.iter_many(self.dev, requests, retries=20)):
                 sz = min(BUFFER_FETCH_CHUNK, self.macro_memory - x)
-                data = self.usb_send(self.dev, struct.pack(">BHB", CMD_VIA_MACRO_GET_BUFFER, x, sz), retries=20)
                 self.macro += data[4:4 + sz]
                 if self.macro.count(b"\x00") > self.macro_count:
                     break
+            self.macro_raw = self.macro
             # macros are stored as NUL-separated strings, so let's clean up the buffer
             # ensuring we only get macro_count strings after we split by NUL
             macros = self.macro.split(b"\x00") + [b""] * self.macro_count
@@ -166,14 +149,24 @@ class ProtocolMacro(BaseProtocol):
         self.reload_macros_late()
 
     def set_macro(self, data):
+        """ Writes the parts of the macro buffer which changed, returns the number of bytes written """
+
         if len(data) > self.macro_memory:
             raise RuntimeError("the macro is too big: got {} max {}".format(len(data), self.macro_memory))
 
-        for x, chunk in enumerate(chunks(data, BUFFER_FETCH_CHUNK)):
-            off = x * BUFFER_FETCH_CHUNK
-            self.usb_send(self.dev, struct.pack(">BHB", CMD_VIA_MACRO_SET_BUFFER, off, len(chunk)) + chunk,
-                          retries=20)
-        self.macro = data
+        requests = self.macro_write_requests(data)
+        self.transport.send_many(self.dev, requests, retries=20)
+        self.macro = self.macro_raw = data
+        return sum(len(request) - 4 for request in requests)
+
+    def macro_write_requests(self, data):
+        """
+            Requests writing the ranges of data which differ from the buffer on the keyboard
+
+            Bytes past what was read back from the keyboard are unknown and always written.
+        """
+        return [struct.pack(">BHB", CMD_VIA_MACRO_SET_BUFFER, offset, size) + data[offset:offset + size]
+                for offset, size in changed_runs(self.macro_raw, data, 1, BUFFER_FETCH_CHUNK)]
 
     def save_macro(self):
         macros = self.macros_deserialize(self.macro)
@@ -182,9 +175,9 @@ class ProtocolMacro(BaseProtocol):
             out.append([act.save() for act in macro])
         return out
 
-    def restore_macros(self, macros):
+    def plan_restore_macros(self, macros):
         if not isinstance(macros, list):
-            return
+            return RestoreSection("macros")
 
         full_macro = []
         for macro in macros:
@@ -200,9 +193,13 @@ class ProtocolMacro(BaseProtocol):
         full_macro = full_macro[:self.macro_count]
         # TODO: log a warning if macro is cutoff
         data = self.macros_serialize(full_macro)[0:self.macro_memory]
-        if data != self.macro:
-            Unlocker.unlock(self)
-            self.set_macro(data)
+        if data == self.macro:
+            return RestoreSection("macros")
+
+        def apply(responses):
+            self.macro = self.macro_raw = data
+
+        return RestoreSection("macros", self.macro_write_requests(data), unlock=True, apply=apply)
 
     def macro_serialize(self, macro):
         """
@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+
+class RestoreSection:
+    """
+        Requests which bring one part of the keyboard state in line with a saved layout
+
+        unlock is set when one of the requests would be refused by a locked keyboard. apply is called with the
+        responses once the requests were sent (None for every one of them when nothing was sent) and updates
+        the state Keyboard keeps in memory.
+    """
+
+    def __init__(self, name, requests=None, unlock=False, apply=None):
+        self.name = name
+        self.requests = requests or []
+        self.unlock = unlock
+        self.apply = apply or (lambda responses: None)
+
+    def __repr__(self):
+        return "{}={}{}".format(self.name, len(self.requests), " (unlock)" if self.unlock else "")
+
+
+class RestorePlan:
+    """ Everything restoring a saved layout takes, built by Keyboard.plan_restore without talking to the keyboard """
+
+    def __init__(self, sections):
+        self.sections = sections
+
+    @property
+    def packets(self):
+        return sum(len(section.requests) for section in self.sections)
+
+    @property
+    def unlock(self):
+        return any(section.unlock for section in self.sections)
+
+    def report(self):
+        """ Returns a list of (section name, number of requests) """
+        return [(section.name, len(section.requests)) for section in self.sections]
+
+    def __repr__(self):
+        return "RestorePlan<packets={} {}>".format(self.packets, " ".join(repr(s) for s in self.sections))
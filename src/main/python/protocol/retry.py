@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import random
+import time
+
+from protocol.constants import CMD_VIA_VIAL_PREFIX, CMD_VIA_GET_KEYCODE, CMD_VIA_SET_KEYCODE, \
+    CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_MACRO_GET_BUFFER, CMD_VIA_MACRO_SET_BUFFER, CMD_VIAL_GET_ENCODER, \
+    CMD_VIAL_SET_ENCODER, CMD_VIAL_DYNAMIC_ENTRY_OP, CMD_VIAL_GET_HE_ACTUATION_CONFIG, CMD_VIAL_SET_HE_ACTUATION_BULK, \
+    CMD_VIA_SET_KEYBOARD_VALUE, CMD_VIAL_QMK_SETTINGS_SET, CMD_VIAL_QMK_SETTINGS_RESET, CMD_VIA_KEYMAP_SET_BUFFER
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CommandBudget:
+    """
+        How much effort a class of commands is worth
+
+        attempts caps the number of tries regardless of what the caller asked for, deadline_ms caps the total
+        time spent on one request including backoff sleeps and min_timeout_ms is the shortest read timeout
+        the adaptive estimate may shrink to, for commands that make the firmware write to EEPROM.
+    """
+
+    def __init__(self, attempts=None, deadline_ms=None, min_timeout_ms=None):
+        self.attempts = attempts
+        self.deadline_ms = deadline_ms
+        self.min_timeout_ms = min_timeout_ms
+
+
+def command_class(msg):
+    """ Groups a request into the command class its budget is looked up by """
+
+    cmd = msg[0]
+    if cmd in [CMD_VIA_SET_KEYCODE, CMD_VIA_KEYMAP_SET_BUFFER, CMD_VIA_SET_KEYBOARD_VALUE]:
+        return "write"
+    if cmd in [CMD_VIA_GET_KEYCODE, CMD_VIA_KEYMAP_GET_BUFFER]:
+        return "keymap"
+    if cmd in [CMD_VIA_MACRO_GET_BUFFER, CMD_VIA_MACRO_SET_BUFFER]:
+        return "macro"
+    if cmd == CMD_VIA_VIAL_PREFIX and len(msg) > 1:
+        sub = msg[1]
+        if sub in [CMD_VIAL_SET_ENCODER, CMD_VIAL_QMK_SETTINGS_SET, CMD_VIAL_QMK_SETTINGS_RESET]:
+            return "write"
+        if sub == CMD_VIAL_GET_ENCODER:
+            return "keymap"
+        if sub == CMD_VIAL_DYNAMIC_ENTRY_OP:
+            return "dynamic"
+        if CMD_VIAL_GET_HE_ACTUATION_CONFIG <= sub <= CMD_VIAL_SET_HE_ACTUATION_BULK:
+            return "hall_effect"
+    return "default"
+
+
+class RetryPolicy:
+    """
+        Decides read timeouts and retry pacing for HID requests
+
+        The response latency of the device is learned from requests that succeed on the first attempt
+        (smoothed round trip time and its variance, the same estimator TCP uses) and the read timeout follows it.
+        Failed attempts are retried after an exponentially growing, fully jittered sleep. Once `breaker_threshold`
+        requests in a row have failed outright the circuit breaker opens and further requests fail immediately
+        until `breaker_cooldown_ms` has passed, after which a single request is let through to probe the device.
+    """
+
+    def __init__(self, initial_timeout_ms=500, min_timeout_ms=50, max_timeout_ms=500,
+                 backoff_base_ms=10, backoff_max_ms=250, breaker_threshold=3, breaker_cooldown_ms=2000,
+                 budgets=None, seed=None):
+        self.initial_timeout_ms = initial_timeout_ms
+        self.min_timeout_ms = min_timeout_ms
+        self.max_timeout_ms = max_timeout_ms
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_ms = breaker_cooldown_ms
+
+        self.budgets = {
+            "default": CommandBudget(deadline_ms=5000),
+            "keymap": CommandBudget(deadline_ms=3000),
+            "write": CommandBudget(deadline_ms=3000, min_timeout_ms=250),
+            "macro": CommandBudget(deadline_ms=5000, min_timeout_ms=250),
+            "dynamic": CommandBudget(deadline_ms=3000, min_timeout_ms=100),
+            "hall_effect": CommandBudget(attempts=5, deadline_ms=1000, min_timeout_ms=100),
+        }
+        if budgets is not None:
+            self.budgets.update(budgets)
+
+        self.random = random.Random(seed)
+
+        self.srtt = None
+        self.rttvar = None
+        self.consecutive_failures = 0
+        self.open_until = None
+
+    def budget(self, msg):
+        return self.budgets.get(command_class(msg), self.budgets["default"])
+
+    def attempts(self, msg, retries):
+        budget = self.budget(msg)
+        if budget.attempts is not None:
+            return max(1, min(retries, budget.attempts))
+        return max(1, retries)
+
+    def deadline(self, msg):
+        """ Returns the monotonic time by which a request must have succeeded, or None """
+        budget = self.budget(msg)
+        if budget.deadline_ms is None:
+            return None
+        return time.monotonic() + budget.deadline_ms / 1000
+
+    def read_timeout_ms(self, msg=None, attempt=0):
+        """ Read timeout for the given attempt at a request, doubled on every retry """
+
+        if self.srtt is None:
+            timeout = self.initial_timeout_ms
+        else:
+            timeout = self.srtt + 4 * self.rttvar
+        floor = self.min_timeout_ms
+        if msg is not None and self.budget(msg).min_timeout_ms is not None:
+            floor = max(floor, self.budget(msg).min_timeout_ms)
+        timeout = max(floor, timeout) * (2 ** attempt)
+        return int(min(self.max_timeout_ms, timeout))
+
+    def backoff_ms(self, attempt):
+        """ Sleep before retry number `attempt` (starting from 1) """
+        cap = min(self.backoff_max_ms, self.backoff_base_ms * (2 ** (attempt - 1)))
+        return self.random.uniform(0, cap)
+
+    def sleep_before_retry(self, attempt, deadline=None):
+        """ Sleeps before the next attempt, returns False if that would run past the deadline """
+        delay = self.backoff_ms(attempt) / 1000
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def record_latency(self, latency_ms):
+        if self.srtt is None:
+            self.srtt = latency_ms
+            self.rttvar = latency_ms / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - latency_ms)
+            self.srtt = 0.875 * self.srtt + 0.125 * latency_ms
+
+    def check_circuit(self):
+        """ Raises CircuitOpenError while the breaker is open """
+        if self.open_until is None:
+            return
+        if time.monotonic() < self.open_until:
+            raise CircuitOpenError("device is not responding, giving up until it recovers")
+        # half-open: let the next request through, one more failure opens the breaker again
+        self.open_until = None
+        self.consecutive_failures = self.breaker_threshold - 1
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.breaker_threshold:
+            self.open_until = time.monotonic() + self.breaker_cooldown_ms / 1000
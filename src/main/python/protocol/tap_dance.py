@@ -40,7 +40,10 @@ class ProtocolTapDance(BaseProtocol):
             tap_dance.append((entry[0], entry[1], entry[2], entry[3], entry[4]))
         return tap_dance
 
-    def restore_tap_dance(self, data):
-        for x, e in enumerate(data):
-            if x < self.tap_dance_count:
-                self.tap_dance_set(x, e)
+    def plan_restore_tap_dance(self, data):
+        entries = [tuple(Keycode.serialize(Keycode.deserialize(kc)) for kc in e[:4]) + (e[4],) for e in data]
+        return self._plan_dynamic_entries(
+            "tap_dance", DYNAMIC_VIAL_TAP_DANCE_SET, self.tap_dance_entries, entries,
+            lambda e: struct.pack("<HHHHH", *(Keycode.deserialize(kc) for kc in e[:4]), e[4]),
+            lambda e: RESET_KEYCODE in e[:4]
+        )
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import json
+import time
+from bisect import bisect_left
+
+from protocol import constants
+from protocol.constants import CMD_VIA_VIAL_PREFIX
+
+# upper bounds of latency histogram buckets in milliseconds, the last bucket collects everything slower
+LATENCY_BUCKETS_MS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+VIA_COMMAND_NAMES = {value: name for name, value in vars(constants).items()
+                     if name.startswith("CMD_VIA_") and name != "CMD_VIA_VIAL_PREFIX"}
+VIAL_COMMAND_NAMES = {value: name for name, value in vars(constants).items() if name.startswith("CMD_VIAL_")}
+
+
+def command_key(msg):
+    """ Vial commands are keyed by their sub-command, VIA commands by the command byte """
+    if msg[0] == CMD_VIA_VIAL_PREFIX and len(msg) > 1:
+        return CMD_VIA_VIAL_PREFIX << 8 | msg[1]
+    return msg[0]
+
+
+def command_name(key):
+    if key > 0xFF:
+        return VIAL_COMMAND_NAMES.get(key & 0xFF, "CMD_VIAL_0x{:02X}".format(key & 0xFF))
+    return VIA_COMMAND_NAMES.get(key, "CMD_VIA_0x{:02X}".format(key))
+
+
+class CommandStats:
+
+    __slots__ = ["count", "bytes_out", "bytes_in", "total_ms", "max_ms", "timeouts", "retries", "failures",
+                 "histogram"]
+
+    def __init__(self):
+        self.count = self.bytes_out = self.bytes_in = 0
+        self.total_ms = self.max_ms = 0.0
+        self.timeouts = self.retries = self.failures = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0,
+            "max_ms": round(self.max_ms, 3),
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "failures": self.failures,
+            "histogram": self.histogram[:],
+        }
+
+
+class HidTelemetry:
+    """
+        Per-command counters for HID traffic: calls, bytes moved, latency histogram, timeouts and retries
+
+        Recording a request costs a dict lookup and a handful of integer updates, so it is always on.
+    """
+
+    def __init__(self):
+        self.stats = dict()
+        self.started = time.time()
+
+    def reset(self):
+        self.stats = dict()
+        self.started = time.time()
+
+    def record(self, msg, data, latency_ms, attempts=1, timeouts=0):
+        """ Records a request; data is the response or an empty bytes object if the request failed """
+
+        key = command_key(msg)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CommandStats()
+
+        stats.count += 1
+        stats.bytes_out += len(msg) * attempts
+        stats.bytes_in += len(data)
+        stats.total_ms += latency_ms
+        if latency_ms > stats.max_ms:
+            stats.max_ms = latency_ms
+        stats.histogram[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        stats.timeouts += timeouts
+        stats.retries += attempts - 1
+        if not data:
+            stats.failures += 1
+
+    def totals(self):
+        total = CommandStats()
+        for stats in self.stats.values():
+            for field in ["count", "bytes_out", "bytes_in", "total_ms", "timeouts", "retries", "failures"]:
+                setattr(total, field, getattr(total, field) + getattr(stats, field))
+            total.max_ms = max(total.max_ms, stats.max_ms)
+            total.histogram = [a + b for a, b in zip(total.histogram, stats.histogram)]
+        return total
+
+    def to_dict(self):
+        commands = []
+        for key, stats in sorted(self.stats.items(), key=lambda x: -x[1].total_ms):
+            out = stats.to_dict()
+            out["command"] = command_name(key)
+            out["id"] = "{:04X}".format(key) if key > 0xFF else "{:02X}".format(key)
+            commands.append(out)
+        return {
+            "started": self.started,
+            "histogram_buckets_ms": LATENCY_BUCKETS_MS,
+            "totals": self.totals().to_dict(),
+            "commands": commands,
+        }
+
+    def to_json(self, extra=None):
+        data = self.to_dict()
+        if extra is not None:
+            data.update(extra)
+        return json.dumps(data, indent=2)
@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import os
+import struct
+import time
+
+from util import MSG_LEN
+
+TRANSCRIPT_MAGIC = b"VIALHID1"
+
+# per record: latency of the request in microseconds, microseconds since the previous record, and the lengths of
+# the request and the response with trailing zero padding stripped; the two payloads follow the header
+RECORD_HEADER = struct.Struct("<IIBB")
+
+
+def strip_padding(data):
+    return bytes(data).rstrip(b"\x00")
+
+
+def clamp_us(seconds):
+    return max(0, min(0xFFFFFFFF, int(seconds * 1000000)))
+
+
+def unused_path(path):
+    """ Returns path, or path with the first numeric suffix that doesn't name an existing file """
+    root, ext = os.path.splitext(path)
+    suffix = 1
+    while os.path.exists(path):
+        path = "{}-{}{}".format(root, suffix, ext)
+        suffix += 1
+    return path
+
+
+class TranscriptRecord:
+
+    __slots__ = ["latency_us", "gap_us", "request", "response"]
+
+    def __init__(self, latency_us, gap_us, request, response):
+        self.latency_us = latency_us
+        self.gap_us = gap_us
+        self.request = request
+        self.response = response
+
+
+class TranscriptRecorder:
+    """
+        Writes every request and response of a session into a compact binary transcript
+
+        A response of zero length marks a request which failed outright.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(TRANSCRIPT_MAGIC)
+        self.last = time.monotonic()
+        self.count = 0
+
+    def record(self, msg, data, latency_ms):
+        now = time.monotonic()
+        request, response = strip_padding(msg), strip_padding(data)
+        # an all-zero response is still a response, keep one byte so it isn't mistaken for a failure
+        if data and not response:
+            response = b"\x00"
+        self.file.write(RECORD_HEADER.pack(clamp_us(latency_ms / 1000), clamp_us(now - self.last),
+                                           len(request), len(response)))
+        self.file.write(request)
+        self.file.write(response)
+        self.last = now
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_transcript(path):
+    with open(path, "rb") as inf:
+        data = inf.read()
+    if data[:len(TRANSCRIPT_MAGIC)] != TRANSCRIPT_MAGIC:
+        raise RuntimeError("{} is not a HID transcript".format(path))
+
+    records = []
+    offset = len(TRANSCRIPT_MAGIC)
+    while offset < len(data):
+        latency_us, gap_us, req_len, resp_len = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        request = data[offset:offset + req_len]
+        offset += req_len
+        response = data[offset:offset + resp_len]
+        offset += resp_len
+        records.append(TranscriptRecord(latency_us, gap_us, request, response))
+    return records
+
+
+class TranscriptReplay:
+    """
+        Serves a recorded transcript back to a Keyboard in place of the real device
+
+        Use as Keyboard(replay, usb_send=replay.usb_send). Requests are matched against the transcript in order;
+        if the client deviates from the recording, the next recorded occurrence of the same request is served,
+        and failing that any earlier one. With realtime=True responses are paced like the recording: every one
+        takes at least its recorded latency and isn't served before its recorded gap since the previous response
+        has passed, so a client faster than the recorded host waits like that host did. Otherwise the transcript
+        is served as fast as possible.
+    """
+
+    def __init__(self, records, realtime=False):
+        self.records = records
+        self.realtime = realtime
+        self.cursor = 0
+        self.misses = 0
+        # when the previous response was served, for realtime pacing
+        self.last = None
+
+        self.by_request = dict()
+        for idx, record in enumerate(records):
+            self.by_request.setdefault(record.request, []).append(idx)
+
+    @classmethod
+    def load(cls, path, realtime=False):
+        return cls(load_transcript(path), realtime)
+
+    def find(self, request):
+        if self.cursor < len(self.records) and self.records[self.cursor].request == request:
+            return self.cursor
+
+        self.misses += 1
+        candidates = self.by_request.get(request)
+        if not candidates:
+            raise RuntimeError("request {} is not in the transcript".format(request.hex()))
+        for idx in candidates:
+            if idx >= self.cursor:
+                return idx
+        return candidates[-1]
+
+    def pace(self, record):
+        """ Waits until the recorded response to record would have arrived """
+
+        now = time.monotonic()
+        # the gap runs from the previous response to this one, so it already includes this request's latency
+        target = now + record.latency_us / 1000000
+        if self.last is not None:
+            target = max(target, self.last + record.gap_us / 1000000)
+        time.sleep(target - now)
+        self.last = time.monotonic()
+
+    @staticmethod
+    def usb_send(dev, msg, retries=1):
+        idx = dev.find(strip_padding(msg))
+        record = dev.records[idx]
+        dev.cursor = idx + 1
+        if dev.realtime:
+            dev.pace(record)
+        if not record.response:
+            raise RuntimeError("failed to communicate with the device")
+        return record.response + b"\x00" * (MSG_LEN - len(record.response))
@@ -0,0 +1,268 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+import logging
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from protocol.constants import CMD_VIA_VIAL_PREFIX, CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_MACRO_GET_BUFFER
+from protocol.retry import RetryPolicy
+from protocol.telemetry import HidTelemetry
+from protocol.transcript import TranscriptRecorder
+from util import MSG_LEN, hid_send
+
+# how many requests can be outstanding at once on a device which tolerates pipelining
+DEFAULT_WINDOW = 8
+
+# read timeout used to flush stale responses out of the input queue
+DRAIN_READ_TIMEOUT_MS = 20
+# upper bound on how many stale responses we flush, OS input queues don't hold more than this
+DRAIN_LIMIT = 64
+
+
+def pad_message(msg):
+    if len(msg) > MSG_LEN:
+        raise RuntimeError("message must be less than 32 bytes")
+    return msg + b"\x00" * (MSG_LEN - len(msg))
+
+
+def response_matches(msg, data):
+    """ Checks whether a response could have been produced by the request """
+
+    # vial commands write their response from the first byte on, so they can only be matched by order
+    if msg[0] == CMD_VIA_VIAL_PREFIX:
+        return True
+    # buffer reads echo back the command, the offset and the size
+    if msg[0] in [CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_MACRO_GET_BUFFER]:
+        return data[0:4] == msg[0:4]
+    # every other VIA command echoes the command id, or replaces it with id_unhandled
+    return data[0] == msg[0]
+
+
+class TransportBusyError(RuntimeError):
+    pass
+
+
+class HidTransport:
+    """
+        Request engine underneath Keyboard.usb_send
+
+        Single requests are sent in lock-step, exactly as usb_send would. Batches passed to send_many/iter_many
+        are pipelined on devices which tolerate it: up to `window` requests are written before their responses
+        are read back and matched to the requests in order. Whether a device can be pipelined is probed on the
+        first batch; any mismatch or timeout afterwards drops the transport back to lock-step for good.
+
+        Read timeouts and retries on raw devices are governed by the RetryPolicy, and every request is
+        accounted for in the HidTelemetry and, if recording was started, written to a transcript.
+
+        The transport can be shared between threads: a request holds the transport's lock until its response
+        has been read. A batch holds it as well, but once another thread is waiting for the lock the batch lets
+        the requests in flight complete and hands the lock over, so e.g. the GUI thread is not stuck behind
+        a batch read by the keyboard loader. Sending from the thread which holds the lock, e.g. from a GUI event
+        handled while iterating over iter_many, raises TransportBusyError instead of reading a response meant
+        for another request.
+    """
+
+    def __init__(self, usb_send=hid_send, window=DEFAULT_WINDOW, policy=None):
+        self.usb_send = usb_send
+        self.window = window
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.telemetry = HidTelemetry()
+        # optional TranscriptRecorder capturing the session
+        self.recorder = None
+        self.lock = threading.Lock()
+        # ident of the thread holding the lock
+        self.owner = None
+        # number of threads blocked on the lock, guarded by waiting_lock
+        self.waiting = 0
+        self.waiting_lock = threading.Lock()
+
+        # None - not probed yet, otherwise whether the device keeps up with pipelined requests
+        self.pipelining = None
+        # only raw hidapi devices can be pipelined, webhid and custom senders are always lock-step
+        if usb_send is not hid_send or sys.platform == "emscripten" or window <= 1:
+            self.pipelining = False
+
+    @contextmanager
+    def locked(self):
+        if self.owner == threading.get_ident():
+            raise TransportBusyError("a request was made while the transport is in the middle of another one")
+        with self.waiting_lock:
+            self.waiting += 1
+        try:
+            self.lock.acquire()
+        finally:
+            with self.waiting_lock:
+                self.waiting -= 1
+        self.owner = threading.get_ident()
+        try:
+            yield
+        finally:
+            self.owner = None
+            self.lock.release()
+
+    def handoff(self):
+        """ Lets threads waiting for the transport go first, called by a batch when nothing is in flight """
+        if not self.waiting:
+            return
+        self.owner = None
+        self.lock.release()
+        # give a waiting thread the chance to take the lock before it is taken back
+        time.sleep(0.001)
+        self.lock.acquire()
+        self.owner = threading.get_ident()
+
+    def send(self, dev, msg, retries=1):
+        with self.locked():
+            return self._send(dev, msg, retries)
+
+    def _send(self, dev, msg, retries):
+        start = time.monotonic()
+        data = b""
+        try:
+            if self.usb_send is hid_send:
+                data = hid_send(dev, msg, retries=retries, policy=self.policy, telemetry=self.telemetry)
+            else:
+                data = self.usb_send(dev, msg, retries=retries)
+            return data
+        finally:
+            latency_ms = (time.monotonic() - start) * 1000
+            # hid_send does its own accounting, as only it knows about retries and timeouts
+            if self.usb_send is not hid_send:
+                self.telemetry.record(msg, data, latency_ms)
+            if self.recorder is not None:
+                self.recorder.record(msg, data, latency_ms)
+
+    def start_recording(self, path):
+        """ Starts writing every request and response into a transcript at path """
+        self.stop_recording()
+        self.recorder = TranscriptRecorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def send_many(self, dev, msgs, retries=1):
+        """ Sends every request from msgs, returns the list of responses in the same order """
+        return list(self.iter_many(dev, msgs, retries=retries))
+
+    def iter_many(self, dev, msgs, retries=1):
+        """
+            Sends every request from msgs (which can be a generator), yields responses in the same order
+
+            Stopping the iteration early is allowed, responses to requests that are already in flight
+            are read and discarded.
+        """
+
+        with self.locked():
+            yield from self._iter_many(dev, msgs, retries)
+
+    def _iter_many(self, dev, msgs, retries):
+        if self.pipelining is None:
+            self.policy.check_circuit()
+            self.pipelining = self.probe(dev)
+
+        if not self.pipelining:
+            for msg in msgs:
+                self.handoff()
+                yield self._send(dev, msg, retries)
+            return
+
+        pending = iter(msgs)
+        inflight = deque()
+        exhausted = False
+        try:
+            while True:
+                if not inflight:
+                    self.handoff()
+                # stop filling the window while another thread waits, so the lock can be handed over once it empties
+                while not exhausted and len(inflight) < self.window and not (inflight and self.waiting):
+                    msg = next(pending, None)
+                    if msg is None:
+                        exhausted = True
+                        break
+                    msg = pad_message(msg)
+                    inflight.append((msg, time.monotonic()))
+                    if not self._write(dev, msg):
+                        break
+
+                if not inflight:
+                    return
+
+                msg, sent = inflight[0]
+                data = self._read(dev, self.policy.read_timeout_ms(msg))
+                if not data or not response_matches(msg, data):
+                    logging.warning("HidTransport: pipelined response mismatch, falling back to lock-step mode")
+                    self.telemetry.record(msg, b"", (time.monotonic() - sent) * 1000, timeouts=int(not data))
+                    self.pipelining = False
+                    self.drain(dev)
+                    # requests which were in flight are resent, this is safe as every command is idempotent
+                    remaining = [msg for msg, sent in inflight]
+                    inflight.clear()
+                    for msg in remaining:
+                        yield self._send(dev, msg, retries)
+                    for msg in pending:
+                        self.handoff()
+                        yield self._send(dev, msg, retries)
+                    return
+
+                inflight.popleft()
+                self.policy.record_success()
+                latency_ms = (time.monotonic() - sent) * 1000
+                self.telemetry.record(msg, data, latency_ms)
+                if self.recorder is not None:
+                    self.recorder.record(msg, data, latency_ms)
+                yield data
+        finally:
+            # iteration was stopped early, make sure responses we are not interested in don't linger in the queue
+            for msg, sent in inflight:
+                if not self._read(dev, self.policy.read_timeout_ms(msg)):
+                    break
+
+    def probe(self, dev):
+        """ Checks whether the device answers a window of outstanding requests in order """
+
+        self.drain(dev)
+        # zero-sized keymap buffer reads are harmless and echo back the offset, so responses can be told apart
+        msgs = [pad_message(struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, x, 0)) for x in range(self.window)]
+        written = 0
+        for msg in msgs:
+            if not self._write(dev, msg):
+                break
+            written += 1
+
+        ok = written == len(msgs)
+        for msg in msgs[:written]:
+            data = self._read(dev, self.policy.read_timeout_ms(msg))
+            if not data or not response_matches(msg, data):
+                ok = False
+                break
+
+        if not ok:
+            self.drain(dev)
+        logging.info("HidTransport: {} pipelining with window={}".format("using" if ok else "not using", self.window))
+        return ok
+
+    def drain(self, dev):
+        """ Discards all responses pending in the input queue """
+        for _ in range(DRAIN_LIMIT):
+            if not self._read(dev, DRAIN_READ_TIMEOUT_MS):
+                break
+
+    @staticmethod
+    def _write(dev, msg):
+        try:
+            # add 00 at start for hidapi report id
+            return dev.write(b"\x00" + msg) == MSG_LEN + 1
+        except OSError:
+            return False
+
+    @staticmethod
+    def _read(dev, timeout_ms):
+        try:
+            return bytes(dev.read(MSG_LEN, timeout_ms=timeout_ms))
+        except OSError:
+            return b""
@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, \
+    QFileDialog, QHeaderView
+
+from protocol.telemetry import LATENCY_BUCKETS_MS
+from util import tr
+
+COLUMNS = ["Command", "Calls", "Bytes out", "Bytes in", "Total ms", "Mean ms", "Max ms", "Timeouts", "Retries",
+           "Failures", "Latency histogram"]
+
+
+def format_histogram(histogram):
+    """ Short textual form of a latency histogram, e.g. "<=1:120 <=2:14 >512:1" """
+    out = []
+    for x, count in enumerate(histogram):
+        if count == 0:
+            continue
+        if x < len(LATENCY_BUCKETS_MS):
+            out.append("<={}:{}".format(LATENCY_BUCKETS_MS[x], count))
+        else:
+            out.append(">{}:{}".format(LATENCY_BUCKETS_MS[-1], count))
+    return " ".join(out)
+
+
+class TelemetryDialog(QDialog):
+
+    def __init__(self, device):
+        super().__init__()
+
+        self.device = device
+        self.telemetry = device.keyboard.transport.telemetry
+        self.setWindowTitle(tr("TelemetryDialog", "HID statistics for {}").format(device.title()))
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+
+        self.lbl_summary = QLabel()
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(len(COLUMNS))
+        self.table.setHorizontalHeaderLabels([tr("TelemetryDialog", c) for c in COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.verticalHeader().hide()
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.btn_refresh = self.buttonBox.addButton(tr("TelemetryDialog", "Refresh"), QDialogButtonBox.ActionRole)
+        self.btn_reset = self.buttonBox.addButton(tr("TelemetryDialog", "Reset"), QDialogButtonBox.ActionRole)
+        self.btn_export = self.buttonBox.addButton(tr("TelemetryDialog", "Export JSON..."),
+                                                   QDialogButtonBox.ActionRole)
+        self.btn_refresh.clicked.connect(self.refresh)
+        self.btn_reset.clicked.connect(self.on_reset)
+        self.btn_export.clicked.connect(self.on_export)
+        self.buttonBox.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.lbl_summary)
+        layout.addWidget(self.table)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+        self.resize(1000, 500)
+
+        self.refresh()
+
+    def refresh(self):
+        data = self.telemetry.to_dict()
+        totals = data["totals"]
+        self.lbl_summary.setText(tr("TelemetryDialog", "{} requests, {:.0f} ms total, {} timeouts, {} retries, "
+                                                       "{} failures").format(
+            totals["count"], totals["total_ms"], totals["timeouts"], totals["retries"], totals["failures"]))
+
+        self.table.setRowCount(len(data["commands"]))
+        for row, cmd in enumerate(data["commands"]):
+            values = ["{} ({})".format(cmd["command"], cmd["id"]), cmd["count"], cmd["bytes_out"], cmd["bytes_in"],
+                      "{:.1f}".format(cmd["total_ms"]), "{:.2f}".format(cmd["mean_ms"]),
+                      "{:.1f}".format(cmd["max_ms"]), cmd["timeouts"], cmd["retries"], cmd["failures"],
+                      format_histogram(cmd["histogram"])]
+            for col, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if col not in [0, len(values) - 1]:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, col, item)
+
+    def on_reset(self):
+        self.telemetry.reset()
+        self.refresh()
+
+    def export_json(self):
+        keyboard = self.device.keyboard
+        return self.telemetry.to_json({
+            "device": self.device.title(),
+            "keyboard_id": "{:016X}".format(keyboard.keyboard_id & 0xFFFFFFFFFFFFFFFF),
+            "via_protocol": keyboard.via_protocol,
+            "vial_protocol": keyboard.vial_protocol,
+            "pipelining": bool(keyboard.transport.pipelining),
+        })
+
+    def on_export(self):
+        dialog = QFileDialog()
+        dialog.setDefaultSuffix("json")
+        dialog.setAcceptMode(QFileDialog.AcceptSave)
+        dialog.setNameFilters(["JSON (*.json)"])
+        if dialog.exec_() == QDialog.Accepted:
+            with open(dialog.selectedFiles()[0], "w") as outf:
+                outf.write(self.export_json())
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from editor.qmk_settings import QmkSettings
+from protocol.constants import CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_DEFINITION
+from protocol.definition_cache import DefinitionCache
+from protocol.emulator import FirmwareEmulator, EmulatedDevice
+from test.test_emulator import FakeAppctx, LAYOUT_2x3
+from vial_device import VialEmulatedKeyboard
+
+LAYOUT_2x3_RENAMED = LAYOUT_2x3.replace('"test"', '"tset"')
+
+DEFINITION_KEY = CMD_VIA_VIAL_PREFIX << 8 | CMD_VIAL_GET_DEFINITION
+
+
+def definition_requests(keyboard):
+    stats = keyboard.transport.telemetry.stats.get(DEFINITION_KEY)
+    return stats.count if stats else 0
+
+
+class TestDefinitionCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QmkSettings.initialize(FakeAppctx())
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def open(self, cache, layout=LAYOUT_2x3, keyboard_id=0x1122334455667788):
+        device = VialEmulatedKeyboard(EmulatedDevice(FirmwareEmulator(layout, keyboard_id=keyboard_id)))
+        device.definition_cache = cache
+        device.open()
+        return device.keyboard
+
+    def test_reconnect(self):
+        cache = DefinitionCache(self.tmp.name)
+        kb = self.open(cache)
+        blocks = definition_requests(kb)
+        self.assertGreater(blocks, 3)
+
+        # same session: the entry is already known to be good
+        kb = self.open(cache)
+        self.assertEqual(definition_requests(kb), 0)
+        self.assertEqual(kb.rows, 2)
+
+        # new session: the tail of the definition is checked against the keyboard
+        kb = self.open(DefinitionCache(self.tmp.name))
+        self.assertLess(definition_requests(kb), blocks)
+        self.assertEqual(kb.definition["name"], "test")
+
+    def test_stale(self):
+        self.open(DefinitionCache(self.tmp.name))
+        # same uid and size, different contents: the validation must notice and download it again
+        kb = self.open(DefinitionCache(self.tmp.name), layout=LAYOUT_2x3_RENAMED)
+        self.assertEqual(kb.definition["name"], "tset")
+        self.assertGreater(definition_requests(kb), 3)
+
+    def test_eviction(self):
+        cache = DefinitionCache(self.tmp.name, max_entries=2)
+        size = len(FirmwareEmulator(LAYOUT_2x3).compressed_definition)
+        for x in range(3):
+            self.open(cache, keyboard_id=0x1000 + x)
+            # spell out the use order, the entries may be written within the filesystem's timestamp resolution
+            os.utime(cache.entry_path(0x1000 + x, size), (x, x))
+        self.assertFalse(os.path.exists(cache.entry_path(0x1000, size)))
+        self.assertTrue(os.path.exists(cache.entry_path(0x1001, size)))
+        self.assertTrue(os.path.exists(cache.entry_path(0x1002, size)))
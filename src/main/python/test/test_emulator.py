@@ -0,0 +1,211 @@
+import os
+import struct
+import unittest
+
+from editor.qmk_settings import QmkSettings
+from keyboard_loader import KeyboardLoader
+from keycodes.keycodes import Keycode
+from protocol.constants import CMD_VIA_KEYMAP_SET_BUFFER, CMD_VIA_MACRO_SET_BUFFER
+from protocol.emulator import FirmwareEmulator, EmulatedDevice
+from protocol.keyboard_comm import RELOAD_STAGES, STAGE_LAYOUT
+from vial_device import VialEmulatedKeyboard
+
+LAYOUT_2x3 = """
+{"name":"test","vendorId":"0x0000","productId":"0x1111","lighting":"vialrgb","matrix":{"rows":2,"cols":3},
+ "layouts":{"keymap":[["0,0","0,1","0,2"],["1,0","1,1","1,2"]]}}
+"""
+
+
+class FakeAppctx:
+
+    def get_resource(self, path):
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../resources/base/", path)
+
+
+def open_emulated(firmware, **kwargs):
+    device = VialEmulatedKeyboard(EmulatedDevice(firmware, **kwargs))
+    device.open()
+    return device.keyboard
+
+
+class TestEmulator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QmkSettings.initialize(FakeAppctx())
+
+    def test_reload(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3, layers=2, qmk_settings=[1, 2])
+        firmware.keymap[0:2] = b"\x00\x04"
+        firmware.actuation[0] = 100
+        kb = open_emulated(firmware)
+
+        self.assertEqual(kb.layers, 2)
+        self.assertEqual(kb.layout[(0, 0, 0)], Keycode.serialize(4))
+        self.assertEqual(kb.tap_dance_count, 8)
+        self.assertEqual(set(kb.settings.keys()), {1, 2})
+        self.assertEqual(kb.rgb_version, 1)
+        self.assertEqual(kb.actuation_matrix[0][0][0].actuation_point, 100)
+        self.assertTrue(kb.firmware_updated)
+
+    def test_definition_padding(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3)
+        # bytes past the end of the xz stream, spilling into blocks of their own, are ignored
+        firmware.compressed_definition += b"\x00" * 100
+        kb = open_emulated(firmware)
+        self.assertEqual(kb.definition["name"], "test")
+
+    def test_write(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3, layers=2)
+        kb = open_emulated(firmware)
+        kb.set_key(1, 1, 2, Keycode.serialize(5))
+        self.assertEqual(firmware.keycode(1, 1, 2), 5)
+        kb.set_macro(b"hello\x00" + b"\x00" * 15)
+        self.assertEqual(bytes(firmware.macro_buffer[0:5]), b"hello")
+
+    def test_macro_diff(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3, macro_count=4)
+        kb = open_emulated(firmware)
+        data = b"a" * 100 + b"\x00" + b"b" * 100 + b"\x00\x00\x00"
+        self.assertEqual(kb.set_macro(data), len(data))
+        self.assertEqual(kb.set_macro(data), 0)
+
+        # one character changed in each macro, two requests of one byte each
+        edited = b"a" * 50 + b"c" + b"a" * 49 + b"\x00" + b"b" * 99 + b"c\x00\x00\x00"
+        self.assertEqual(kb.set_macro(edited), 2)
+        self.assertEqual(bytes(firmware.macro_buffer[:len(edited)]), edited)
+        self.assertEqual(kb.transport.telemetry.stats[CMD_VIA_MACRO_SET_BUFFER].count, 10)
+
+    def test_macro_diff_raw(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3, macro_count=2)
+        firmware.macro_buffer[0:8] = b"a\x00b\x00c\x00d\x00"
+        kb = open_emulated(firmware)
+        self.assertEqual(kb.macro, b"a\x00b\x00")
+        # the extra macros are still on the keyboard even though they are cut from the loaded buffer
+        self.assertEqual(kb.set_macro(b"a\x00b\x00c\x00"), 0)
+        self.assertEqual(kb.set_macro(b"a\x00b\x00\x00\x00"), 1)
+        self.assertEqual(bytes(firmware.macro_buffer[0:8]), b"a\x00b\x00\x00\x00d\x00")
+
+    def test_restore_keymap(self):
+        source = FirmwareEmulator(LAYOUT_2x3, layers=6)
+        for x in range(0, len(source.keymap), 2):
+            source.keymap[x + 1] = 4 + x % 20
+        saved = open_emulated(source).save_layout()
+
+        firmware = FirmwareEmulator(LAYOUT_2x3, layers=6)
+        firmware.keymap[2:4] = source.keymap[2:4]
+        kb = open_emulated(firmware)
+        kb.restore_layout(saved)
+        self.assertEqual(firmware.keymap, source.keymap)
+        self.assertEqual(kb.layout[(5, 1, 2)], Keycode.serialize(source.keycode(5, 1, 2)))
+        # 72 bytes of keymap, 28 per request
+        self.assertEqual(kb.transport.telemetry.stats[CMD_VIA_KEYMAP_SET_BUFFER].count, 3)
+
+        self.assertEqual(kb.set_keys({(0, 0, 0): kb.layout[(0, 0, 0)]}), 0)
+        self.assertEqual(kb.set_keys({(0, 0, 0): "KC_B", (0, 0, 2): "KC_C"}), 1)
+        self.assertEqual(firmware.keymap[0:6], b"\x00\x05" + source.keymap[2:4] + b"\x00\x06")
+        self.assertEqual(kb.layout[(0, 0, 2)], "KC_C")
+
+    def test_restore_plan(self):
+        source = FirmwareEmulator(LAYOUT_2x3, layers=2, qmk_settings=[1, 2])
+        source.keymap[0:2] = b"\x00\x04"
+        source.dynamic["tap_dance"][3] = struct.pack("<HHHHH", 4, 5, 0, 0, 200)
+        source.dynamic["combo"][0] = struct.pack("<HHHHH", 4, 5, 0, 0, 6)
+        source.qmk_settings[2] = b"\x01\x00\x00\x00"
+        source.actuation[0:8] = b"\x40\x01\x10\x10" * 2
+        source.he_switch = 3
+        saved = open_emulated(source).save_layout()
+
+        firmware = FirmwareEmulator(LAYOUT_2x3, layers=2, qmk_settings=[1, 2])
+        kb = open_emulated(firmware)
+        plan = kb.plan_restore(saved)
+        report = dict(plan.report())
+        self.assertEqual((report["keymap"], report["tap_dance"], report["combo"], report["settings"],
+                          report["hall_effect"], report["encoders"], report["macros"]), (1, 1, 1, 1, 2, 0, 0))
+        self.assertFalse(plan.unlock)
+
+        progress = []
+
+        def on_progress(done, total, section):
+            progress.append((done, section))
+            # progress is reported between batches, the keyboard can be talked to
+            kb.get_unlock_status()
+
+        self.assertEqual(kb.execute_restore(plan, on_progress), plan.packets)
+        self.assertEqual(progress[-1], (plan.packets, "settings"))
+        self.assertEqual(firmware.keymap, source.keymap)
+        self.assertEqual(firmware.dynamic, source.dynamic)
+        self.assertEqual(firmware.qmk_settings, source.qmk_settings)
+        self.assertEqual(firmware.actuation, source.actuation)
+        self.assertEqual(firmware.he_switch, 3)
+
+        # the in-memory state was updated along with the keyboard
+        self.assertEqual(kb.plan_restore(saved).packets, 0)
+        self.assertEqual(open_emulated(firmware).save_layout(), saved)
+
+    def test_unlock(self):
+        firmware = FirmwareEmulator(LAYOUT_2x3, unlock_keys=[(0, 0), (1, 2)], unlock_counter=3)
+        kb = open_emulated(firmware)
+        self.assertEqual(kb.get_unlock_status(), 0)
+        self.assertEqual(kb.get_unlock_keys(), [(0, 0), (1, 2)])
+        kb.unlock_start()
+        firmware.press(0, 0)
+        firmware.press(1, 2)
+        for x in range(3):
+            data = kb.unlock_poll()
+        self.assertEqual(data[0], 1)
+        self.assertEqual(kb.get_unlock_status(), 1)
+        self.assertEqual(kb.matrix_poll()[2:4], b"\x01\x04")
+
+    def test_faults(self):
+        """ Reload survives dropped packets thanks to retries and stays deterministic for a given seed """
+        firmware = FirmwareEmulator(LAYOUT_2x3, layers=2)
+        firmware.keymap[0:2] = b"\x00\x04"
+        kb = open_emulated(firmware, latency_ms=0.1, drop_rate=0.02, seed=1)
+        self.assertEqual(kb.layout[(0, 0, 0)], Keycode.serialize(4))
+
+    def test_stages(self):
+        stages = []
+        device = VialEmulatedKeyboard(EmulatedDevice(FirmwareEmulator(LAYOUT_2x3)))
+        device.open(progress=lambda done, total, stage: stages.append((done, total, stage)))
+        self.assertEqual([stage for done, total, stage in stages if stage is not None], RELOAD_STAGES)
+        self.assertEqual(stages[-1][0], stages[-1][1])
+
+    def test_loader_cancel(self):
+        loader = KeyboardLoader(VialEmulatedKeyboard(EmulatedDevice(FirmwareEmulator(LAYOUT_2x3))))
+        stages, events = [], []
+        loader.stage_loaded.connect(stages.append)
+        loader.stage_loaded.connect(loader.cancel)
+        loader.loaded.connect(lambda: events.append("loaded"))
+        loader.cancelled.connect(lambda: events.append("cancelled"))
+        # run on this thread so that signals are delivered immediately
+        loader.run()
+        self.assertEqual(stages, [STAGE_LAYOUT])
+        self.assertEqual(events, ["cancelled"])
+
+    def test_hall_effect_bulk(self):
+        for bulk in [True, False]:
+            firmware = FirmwareEmulator(LAYOUT_2x3, hall_effect_bulk=bulk)
+            firmware.actuation[-4:] = b"\x10\x01\x02\x03"
+            kb = open_emulated(firmware)
+            self.assertEqual(kb.he_bulk, bulk)
+            self.assertEqual(kb.actuation_matrix[1][1][2].to_tuple(), (0x10, 1, 2, 3))
+            self.assertEqual(kb.actuation_matrix[0][0][0].to_tuple(), (128, 0, 0, 0))
+            self.assertTrue(kb.firmware_updated)
+
+    def test_hall_effect_commit(self):
+        for bulk, requests in [(True, 1), (False, 6)]:
+            firmware = FirmwareEmulator(LAYOUT_2x3, hall_effect_bulk=bulk)
+            kb = open_emulated(firmware)
+            self.assertEqual(kb.commit_actuation(), 0)
+
+            # select all and move the slider
+            kb.actuation_matrix.assign(0, None, actuation_point=50)
+            self.assertEqual(kb.commit_actuation(0), requests)
+            self.assertEqual(firmware.actuation[0:24:4], b"\x32" * 6)
+            self.assertEqual(firmware.actuation[24], 128)
+            self.assertEqual(kb.commit_actuation(0), 0)
+
+            kb.actuation_matrix.key(1, 1, 2).rt_mode = 1
+            self.assertEqual(kb.commit_actuation(), 1)
+            self.assertEqual(firmware.actuation[-3], 1)
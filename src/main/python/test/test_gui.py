@@ -1,6 +1,8 @@
 import lzma
 import os.path
 import struct
+import threading
+import time
 
 from PyQt5.QtCore import QPoint
 from PyQt5.QtWidgets import QPushButton
@@ -13,7 +15,9 @@ from protocol.constants import CMD_VIA_GET_PROTOCOL_VERSION, CMD_VIA_VIAL_PREFIX
     CMD_VIA_MACRO_GET_BUFFER_SIZE, CMD_VIAL_QMK_SETTINGS_QUERY, CMD_VIAL_DYNAMIC_ENTRY_OP, \
     DYNAMIC_VIAL_GET_NUMBER_OF_ENTRIES, CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_MACRO_GET_BUFFER, CMD_VIAL_GET_UNLOCK_STATUS, \
     CMD_VIA_SET_KEYCODE, DYNAMIC_VIAL_COMBO_GET, DYNAMIC_VIAL_COMBO_SET, DYNAMIC_VIAL_TAP_DANCE_GET, \
-    DYNAMIC_VIAL_TAP_DANCE_SET
+    DYNAMIC_VIAL_TAP_DANCE_SET, CMD_VIAL_GET_HE_ACTUATION_CONFIG, CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR, \
+    CMD_VIAL_GET_HE_SWITCH, CMD_VIAL_GET_HE_SPECIAL_LAYER, CMD_VIAL_GET_HE_ACTUATION_BULK, \
+    CMD_VIA_GET_KEYBOARD_VALUE, CMD_VIA_SET_KEYBOARD_VALUE, VIA_LAYOUT_OPTIONS
 from widgets.square_button import SquareButton
 
 FAKE_KEYBOARD = """
@@ -37,6 +41,32 @@ FAKE_KEYBOARD = """
 }
 """
 
+LAYOUT_OPTIONS_KEYBOARD = """
+{
+  "matrix": {
+    "rows": 2,
+    "cols": 2
+  },
+  "layouts": {
+    "labels": ["Split bottom row"],
+    "keymap": [
+      [
+        "0,0",
+        "0,1"
+      ],
+      [
+        {"w": 2},
+        "1,0\\n\\n\\n0,0"
+      ],
+      [
+        "1,0\\n\\n\\n0,1",
+        "1,1\\n\\n\\n0,1"
+      ]
+    ]
+  }
+}
+"""
+
 
 def mock_enumerate():
     return [{
@@ -79,6 +109,8 @@ class VirtualKeyboard:
         self.key_override_entries = 0
         self.alt_repeat_key_entries = 0
 
+        self.layout_options = 0
+
     def get_keymap_buffer(self):
         output = b""
         for layer in range(self.layers):
@@ -132,6 +164,10 @@ class VirtualKeyboard:
             return b"\xFF" * 32
         elif msg[1] == CMD_VIAL_DYNAMIC_ENTRY_OP:
             return self.vial_cmd_dynamic(msg)
+        elif msg[1] in [CMD_VIAL_GET_HE_ACTUATION_CONFIG, CMD_VIAL_GET_HE_INPUT_PRIORITY_PAIR,
+                        CMD_VIAL_GET_HE_SWITCH, CMD_VIAL_GET_HE_SPECIAL_LAYER, CMD_VIAL_GET_HE_ACTUATION_BULK]:
+            # no hall-effect support, firmware echoes back commands it doesn't know
+            return msg
         raise RuntimeError("unknown command for Vial protocol 0x{:02X}".format(msg[1]))
 
     def process(self, msg):
@@ -155,6 +191,13 @@ class VirtualKeyboard:
         elif msg[0] == CMD_VIA_KEYMAP_GET_BUFFER:
             offset, size = struct.unpack_from(">HB", msg[1:])
             return msg[0:1] + self.get_keymap_buffer()[offset:offset+size]
+        elif msg[0] == CMD_VIA_GET_KEYBOARD_VALUE and msg[1] == VIA_LAYOUT_OPTIONS:
+            # answer late, so the GUI handles the stages loaded before the options like with a real keyboard
+            time.sleep(0.2)
+            return struct.pack(">BBI", msg[0], msg[1], self.layout_options)
+        elif msg[0] == CMD_VIA_SET_KEYBOARD_VALUE and msg[1] == VIA_LAYOUT_OPTIONS:
+            self.layout_options = struct.unpack_from(">I", msg[2:])[0]
+            return b""
         raise RuntimeError("unknown command for VIA protocol 0x{:02X}".format(msg[0]))
 
 
@@ -202,6 +245,8 @@ def prepare(qtbot, keyboard_json, combos=None, tap_dance=None):
     mw = MainWindow(FakeAppctx())
     qtbot.addWidget(mw)
     mw.show()
+    # the keyboard is loaded in the background
+    qtbot.waitUntil(lambda: mw.loader is None)
     # keep reference to MainWindow for the duration of tests
     # when MainWindow goes out of scope some KeyWidgets are still registered within KeycodeDisplay which causes UaF
     all_mw.append(mw)
@@ -355,10 +400,16 @@ def test_keymap_zoom(qtbot):
     # grab area for first widget
     scale_initial = mw.keymap_editor.container.scale
 
+    # switching layers leaves the geometry alone
+    generation = mw.keymap_editor.container.geometry_generation
+    mw.keymap_editor.refresh_layer_display()
+    assert mw.keymap_editor.container.geometry_generation == generation
+
     # click the plus button
     qtbot.mouseClick(btn_plus, qt_api.QtCore.Qt.MouseButton.LeftButton)
     # area got bigger
     assert mw.keymap_editor.container.scale > scale_initial
+    assert mw.keymap_editor.container.geometry_generation > generation
 
     # click the minus button
     qtbot.mouseClick(btn_minus, qt_api.QtCore.Qt.MouseButton.LeftButton)
@@ -604,3 +655,93 @@ def test_tap_dance(qtbot):
     assert not tde.btn_save.isEnabled()
     assert td.tabText(td.currentIndex()) == "2"
     assert timeout_w.value() == 123
+
+
+def test_keycode_display(qtbot, monkeypatch):
+    from keymaps import KEYMAPS, load_keymap
+    from util import KeycodeDisplay
+
+    # the windows of earlier tests are still registered but some of their widgets are gone
+    monkeypatch.setattr(KeycodeDisplay, "clients", [])
+    german = load_keymap([name for name, module, attribute in KEYMAPS].index("German (QWERTZ)"))
+    KeycodeDisplay.set_keymap_override(load_keymap(0))
+    data = KeycodeDisplay.display_data("LCTL(KC_Y)")
+    assert data[1] == "Y" and data[5] is None
+    assert KeycodeDisplay.display_data("LCTL(KC_Y)") is data
+
+    # the cached display data follows the keymap override
+    KeycodeDisplay.set_keymap_override(german)
+    data = KeycodeDisplay.display_data("LCTL(KC_Y)")
+    assert data[1] == "Z" and data[5] is not None
+    KeycodeDisplay.set_keymap_override(load_keymap(0))
+    assert KeycodeDisplay.display_data("LCTL(KC_Y)")[1] == "Y"
+
+
+def test_hit_test(qtbot):
+    """ Tests that the grid hit test finds the same keys as checking every key """
+    mw, vk = prepare(qtbot, FAKE_KEYBOARD)
+    container = mw.keymap_editor.container
+
+    def linear(pos):
+        for key in container.widgets:
+            if key.masked and key.mask_polygon.containsPoint(pos / container.scale, qt_api.QtCore.Qt.OddEvenFill):
+                return key, True
+            if key.polygon.containsPoint(pos / container.scale, qt_api.QtCore.Qt.OddEvenFill):
+                return key, False
+        return None, False
+
+    hits = 0
+    for x in range(0, container.width, 3):
+        for y in range(0, container.height, 3):
+            pos = QPoint(x, y)
+            assert container.hit_test(pos) == linear(pos)
+            hits += container.hit_test(pos)[0] is not None
+    assert hits > 0
+
+
+def test_shared_geometry(qtbot):
+    """ Tests that the keymap editor and matrix tester place their keys with the same geometry objects """
+    mw, vk = prepare(qtbot, FAKE_KEYBOARD)
+    keymap = mw.keymap_editor.container
+    matrix = mw.matrix_tester.keyboardWidget
+    assert len(keymap.widgets) == len(matrix.widgets) > 0
+
+    shared = 0
+    for a, b in zip(keymap.widgets, matrix.widgets):
+        assert a is not b
+        assert a.desc is b.desc
+        if a.scale == b.scale:
+            assert a.geometry is b.geometry
+            shared += 1
+    assert shared > 0
+
+    # per-view state stays separate
+    keymap.widgets[0].setText("A")
+    assert matrix.widgets[0].text != "A"
+
+
+def test_layout_options(qtbot, monkeypatch):
+    """ Tests that editors placing keys come up with the layout options the keyboard reports """
+    import protocol.keyboard_comm
+    threads = []
+    recreate = protocol.keyboard_comm.recreate_keyboard_keycodes
+
+    def recreate_keyboard_keycodes(keyboard):
+        threads.append(threading.current_thread())
+        recreate(keyboard)
+
+    monkeypatch.setattr(protocol.keyboard_comm, "recreate_keyboard_keycodes", recreate_keyboard_keycodes)
+    mw, vk = prepare(qtbot, LAYOUT_OPTIONS_KEYBOARD)
+
+    # the global keycode tables are only replaced on the GUI thread
+    assert threads == [threading.main_thread()]
+    assert mw.layout_editor.pack() == 0
+    assert len(mw.keymap_editor.container.widgets) == 3
+    assert len(mw.matrix_tester.keyboardWidget.widgets) == 3
+
+    # changing the option re-places the keys of every view
+    mw.layout_editor.unpack(1)
+    mw.layout_editor.on_changed()
+    assert vk.layout_options == 1
+    assert len(mw.keymap_editor.container.widgets) == 4
+    assert len(mw.matrix_tester.keyboardWidget.widgets) == 4
@@ -0,0 +1,56 @@
+import unittest
+
+from protocol.hall_effect import ActuationMatrix, ActuationConfig
+
+
+class TestActuationMatrix(unittest.TestCase):
+
+    def test_views(self):
+        matrix = ActuationMatrix(2, 2, 3)
+        self.assertEqual(matrix[1][1][2].to_tuple(), (128, 0, 0, 0))
+
+        matrix[1][1][2].rt_press = 40
+        self.assertEqual(matrix.key(1, 1, 2).rt_press, 40)
+        self.assertEqual(bytes(matrix.key(1, 1, 2).to_bytes()), b"\x80\x00\x28\x00")
+        self.assertEqual(bytes(matrix.data[-4:]), b"\x80\x00\x28\x00")
+
+        with self.assertRaises(IndexError):
+            matrix[0][2]
+        with self.assertRaises(IndexError):
+            matrix[0][0][3]
+
+    def test_assign(self):
+        matrix = ActuationMatrix(2, 2, 3)
+        matrix.assign(0, [(0, 1), (1, 2)], rt_mode=1, rt_release=9)
+        self.assertEqual(matrix.key(0, 0, 1).to_tuple(), (128, 1, 0, 9))
+        self.assertEqual(matrix.key(0, 1, 2).to_tuple(), (128, 1, 0, 9))
+        self.assertEqual(matrix.key(0, 0, 0).to_tuple(), (128, 0, 0, 0))
+
+        matrix.assign(1, None, actuation_point=50)
+        self.assertTrue(all(matrix.key(1, r, c).actuation_point == 50 for r in range(2) for c in range(3)))
+        self.assertEqual(matrix.key(0, 0, 0).actuation_point, 128)
+
+        matrix.fill(0)
+        self.assertEqual(matrix.key(0, 0, 1).to_tuple(), (128, 0, 0, 0))
+
+    def test_serialization(self):
+        matrix = ActuationMatrix(2, 2, 3)
+        matrix.key(0, 1, 0).rt_mode = 1
+        data = matrix.to_list()
+        self.assertEqual(data[0][1][0], {"actuation_point": 128, "rt_mode": 1, "rt_press": 0, "rt_release": 0})
+        self.assertEqual(ActuationMatrix.from_list(2, 2, 3, data), matrix)
+        self.assertEqual(ActuationConfig.from_dict(data[0][1][0]).to_tuple(), (128, 1, 0, 0))
+
+    def test_plan_writes(self):
+        matrix = ActuationMatrix(2, 2, 6)
+        committed = bytearray(matrix.data)
+        self.assertEqual(list(matrix.plan_writes(committed, 0, 6)), [])
+
+        for index in [1, 3, 7, 11]:
+            matrix.key(0, *divmod(index, 6)).rt_press = 5
+        matrix.key(1, 0, 0).rt_press = 5
+        # 1 and 3 share a write with the unchanged 2 between them, 7 can't reach back to 1
+        self.assertEqual(list(matrix.plan_writes(committed, 0, 6)), [(1, 3), (7, 5)])
+        self.assertEqual(list(matrix.plan_writes(committed, 0, 1)), [(1, 1), (3, 1), (7, 1), (11, 1)])
+        self.assertEqual(list(matrix.plan_writes(committed, 1, 6)), [(0, 1)])
+        self.assertEqual(list(matrix.plan_writes(None, 1, 6)), [(0, 6), (6, 6)])
@@ -166,7 +166,8 @@ class TestKeyboard(unittest.TestCase):
         dev.finish()
 
         kb, dev = self.prepare_keyboard(LAYOUT_2x2, [[[1, 2], [3, 4]], [[5, 6], [7, 8]]])
-        dev.expect("05010100000A", "")
+        # layer 1, row 1, col 0 is at offset (4 + 2) * 2 of the keymap buffer
+        dev.expect("13000C02000A", "")
         kb.restore_layout(data)
         self.assertEqual(kb.layout[(1, 1, 0)], Keycode.serialize(10))
         dev.finish()
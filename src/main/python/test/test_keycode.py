@@ -1,6 +1,6 @@
 import unittest
 
-from keycodes.keycodes import Keycode, recreate_keyboard_keycodes
+from keycodes.keycodes import Keycode, recreate_keyboard_keycodes, KEYCODES_LAYERS, KEYCODES_MACRO
 
 
 class FakeKeyboard:
@@ -41,3 +41,72 @@ class TestKeycode(unittest.TestCase):
 
     def test_serialize_v6(self):
         self._test_serialize_protocol(6)
+
+    def test_regenerate(self):
+        keyboard = FakeKeyboard(6)
+        recreate_keyboard_keycodes(keyboard)
+        m5 = Keycode.deserialize("M5")
+        self.assertEqual(Keycode.serialize(m5), "M5")
+        lctl_t = Keycode.deserialize("LCTL_T(KC_A)")
+        self.assertEqual(Keycode.serialize(lctl_t), "LCTL_T(KC_A)")
+
+        # the cached names must not outlive the keycodes they were built from
+        keyboard.macro_count = 4
+        recreate_keyboard_keycodes(keyboard)
+        self.assertEqual(Keycode.serialize(m5), hex(m5))
+
+        recreate_keyboard_keycodes(FakeKeyboard(5))
+        self.assertNotEqual(Keycode.deserialize("LCTL_T(KC_A)"), lctl_t)
+        self.assertEqual(Keycode.serialize(Keycode.deserialize("LCTL_T(KC_A)")), "LCTL_T(KC_A)")
+        self.assertEqual(Keycode.deserialize("LCTL(KC_NOPE)"), 0)
+        with self.assertRaises(Exception):
+            Keycode.deserialize("LCTL(KC_NOPE)", reraise=True)
+
+    def test_any_keycode(self):
+        from any_keycode import AnyKeycode
+
+        recreate_keyboard_keycodes(FakeKeyboard(6))
+        anykc = AnyKeycode.shared()
+        self.assertIs(AnyKeycode.shared(), anykc)
+        self.assertEqual(anykc.decode("LCTL(KC_A) | MOD_LSFT << 8"), Keycode.deserialize("C_S(KC_A)"))
+        self.assertIs(AnyKeycode.parse("MO(1)"), AnyKeycode.parse("MO(1)"))
+        mo1 = anykc.decode("MO(1)")
+
+        # the parsed expression is shared, the names it is evaluated with follow the protocol
+        recreate_keyboard_keycodes(FakeKeyboard(5))
+        self.assertIsNot(AnyKeycode.shared(), anykc)
+        self.assertNotEqual(AnyKeycode.shared().decode("MO(1)"), mo1)
+        with self.assertRaises(SyntaxError):
+            AnyKeycode.shared().decode("MO(")
+
+    def test_registry(self):
+        small = FakeKeyboard(6)
+        small.layers = 2
+        recreate_keyboard_keycodes(small)
+        mo1 = Keycode.find("MO(1)")
+        layers = list(KEYCODES_LAYERS)
+
+        recreate_keyboard_keycodes(FakeKeyboard(6))
+        self.assertIsNotNone(Keycode.find("MO(3)"))
+        self.assertIsNot(Keycode.find("MO(1)"), mo1)
+
+        # switching back reuses the keycodes generated for the first keyboard
+        recreate_keyboard_keycodes(small)
+        self.assertEqual(KEYCODES_LAYERS, layers)
+        self.assertTrue(all(a is b for a, b in zip(KEYCODES_LAYERS, layers)))
+        self.assertIs(Keycode.find("MO(1)"), mo1)
+        self.assertIs(Keycode.find_by_qmk_id("MO(1)"), mo1)
+        self.assertIsNone(Keycode.find("MO(3)"))
+        # nor do the keycodes generated for the bigger keyboard linger
+        self.assertIsNone(Keycode.find_by_qmk_id("MO(3)"))
+        self.assertIsNotNone(Keycode.find_by_qmk_id("TD(5)"))
+        self.assertEqual(Keycode.serialize(Keycode.deserialize("MO(3)")), hex(Keycode.deserialize("MO(3)")))
+        self.assertEqual(len(KEYCODES_MACRO), small.macro_count + 5)
+
+    def test_keymaps(self):
+        from keymaps import KEYMAPS, load_keymap
+
+        # every keymap resolves its qmk_ids when loaded, make sure none of them is misconfigured
+        for x in range(len(KEYMAPS)):
+            self.assertIs(load_keymap(x), load_keymap(x))
+        self.assertEqual(load_keymap(0), dict())
@@ -86,6 +86,16 @@ class TestMacro(unittest.TestCase):
         self.assertEqual(macro, [ActionText("Hello"), ActionTap(["KC_A", "KC_B", "KC_C"]), ActionText("World"),
                                  ActionDown(["KC_C", "KC_B", "KC_A"]), ActionDelay(256)])
 
+    def test_deserialize_malformed(self):
+        kb = DummyKeyboard(None)
+        kb.vial_protocol = 2
+        # the unknown action is skipped and the text around it joins into one run
+        self.assertEqual(kb.macro_deserialize(b"Hel\x01\x09lo\x01\x01\x04\x01\x01"),
+                         [ActionText("Hello"), ActionTap(["KC_A"])])
+        self.assertEqual(kb.macro_deserialize(b"\xE9" * 5000), [ActionText("\xE9" * 5000)])
+        kb.vial_protocol = 1
+        self.assertEqual(kb.macro_deserialize(b"Hi\x01\x04\x01\x05\x02"), [ActionText("Hi"), ActionTap(["KC_A", "KC_B"])])
+
     def test_save(self):
         down = ActionDown(["KC_A", "KC_B", "CMB_TOG"])
         self.assertEqual(down.save(), ["down", "KC_A", "KC_B", "CMB_TOG"])
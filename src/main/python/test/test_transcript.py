@@ -0,0 +1,71 @@
+import os
+import struct
+import tempfile
+import time
+import unittest
+
+from protocol.constants import CMD_VIA_KEYMAP_GET_BUFFER
+from protocol.transcript import TranscriptReplay, TranscriptRecord, load_transcript, unused_path
+from protocol.transport import HidTransport
+from util import MSG_LEN
+
+
+def echo_send(dev, msg, retries=1):
+    return msg + b"\x00" * (MSG_LEN - len(msg))
+
+
+class TestTranscript(unittest.TestCase):
+
+    def record(self, msgs):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+
+        transport = HidTransport(echo_send)
+        transport.start_recording(path)
+        for msg in msgs:
+            transport.send(None, msg)
+        transport.stop_recording()
+        return path
+
+    def test_roundtrip(self):
+        msgs = [struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, x, 28) for x in range(0, 112, 28)]
+        path = self.record(msgs)
+
+        records = load_transcript(path)
+        self.assertEqual([r.request for r in records], [m.rstrip(b"\x00") for m in msgs])
+        # requests and responses are stored without their zero padding
+        self.assertLess(os.path.getsize(path), len(msgs) * 2 * MSG_LEN)
+
+        replay = TranscriptReplay(records)
+        for msg in msgs:
+            self.assertEqual(replay.usb_send(replay, msg), echo_send(None, msg))
+        self.assertEqual(replay.misses, 0)
+
+    def test_out_of_order(self):
+        msgs = [bytes([0x01]), bytes([0x11]), bytes([0x0C])]
+        replay = TranscriptReplay.load(self.record(msgs))
+        self.assertEqual(replay.usb_send(replay, bytes([0x0C]))[0], 0x0C)
+        self.assertEqual(replay.usb_send(replay, bytes([0x01]))[0], 0x01)
+        self.assertEqual(replay.misses, 2)
+        with self.assertRaises(RuntimeError):
+            replay.usb_send(replay, bytes([0x42]))
+
+    def test_realtime(self):
+        records = [TranscriptRecord(1000, 0, b"\x01", b"\x01"), TranscriptRecord(1000, 50000, b"\x02", b"\x02")]
+        replay = TranscriptReplay(records, realtime=True)
+        replay.usb_send(replay, b"\x01")
+        start = time.monotonic()
+        replay.usb_send(replay, b"\x02")
+        # the host waited between the two requests when recording, so does the replay
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+    def test_unused_path(self):
+        path = self.record([b"\x01"])
+        root, ext = os.path.splitext(path)
+        # a later session must not truncate the transcript of an earlier one
+        second = unused_path(path)
+        self.assertEqual(second, "{}-1{}".format(root, ext))
+        open(second, "wb").close()
+        self.addCleanup(os.unlink, second)
+        self.assertEqual(unused_path(path), "{}-2{}".format(root, ext))
@@ -0,0 +1,232 @@
+import struct
+import threading
+import time
+import unittest
+from collections import deque
+from unittest import mock
+
+from protocol.constants import CMD_VIA_KEYMAP_GET_BUFFER, CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG, \
+    CMD_VIA_SET_KEYCODE, CMD_VIA_SET_KEYBOARD_VALUE, CMD_VIAL_SET_ENCODER, CMD_VIAL_QMK_SETTINGS_SET, \
+    CMD_VIAL_QMK_SETTINGS_RESET, CMD_VIA_KEYMAP_SET_BUFFER
+from protocol.retry import RetryPolicy, CommandBudget, CircuitOpenError, command_class
+from protocol.telemetry import command_key, command_name
+from protocol.transport import HidTransport, TransportBusyError
+from util import MSG_LEN, hid_send
+
+
+class QueueDevice:
+    """ Answers every request, queueing responses like the OS input buffer does """
+
+    def __init__(self):
+        self.responses = deque()
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.responses.append(self.process(data[1:]))
+        return len(data)
+
+    def read(self, sz, timeout_ms=None):
+        if self.responses:
+            return self.responses.popleft()
+        return b""
+
+    @staticmethod
+    def process(msg):
+        # echo the request back, with the offset duplicated into the payload so we can check the order
+        return msg[0:4] + msg[1:3] + b"\x00" * (MSG_LEN - 6)
+
+
+class LockstepDevice(QueueDevice):
+    """ Only remembers the last request, like a device that can't keep up with pipelining """
+
+    def write(self, data):
+        self.writes += 1
+        self.responses = deque([self.process(data[1:])])
+        return len(data)
+
+
+def buffer_reads(count):
+    return [struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, x, 28) for x in range(count)]
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_pipelined(self):
+        dev = QueueDevice()
+        transport = HidTransport(window=4)
+        responses = transport.send_many(dev, buffer_reads(10))
+        self.assertTrue(transport.pipelining)
+        self.assertEqual([struct.unpack(">H", r[4:6])[0] for r in responses], list(range(10)))
+        self.assertFalse(dev.responses)
+
+    def test_lockstep_fallback(self):
+        dev = LockstepDevice()
+        transport = HidTransport(window=4)
+        responses = transport.send_many(dev, buffer_reads(10))
+        self.assertFalse(transport.pipelining)
+        self.assertEqual([struct.unpack(">H", r[4:6])[0] for r in responses], list(range(10)))
+
+    def test_stop_early(self):
+        dev = QueueDevice()
+        transport = HidTransport(window=4)
+        for x, data in enumerate(transport.iter_many(dev, buffer_reads(10))):
+            if x == 2:
+                break
+        # responses to the requests still in flight must not leak into the next batch
+        self.assertFalse(dev.responses)
+        responses = transport.send_many(dev, buffer_reads(3))
+        self.assertEqual([struct.unpack(">H", r[4:6])[0] for r in responses], [0, 1, 2])
+
+    def test_custom_sender(self):
+        sent = []
+
+        def usb_send(dev, msg, retries=1):
+            sent.append(msg)
+            return msg
+
+        transport = HidTransport(usb_send, window=4)
+        self.assertEqual(transport.send_many(None, [b"\x01", b"\x02"]), [b"\x01", b"\x02"])
+        self.assertEqual(sent, [b"\x01", b"\x02"])
+        self.assertFalse(transport.pipelining)
+
+    def test_reentry(self):
+        dev = QueueDevice()
+        transport = HidTransport(window=4)
+        for data in transport.iter_many(dev, buffer_reads(3)):
+            # e.g. a timer firing while the batch is iterated, it would read a response meant for the batch
+            with self.assertRaises(TransportBusyError):
+                transport.send(dev, buffer_reads(1)[0])
+        self.assertEqual(struct.unpack(">H", transport.send(dev, buffer_reads(2)[1])[4:6])[0], 1)
+        self.assertTrue(transport.pipelining)
+
+    def test_handoff(self):
+        for pipelining in [None, False]:
+            dev = SlowDevice()
+            transport = HidTransport(window=4)
+            transport.pipelining = pipelining
+            responses = []
+
+            def batch():
+                responses.extend(transport.iter_many(dev, buffer_reads(300)))
+
+            thread = threading.Thread(target=batch)
+            thread.start()
+            while not responses:
+                time.sleep(0.001)
+            # another thread gets its turn in between the requests of the batch, not after all of them
+            data = transport.send(dev, struct.pack(">BHB", CMD_VIA_KEYMAP_GET_BUFFER, 1000, 28))
+            self.assertLess(len(responses), 300)
+            thread.join()
+            self.assertEqual(struct.unpack(">H", data[4:6])[0], 1000)
+            self.assertEqual([struct.unpack(">H", r[4:6])[0] for r in responses], list(range(300)))
+
+
+class SlowDevice(QueueDevice):
+    """ Takes a while to answer every request """
+
+    def read(self, sz, timeout_ms=None):
+        time.sleep(0.001)
+        return super().read(sz, timeout_ms)
+
+
+class FlakyDevice(QueueDevice):
+    """ Swallows the first `drops` requests without answering """
+
+    def __init__(self, drops):
+        super().__init__()
+        self.drops = drops
+
+    def write(self, data):
+        self.writes += 1
+        if self.drops > 0:
+            self.drops -= 1
+        else:
+            self.responses.append(self.process(data[1:]))
+        return len(data)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_adaptive_timeout(self):
+        policy = RetryPolicy(min_timeout_ms=5, max_timeout_ms=500)
+        self.assertEqual(policy.read_timeout_ms(), 500)
+        for x in range(20):
+            policy.record_latency(2)
+        self.assertLess(policy.read_timeout_ms(), 20)
+        # retries get progressively more patient
+        self.assertGreater(policy.read_timeout_ms(attempt=2), policy.read_timeout_ms(attempt=0))
+
+    def test_command_budget(self):
+        policy = RetryPolicy(budgets={"hall_effect": CommandBudget(attempts=2)})
+        he = bytes([CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG, 0, 0, 0])
+        self.assertEqual(command_class(he), "hall_effect")
+        self.assertEqual(policy.attempts(he, 20), 2)
+        self.assertEqual(policy.attempts(buffer_reads(1)[0], 20), 20)
+
+    def test_write_floor(self):
+        policy = RetryPolicy(min_timeout_ms=5)
+        for x in range(20):
+            policy.record_latency(1.5)
+        writes = [
+            bytes([CMD_VIA_SET_KEYCODE, 0, 0, 0, 0, 4]),
+            bytes([CMD_VIA_KEYMAP_SET_BUFFER, 0, 0, 2, 0, 4]),
+            bytes([CMD_VIA_SET_KEYBOARD_VALUE, 2, 0]),
+            bytes([CMD_VIA_VIAL_PREFIX, CMD_VIAL_SET_ENCODER, 0, 0, 0, 0, 4]),
+            bytes([CMD_VIA_VIAL_PREFIX, CMD_VIAL_QMK_SETTINGS_SET, 1, 0, 1]),
+            bytes([CMD_VIA_VIAL_PREFIX, CMD_VIAL_QMK_SETTINGS_RESET]),
+        ]
+        for msg in writes:
+            self.assertEqual(command_class(msg), "write")
+            # the firmware writes these to EEPROM, a fast read latency does not mean a fast write
+            self.assertGreaterEqual(policy.read_timeout_ms(msg), 250)
+        self.assertLess(policy.read_timeout_ms(buffer_reads(1)[0]), 20)
+
+    def test_retry(self):
+        dev = FlakyDevice(drops=2)
+        policy = RetryPolicy(min_timeout_ms=1, backoff_base_ms=1, seed=0)
+        data = hid_send(dev, buffer_reads(1)[0], retries=5, policy=policy)
+        self.assertEqual(dev.writes, 3)
+        self.assertEqual(data[0], CMD_VIA_KEYMAP_GET_BUFFER)
+
+    def test_circuit_breaker(self):
+        dev = FlakyDevice(drops=1000)
+        policy = RetryPolicy(min_timeout_ms=1, backoff_base_ms=1, breaker_threshold=2, seed=0)
+        for x in range(2):
+            with self.assertRaises(RuntimeError):
+                hid_send(dev, buffer_reads(1)[0], retries=2, policy=policy)
+        writes = dev.writes
+        with self.assertRaises(CircuitOpenError):
+            hid_send(dev, buffer_reads(1)[0], retries=2, policy=policy)
+        self.assertEqual(dev.writes, writes)
+
+    def test_default_policy(self):
+        policy = RetryPolicy()
+        with mock.patch("util.DEFAULT_RETRY_POLICY", policy):
+            hid_send(QueueDevice(), buffer_reads(1)[0])
+        # calls without a policy of their own share the default one
+        self.assertIsNotNone(policy.srtt)
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_record(self):
+        dev = FlakyDevice(drops=1)
+        transport = HidTransport(policy=RetryPolicy(min_timeout_ms=1, backoff_base_ms=1, seed=0))
+        transport.pipelining = False
+        transport.send(dev, buffer_reads(1)[0], retries=3)
+        transport.send_many(dev, buffer_reads(3))
+
+        data = transport.telemetry.to_dict()
+        self.assertEqual(len(data["commands"]), 1)
+        cmd = data["commands"][0]
+        self.assertEqual(cmd["command"], "CMD_VIA_KEYMAP_GET_BUFFER")
+        self.assertEqual(cmd["count"], 4)
+        self.assertEqual(cmd["retries"], 1)
+        self.assertEqual(cmd["timeouts"], 1)
+        self.assertEqual(cmd["bytes_in"], 4 * MSG_LEN)
+        self.assertEqual(sum(cmd["histogram"]), 4)
+
+    def test_vial_command_names(self):
+        self.assertEqual(command_name(command_key(bytes([CMD_VIA_VIAL_PREFIX, CMD_VIAL_GET_HE_ACTUATION_CONFIG]))),
+                         "CMD_VIAL_GET_HE_ACTUATION_CONFIG")
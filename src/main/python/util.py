@@ -12,7 +12,9 @@ from PyQt5.QtWidgets import QApplication, QWidget, QScrollArea, QFrame
 
 from hidproxy import hid
 from keycodes.keycodes import Keycode
-from keymaps import KEYMAPS
+from keymaps import load_keymap
+from protocol.retry import RetryPolicy
+from themes import Theme
 
 tr = QCoreApplication.translate
 
@@ -36,37 +38,74 @@ EXAMPLE_KEYBOARDS = [
 # anything starting with this prefix should not be allowed
 EXAMPLE_KEYBOARD_PREFIX = 0xA6867BDFD3B00F
 
+# used by callers of hid_send which don't bring their own policy, so those still learn latency and trip the breaker
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def hid_send(dev, msg, retries=1, policy=None, telemetry=None):
+    """ Sends a request and waits for its response, pacing retries and read timeouts by the RetryPolicy """
 
-def hid_send(dev, msg, retries=1):
     if len(msg) > MSG_LEN:
         raise RuntimeError("message must be less than 32 bytes")
     msg += b"\x00" * (MSG_LEN - len(msg))
 
-    data = b""
-    first = True
+    if policy is None:
+        policy = DEFAULT_RETRY_POLICY
+    policy.check_circuit()
 
-    while retries > 0:
-        retries -= 1
-        if not first:
-            time.sleep(0.5)
-        first = False
+    attempts = policy.attempts(msg, retries)
+    deadline = policy.deadline(msg)
+    data = b""
+    tries = timeouts = 0
+    started = time.monotonic()
+
+    for attempt in range(attempts):
+        if attempt > 0:
+            if not policy.sleep_before_retry(attempt, deadline):
+                break
+            hid_flush(dev)
+        tries += 1
         try:
             # add 00 at start for hidapi report id
             if dev.write(b"\x00" + msg) != MSG_LEN + 1:
                 continue
 
-            data = bytes(dev.read(MSG_LEN, timeout_ms=500))
+            start = time.monotonic()
+            data = bytes(dev.read(MSG_LEN, timeout_ms=policy.read_timeout_ms(msg, attempt)))
             if not data:
+                timeouts += 1
                 continue
         except OSError:
             continue
+        # only learn latency from requests that weren't retried, a late reply can't be told apart
+        if attempt == 0:
+            policy.record_latency((time.monotonic() - start) * 1000)
         break
 
+    if telemetry is not None:
+        telemetry.record(msg, data, (time.monotonic() - started) * 1000, tries, timeouts)
+
     if not data:
+        policy.record_failure()
         raise RuntimeError("failed to communicate with the device")
+    policy.record_success()
     return data
 
 
+def hid_flush(dev, limit=4):
+    """ Discards responses which arrived after their request timed out, so they aren't taken for the next one """
+
+    # webhid reads don't honor the timeout
+    if sys.platform == "emscripten":
+        return
+    for _ in range(limit):
+        try:
+            if not dev.read(MSG_LEN, timeout_ms=1):
+                break
+        except OSError:
+            break
+
+
 def is_rawhid(desc, quiet):
     if desc["usage_page"] != 0xFF60 or desc["usage"] != 0x61:
         if not quiet:
@@ -137,6 +176,28 @@ def chunks(data, sz):
         yield data[i:i+sz]
 
 
+def changed_runs(old, new, record, sz):
+    """
+        Yields (offset, size) ranges of new, at most sz bytes each, covering every record which differs from old
+
+        Unchanged records between two changes are included in a range when that saves one, so the number of
+        ranges is the smallest possible. Every record counts as changed when old is None.
+    """
+
+    start = end = None
+    for offset in range(0, len(new), record):
+        if old is not None and new[offset:offset + record] == old[offset:offset + record]:
+            continue
+        if start is not None and offset + record - start <= sz:
+            end = offset + record
+            continue
+        if start is not None:
+            yield start, end - start
+        start, end = offset, offset + record
+    if start is not None:
+        yield start, end - start
+
+
 def pad_for_vibl(msg):
     """ Pads message to vibl fixed 64-byte length """
     if len(msg) > 64:
@@ -169,8 +230,11 @@ def make_scrollable(layout):
 
 class KeycodeDisplay:
 
-    keymap_override = KEYMAPS[0][1]
+    keymap_override = load_keymap(0)
     clients = []
+    # what display_keycode shows for a (keycode, theme), valid for one keymap override and generation of keycodes
+    display_cache = dict()
+    display_cache_generation = None
 
     @classmethod
     def get_label(cls, code):
@@ -186,7 +250,17 @@ class KeycodeDisplay:
         return key is not None and key.qmk_id in cls.keymap_override
 
     @classmethod
-    def display_keycode(cls, widget, code):
+    def display_data(cls, code):
+        """ Returns (text, mask text, tooltip, masked, color, mask color) a key showing code displays """
+
+        if cls.display_cache_generation != Keycode.generation:
+            cls.display_cache.clear()
+            cls.display_cache_generation = Keycode.generation
+        key = (code, Theme.get_theme())
+        data = cls.display_cache.get(key)
+        if data is not None:
+            return data
+
         text = cls.get_label(code)
         tooltip = Keycode.tooltip(code)
         mask = Keycode.is_mask(code)
@@ -196,22 +270,28 @@ class KeycodeDisplay:
             mask_text = cls.get_label(inner.qmk_id)
         if mask:
             text = text.split("\n")[0]
+        color = mask_color = None
+        if cls.code_is_overriden(code):
+            color = QApplication.palette().color(QPalette.Link)
+        if inner and mask and cls.code_is_overriden(inner.qmk_id):
+            mask_color = QApplication.palette().color(QPalette.Link)
+        data = cls.display_cache[key] = (text, mask_text, tooltip, mask, color, mask_color)
+        return data
+
+    @classmethod
+    def display_keycode(cls, widget, code):
+        text, mask_text, tooltip, mask, color, mask_color = cls.display_data(code)
         widget.masked = mask
         widget.setText(text)
         widget.setMaskText(mask_text)
         widget.setToolTip(tooltip)
-        if cls.code_is_overriden(code):
-            widget.setColor(QApplication.palette().color(QPalette.Link))
-        else:
-            widget.setColor(None)
-        if inner and mask and cls.code_is_overriden(inner.qmk_id):
-            widget.setMaskColor(QApplication.palette().color(QPalette.Link))
-        else:
-            widget.setMaskColor(None)
+        widget.setColor(color)
+        widget.setMaskColor(mask_color)
 
     @classmethod
     def set_keymap_override(cls, override):
         cls.keymap_override = override
+        cls.display_cache.clear()
         for client in cls.clients:
             client.on_keymap_override()
 
@@ -1,21 +1,31 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
+import logging
+import os
+import struct
 import time
 
 from hidproxy import hid
 from protocol.keyboard_comm import Keyboard
 from protocol.dummy_keyboard import DummyKeyboard
-from util import MSG_LEN, pad_for_vibl
+from protocol.retry import RetryPolicy
+from protocol.transcript import unused_path
+from util import MSG_LEN, VIAL_SERIAL_NUMBER_MAGIC, pad_for_vibl
+
+# set to a file path to capture a HID transcript of every keyboard session, for offline replay and profiling;
+# sessions after the first one get a numeric suffix instead of overwriting the earlier transcripts
+TRANSCRIPT_ENV = "VIAL_HID_TRANSCRIPT"
 
 
 class VialDevice:
 
-    def __init__(self, dev):
+    def __init__(self, dev, policy=None):
         self.desc = dev
         self.dev = None
         self.sideload = False
         self.via_stack = False
+        self.policy = policy if policy is not None else RetryPolicy()
 
-    def open(self, override_json=None):
+    def open(self, override_json=None, progress=None, run_on_gui=None):
         self.dev = hid.device()
         for x in range(10):
             try:
@@ -38,17 +48,32 @@ class VialDevice:
 
 class VialKeyboard(VialDevice):
 
-    def __init__(self, dev, sideload=False, via_stack=False):
-        super().__init__(dev)
+    # DefinitionCache shared by all keyboards, set up by the main window
+    definition_cache = None
+
+    def __init__(self, dev, sideload=False, via_stack=False, policy=None):
+        super().__init__(dev, policy)
         self.via_id = str(dev["vendor_id"] * 65536 + dev["product_id"])
         self.sideload = sideload
         self.via_stack = via_stack
         self.keyboard = None
 
-    def open(self, override_json=None):
+    def open(self, override_json=None, progress=None, run_on_gui=None):
         super().open(override_json)
-        self.keyboard = Keyboard(self.dev)
-        self.keyboard.reload(override_json)
+        self.open_keyboard(override_json, progress, run_on_gui)
+
+    def open_keyboard(self, override_json=None, progress=None, run_on_gui=None):
+        self.keyboard = Keyboard(self.dev, policy=self.policy, definition_cache=self.definition_cache)
+        if os.environ.get(TRANSCRIPT_ENV):
+            path = unused_path(os.environ[TRANSCRIPT_ENV])
+            logging.info("Recording HID transcript to {}".format(path))
+            self.keyboard.transport.start_recording(path)
+        self.keyboard.reload(override_json, progress=progress, run_on_gui=run_on_gui)
+
+    def close(self):
+        if self.keyboard is not None:
+            self.keyboard.transport.stop_recording()
+        super().close()
 
     def title(self):
         s = "{} {}".format(self.desc["manufacturer_string"], self.desc["product_string"]).strip()
@@ -64,7 +89,7 @@ class VialKeyboard(VialDevice):
         except OSError:
             return b""
         self.send(b"\xFE\x00" + b"\x00" * 30)
-        data = self.recv(MSG_LEN, timeout_ms=500)
+        data = self.recv(MSG_LEN, timeout_ms=self.policy.read_timeout_ms())
         super().close()
         return data[4:12]
 
@@ -80,20 +105,39 @@ class VialBootloader(VialDevice):
         except OSError:
             return b""
         self.send(pad_for_vibl(b"VC\x01"))
-        data = self.recv(8, timeout_ms=500)
+        data = self.recv(8, timeout_ms=self.policy.read_timeout_ms())
         super().close()
         return data
 
 
+class VialEmulatedKeyboard(VialKeyboard):
+    """ A VialKeyboard backed by an in-process EmulatedDevice instead of USB hardware """
+
+    def __init__(self, device, policy=None):
+        super().__init__({
+            "vendor_id": 0xFEED, "product_id": 0xE4E4, "serial_number": VIAL_SERIAL_NUMBER_MAGIC,
+            "path": "/emulated/keyboard", "manufacturer_string": "Vial", "product_string": "Emulated Keyboard",
+        }, policy=policy)
+        self.emulated = device
+
+    def open(self, override_json=None, progress=None, run_on_gui=None):
+        self.dev = self.emulated
+        self.open_keyboard(override_json, progress, run_on_gui)
+
+    def get_uid(self):
+        return struct.pack("<Q", self.emulated.firmware.keyboard_id)
+
+
 class VialDummyKeyboard(VialKeyboard):
 
     def __init__(self):
         self.sideload = True
         self.desc = {"path": "/dummy/keyboard"}
+        self.policy = RetryPolicy()
 
-    def open(self, override_json=None):
+    def open(self, override_json=None, progress=None, run_on_gui=None):
         self.keyboard = DummyKeyboard(None, usb_send=self.raise_usb_send)
-        self.keyboard.reload(override_json)
+        self.keyboard.reload(override_json, progress=progress, run_on_gui=run_on_gui)
 
     def title(self):
         return "[Dummy Keyboard]"
@@ -0,0 +1,228 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
+
+from PyQt5.QtGui import QPainterPath, QTransform, QPolygonF
+from PyQt5.QtCore import QRect, QPointF
+
+from constants import KEY_SIZE_RATIO, KEY_SPACING_RATIO, KEYBOARD_WIDGET_MASK_HEIGHT, KEY_ROUNDNESS, \
+    SHADOW_SIDE_PADDING, SHADOW_TOP_PADDING, SHADOW_BOTTOM_PADDING, KEYBOARD_WIDGET_NONMASK_PADDING
+
+
+class KeyGeometry:
+
+    """
+        Where a key is drawn and which area it reacts to, for one scale and shift
+
+        Instances are never modified once built and are shared through get() by every view of the same key, views
+        only keep their own state (legends, pressed, selected...) next to a reference to one of these. A geometry
+        doesn't reference its descriptor, so the placements of a definition go away together with its keys.
+    """
+
+    __slots__ = ("scale", "shift_x", "shift_y", "size", "rotation_angle", "rotation_x", "rotation_y", "transform", "has2",
+                 "x", "y", "w", "h", "x2", "y2", "w2", "h2", "corner", "rect", "rect2", "text_rect", "nonmask_rect",
+                 "mask_rect", "bbox", "bbox2", "mask_bbox", "polygon", "polygon2", "mask_polygon", "bounds",
+                 "background_draw_path", "foreground_draw_path", "extra_draw_path")
+
+    # placements remembered for a single key, a few layout options and zoom levels
+    MAX_PLACEMENTS = 16
+    placements = WeakKeyDictionary()
+
+    @classmethod
+    def get(cls, desc, scale, shift_x=0, shift_y=0):
+        """ Returns the geometry of the key described by desc, building it on first use """
+
+        placements = KeyGeometry.placements.get(desc)
+        if placements is None:
+            placements = KeyGeometry.placements[desc] = OrderedDict()
+        key = (cls, scale, shift_x, shift_y)
+        geometry = placements.get(key)
+        if geometry is None:
+            geometry = placements[key] = cls(desc, scale, shift_x, shift_y)
+            if len(placements) > cls.MAX_PLACEMENTS:
+                placements.popitem(last=False)
+        else:
+            placements.move_to_end(key)
+        return geometry
+
+    def __init__(self, desc, scale, shift_x=0, shift_y=0):
+        self.scale = scale
+        self.rotation_angle = desc.rotation_angle
+        self.has2 = desc.width2 != desc.width or desc.height2 != desc.height or desc.x2 != 0 or desc.y2 != 0
+        self.size = self.scale * (KEY_SIZE_RATIO + KEY_SPACING_RATIO)
+        spacing = self.scale * KEY_SPACING_RATIO
+
+        self.rotation_x = self.size * desc.rotation_x
+        self.rotation_y = self.size * desc.rotation_y
+
+        self.shift_x = shift_x
+        self.shift_y = shift_y
+        self.transform = QTransform()
+        self.transform.translate(self.shift_x, self.shift_y)
+        self.transform.translate(self.rotation_x, self.rotation_y)
+        self.transform.rotate(self.rotation_angle)
+        self.transform.translate(-self.rotation_x, -self.rotation_y)
+        self.x = self.size * desc.x
+        self.y = self.size * desc.y
+        self.w = self.size * desc.width - spacing
+        self.h = self.size * desc.height - spacing
+
+        self.rect = QRect(
+            round(self.x),
+            round(self.y),
+            round(self.w),
+            round(self.h)
+        )
+        self.text_rect = QRect(
+            round(self.x),
+            round(self.y + self.size * SHADOW_TOP_PADDING),
+            round(self.w),
+            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
+        )
+
+        self.x2 = self.x + self.size * desc.x2
+        self.y2 = self.y + self.size * desc.y2
+        self.w2 = self.size * desc.width2 - spacing
+        self.h2 = self.size * desc.height2 - spacing
+
+        self.rect2 = QRect(
+            round(self.x2),
+            round(self.y2),
+            round(self.w2),
+            round(self.h2)
+        )
+
+        self.bbox = self.calculate_bbox(self.rect)
+        self.bbox2 = self.calculate_bbox(self.rect2)
+        self.polygon = QPolygonF(self.bbox + [self.bbox[0]])
+        self.polygon2 = QPolygonF(self.bbox2 + [self.bbox2[0]])
+        self.polygon = self.polygon.united(self.polygon2)
+        self.corner = self.size * KEY_ROUNDNESS
+        self.background_draw_path = self.calculate_background_draw_path()
+        self.foreground_draw_path = self.calculate_foreground_draw_path()
+        self.extra_draw_path = self.calculate_extra_draw_path(desc)
+
+        # calculate areas where the inner keycode will be located
+        # nonmask = outer (e.g. Rsft_T)
+        # mask = inner (e.g. KC_A)
+        self.nonmask_rect = QRect(
+            round(self.x),
+            round(self.y + self.size * KEYBOARD_WIDGET_NONMASK_PADDING),
+            round(self.w),
+            round(self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT))
+        )
+        self.mask_rect = QRect(
+            round(self.x + self.size * SHADOW_SIDE_PADDING),
+            round(self.y + self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT)),
+            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
+            round(self.h * KEYBOARD_WIDGET_MASK_HEIGHT - self.size * SHADOW_BOTTOM_PADDING)
+        )
+        self.mask_bbox = self.calculate_bbox(self.mask_rect)
+        self.mask_polygon = QPolygonF(self.mask_bbox + [self.mask_bbox[0]])
+        # the encoder arrow sticks out of the key
+        self.bounds = self.polygon.boundingRect().united(self.transform.map(self.extra_draw_path).boundingRect())
+
+    def calculate_bbox(self, rect):
+        x1 = rect.topLeft().x()
+        y1 = rect.topLeft().y()
+        x2 = rect.bottomRight().x()
+        y2 = rect.bottomRight().y()
+        points = [(x1, y1), (x1, y2), (x2, y2), (x2, y1)]
+        return [self.transform.map(QPointF(x, y)) for x, y in points]
+
+    def calculate_background_draw_path(self):
+        path = QPainterPath()
+        path.addRoundedRect(
+            round(self.x),
+            round(self.y),
+            round(self.w),
+            round(self.h),
+            self.corner,
+            self.corner
+        )
+
+        # second part only considered if different from first
+        if self.has2:
+            path2 = QPainterPath()
+            path2.addRoundedRect(
+                round(self.x2),
+                round(self.y2),
+                round(self.w2),
+                round(self.h2),
+                self.corner,
+                self.corner
+            )
+            path = path.united(path2)
+
+        return path
+
+    def calculate_foreground_draw_path(self):
+        path = QPainterPath()
+        path.addRoundedRect(
+            round(self.x + self.size * SHADOW_SIDE_PADDING),
+            round(self.y + self.size * SHADOW_TOP_PADDING),
+            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
+            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
+            self.corner,
+            self.corner
+        )
+
+        # second part only considered if different from first
+        if self.has2:
+            path2 = QPainterPath()
+            path2.addRoundedRect(
+                round(self.x2 + self.size * SHADOW_SIDE_PADDING),
+                round(self.y2 + self.size * SHADOW_TOP_PADDING),
+                round(self.w2 - 2 * self.size * SHADOW_SIDE_PADDING),
+                round(self.h2 - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
+                self.corner,
+                self.corner
+            )
+            path = path.united(path2)
+
+        return path
+
+    def calculate_extra_draw_path(self, desc):
+        return QPainterPath()
+
+
+class EncoderGeometry(KeyGeometry):
+
+    __slots__ = ()
+
+    def calculate_background_draw_path(self):
+        path = QPainterPath()
+        path.addEllipse(round(self.x), round(self.y), round(self.w), round(self.h))
+        return path
+
+    def calculate_foreground_draw_path(self):
+        path = QPainterPath()
+        path.addEllipse(
+            round(self.x + self.size * SHADOW_SIDE_PADDING),
+            round(self.y + self.size * SHADOW_TOP_PADDING),
+            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
+            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
+        )
+        return path
+
+    def calculate_extra_draw_path(self, desc):
+        path = QPainterPath()
+        # midpoint of arrow triangle
+        p = self.h
+        x = self.x
+        y = self.y + p / 2
+        if desc.encoder_dir == 0:
+            # counterclockwise - pointing down
+            path.moveTo(round(x), round(y))
+            path.lineTo(round(x + p / 10), round(y - p / 10))
+            path.lineTo(round(x), round(y + p / 10))
+            path.lineTo(round(x - p / 10), round(y - p / 10))
+            path.lineTo(round(x), round(y))
+        else:
+            # clockwise - pointing up
+            path.moveTo(round(x), round(y))
+            path.lineTo(round(x + p / 10), round(y + p / 10))
+            path.lineTo(round(x), round(y - p / 10))
+            path.lineTo(round(x - p / 10), round(y + p / 10))
+            path.lineTo(round(x), round(y))
+        return path
@@ -1,17 +1,24 @@
+import math
 from collections import defaultdict
 
-from PyQt5.QtGui import QPainter, QColor, QPainterPath, QTransform, QBrush, QPolygonF, QPalette
+from PyQt5.QtGui import QPainter, QColor, QTransform, QBrush, QPalette, QPen, QPixmap, QFont
 from PyQt5.QtWidgets import QWidget, QToolTip, QApplication
-from PyQt5.QtCore import Qt, QSize, QRect, QPointF, pyqtSignal, QEvent, QRectF
+from PyQt5.QtCore import Qt, QSize, QPointF, pyqtSignal, QEvent, QRectF
 
-from constants import KEY_SIZE_RATIO, KEY_SPACING_RATIO, KEYBOARD_WIDGET_PADDING, \
-    KEYBOARD_WIDGET_MASK_HEIGHT, KEY_ROUNDNESS, SHADOW_SIDE_PADDING, SHADOW_TOP_PADDING, SHADOW_BOTTOM_PADDING, \
-    KEYBOARD_WIDGET_NONMASK_PADDING
+from constants import KEYBOARD_WIDGET_PADDING
 from themes import Theme
+from widgets.key_geometry import KeyGeometry, EncoderGeometry
 
 
 class KeyWidget:
 
+    """ What one view shows on a key, the placement itself is a KeyGeometry shared with every other view """
+
+    __slots__ = ("active", "on", "masked", "pressed", "desc", "text", "mask_text", "tooltip", "color", "mask_color",
+                 "tile", "tile_state", "geometry")
+
+    geometry_class = KeyGeometry
+
     def __init__(self, desc, scale, shift_x=0, shift_y=0):
         self.active = False
         self.on = False
@@ -23,154 +30,24 @@ class KeyWidget:
         self.tooltip = ""
         self.color = None
         self.mask_color = None
-        self.scale = 0
-
-        self.rotation_angle = desc.rotation_angle
-
-        self.has2 = desc.width2 != desc.width or desc.height2 != desc.height or desc.x2 != 0 or desc.y2 != 0
+        # drawing of the key for tile_state, see KeyTilePainter.key_tile
+        self.tile = None
+        self.tile_state = None
+        self.geometry = None
 
         self.update_position(scale, shift_x, shift_y)
 
+    def __getattr__(self, name):
+        # rect, polygon, transform, draw paths... all come from the shared geometry
+        if name == "geometry":
+            raise AttributeError(name)
+        return getattr(self.geometry, name)
+
     def update_position(self, scale, shift_x=0, shift_y=0):
-        if self.scale != scale or self.shift_x != shift_x or self.shift_y != shift_y:
-            self.scale = scale
-            self.size = self.scale * (KEY_SIZE_RATIO + KEY_SPACING_RATIO)
-            spacing = self.scale * KEY_SPACING_RATIO
-
-            self.rotation_x = self.size * self.desc.rotation_x
-            self.rotation_y = self.size * self.desc.rotation_y
-
-            self.shift_x = shift_x
-            self.shift_y = shift_y
-            self.x = self.size * self.desc.x
-            self.y = self.size * self.desc.y
-            self.w = self.size * self.desc.width - spacing
-            self.h = self.size * self.desc.height - spacing
-
-            self.rect = QRect(
-                round(self.x),
-                round(self.y),
-                round(self.w),
-                round(self.h)
-            )
-            self.text_rect = QRect(
-                round(self.x),
-                round(self.y + self.size * SHADOW_TOP_PADDING),
-                round(self.w),
-                round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
-            )
-
-            self.x2 = self.x + self.size * self.desc.x2
-            self.y2 = self.y + self.size * self.desc.y2
-            self.w2 = self.size * self.desc.width2 - spacing
-            self.h2 = self.size * self.desc.height2 - spacing
-
-            self.rect2 = QRect(
-                round(self.x2),
-                round(self.y2),
-                round(self.w2),
-                round(self.h2)
-            )
-
-            self.bbox = self.calculate_bbox(self.rect)
-            self.bbox2 = self.calculate_bbox(self.rect2)
-            self.polygon = QPolygonF(self.bbox + [self.bbox[0]])
-            self.polygon2 = QPolygonF(self.bbox2 + [self.bbox2[0]])
-            self.polygon = self.polygon.united(self.polygon2)
-            self.corner = self.size * KEY_ROUNDNESS
-            self.background_draw_path = self.calculate_background_draw_path()
-            self.foreground_draw_path = self.calculate_foreground_draw_path()
-            self.extra_draw_path = self.calculate_extra_draw_path()
-
-            # calculate areas where the inner keycode will be located
-            # nonmask = outer (e.g. Rsft_T)
-            # mask = inner (e.g. KC_A)
-            self.nonmask_rect = QRect(
-                round(self.x),
-                round(self.y + self.size * KEYBOARD_WIDGET_NONMASK_PADDING),
-                round(self.w),
-                round(self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT))
-            )
-            self.mask_rect = QRect(
-                round(self.x + self.size * SHADOW_SIDE_PADDING),
-                round(self.y + self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT)),
-                round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-                round(self.h * KEYBOARD_WIDGET_MASK_HEIGHT - self.size * SHADOW_BOTTOM_PADDING)
-            )
-            self.mask_bbox = self.calculate_bbox(self.mask_rect)
-            self.mask_polygon = QPolygonF(self.mask_bbox + [self.mask_bbox[0]])
-
-    def calculate_bbox(self, rect):
-        x1 = rect.topLeft().x()
-        y1 = rect.topLeft().y()
-        x2 = rect.bottomRight().x()
-        y2 = rect.bottomRight().y()
-        points = [(x1, y1), (x1, y2), (x2, y2), (x2, y1)]
-        bbox = []
-        for p in points:
-            t = QTransform()
-            t.translate(self.shift_x, self.shift_y)
-            t.translate(self.rotation_x, self.rotation_y)
-            t.rotate(self.rotation_angle)
-            t.translate(-self.rotation_x, -self.rotation_y)
-            p = t.map(QPointF(p[0], p[1]))
-            bbox.append(p)
-        return bbox
-
-    def calculate_background_draw_path(self):
-        path = QPainterPath()
-        path.addRoundedRect(
-            round(self.x),
-            round(self.y),
-            round(self.w),
-            round(self.h),
-            self.corner,
-            self.corner
-        )
-
-        # second part only considered if different from first
-        if self.has2:
-            path2 = QPainterPath()
-            path2.addRoundedRect(
-                round(self.x2),
-                round(self.y2),
-                round(self.w2),
-                round(self.h2),
-                self.corner,
-                self.corner
-            )
-            path = path.united(path2)
-
-        return path
-
-    def calculate_foreground_draw_path(self):
-        path = QPainterPath()
-        path.addRoundedRect(
-            round(self.x + self.size * SHADOW_SIDE_PADDING),
-            round(self.y + self.size * SHADOW_TOP_PADDING),
-            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
-            self.corner,
-            self.corner
-        )
-
-        # second part only considered if different from first
-        if self.has2:
-            path2 = QPainterPath()
-            path2.addRoundedRect(
-                round(self.x2 + self.size * SHADOW_SIDE_PADDING),
-                round(self.y2 + self.size * SHADOW_TOP_PADDING),
-                round(self.w2 - 2 * self.size * SHADOW_SIDE_PADDING),
-                round(self.h2 - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
-                self.corner,
-                self.corner
-            )
-            path = path.united(path2)
-
-        return path
-
-    def calculate_extra_draw_path(self):
-        return QPainterPath()
+        geometry = self.geometry
+        if geometry is None or geometry.scale != scale or geometry.shift_x != shift_x or geometry.shift_y != shift_y:
+            self.geometry = self.geometry_class.get(self.desc, scale, shift_x, shift_y)
+            self.tile = None
 
     def setText(self, text):
         self.text = text
@@ -207,48 +84,147 @@ class KeyWidget:
 
 class EncoderWidget(KeyWidget):
 
-    def calculate_background_draw_path(self):
-        path = QPainterPath()
-        path.addEllipse(round(self.x), round(self.y), round(self.w), round(self.h))
-        return path
-
-    def calculate_foreground_draw_path(self):
-        path = QPainterPath()
-        path.addEllipse(
-            round(self.x + self.size * SHADOW_SIDE_PADDING),
-            round(self.y + self.size * SHADOW_TOP_PADDING),
-            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
-        )
-        return path
-
-    def calculate_extra_draw_path(self):
-        path = QPainterPath()
-        # midpoint of arrow triangle
-        p = self.h
-        x = self.x
-        y = self.y + p / 2
-        if self.desc.encoder_dir == 0:
-            # counterclockwise - pointing down
-            path.moveTo(round(x), round(y))
-            path.lineTo(round(x + p / 10), round(y - p / 10))
-            path.lineTo(round(x), round(y + p / 10))
-            path.lineTo(round(x - p / 10), round(y - p / 10))
-            path.lineTo(round(x), round(y))
-        else:
-            # clockwise - pointing up
-            path.moveTo(round(x), round(y))
-            path.lineTo(round(x + p / 10), round(y + p / 10))
-            path.lineTo(round(x), round(y - p / 10))
-            path.lineTo(round(x - p / 10), round(y + p / 10))
-            path.lineTo(round(x), round(y))
-        return path
+    __slots__ = ()
+
+    geometry_class = EncoderGeometry
 
     def __repr__(self):
         return "EncoderWidget"
 
 
-class KeyboardWidget(QWidget):
+class KeyGrid:
+
+    """
+        Uniform grid over the bounding boxes of keys, hit tests only check the keys overlapping the cell of a point
+
+        Every cell keeps its keys in the order they were given in, so the first key found is the same as with a
+        linear scan.
+    """
+
+    def __init__(self, keys):
+        self.cells = defaultdict(list)
+        # about the size of a regular key
+        sides = sorted(min(key.bounds.width(), key.bounds.height()) for key in keys)
+        self.cell_size = (sides[len(sides) // 2] if sides else 0) or 1
+        for key in keys:
+            b = key.bounds
+            for cx in range(math.floor(b.left() / self.cell_size), math.floor(b.right() / self.cell_size) + 1):
+                for cy in range(math.floor(b.top() / self.cell_size), math.floor(b.bottom() / self.cell_size) + 1):
+                    self.cells[(cx, cy)].append(key)
+
+    def candidates(self, pos):
+        return self.cells.get((math.floor(pos.x() / self.cell_size), math.floor(pos.y() / self.cell_size)), [])
+
+
+class PaintStyles:
+
+    """ Pens, brushes and fonts keys are drawn with, derived from the application palette """
+
+    def __init__(self, font):
+        palette = QApplication.palette()
+        button = palette.color(QPalette.Button)
+        highlight = palette.color(QPalette.Highlight)
+
+        # for regular keycaps
+        self.regular_pen = QPen(palette.color(QPalette.ButtonText))
+        self.background_brush = QBrush(button)
+        self.foreground_brush = QBrush(button.lighter(120))
+        self.mask_brush = QBrush(button.lighter(Theme.mask_light_factor()))
+
+        # for currently selected keycap
+        self.active_pen = QPen(highlight)
+        self.active_pen.setWidthF(1.5)
+
+        # for the encoder arrow
+        self.extra_pen = self.regular_pen
+        self.extra_brush = QBrush(palette.color(QPalette.ButtonText))
+
+        # for pressed keycaps
+        self.background_pressed_brush = QBrush(highlight)
+        self.foreground_pressed_brush = QBrush(highlight.lighter(120))
+        self.background_on_brush = QBrush(highlight.darker(150))
+        self.foreground_on_brush = QBrush(highlight.darker(120))
+
+        self.font = font
+        self.mask_font = QFont(font)
+        self.mask_font.setPointSize(round(font.pointSize() * 0.8))
+
+
+class KeyTilePainter:
+
+    """
+        Paints the keys of a keyboard widget from pixmap tiles cached on the keys
+
+        A tile is redrawn only when key_state() of its key, the scale or the device pixel ratio changed, and only
+        the keys within the dirty area are painted. The widget provides key_state() and
+        draw_key(qp, key, styles, active, active_mask), with active and active_mask the first two items of the state.
+    """
+
+    paint_styles_class = PaintStyles
+
+    def paint_styles(self):
+        """ Returns PaintStyles for the current palette, theme and font """
+
+        key = (QApplication.palette().cacheKey(), Theme.get_theme(), self.font().key())
+        if key != self.styles_key:
+            self.styles = self.paint_styles_class(self.font())
+            self.styles_key = key
+        return self.styles
+
+    def key_tile(self, key):
+        """ Returns a pixmap of the key and its position, only redrawn when its state or geometry changed """
+
+        state = self.key_state(key) + (self.scale, self.devicePixelRatioF())
+        if key.tile is None or key.tile_state != state:
+            rect = self.key_rect(key)
+            pixmap = QPixmap(rect.size() * state[-1])
+            pixmap.setDevicePixelRatio(state[-1])
+            pixmap.fill(Qt.transparent)
+            qp = QPainter(pixmap)
+            qp.setRenderHint(QPainter.Antialiasing)
+            qp.setTransform(key.transform * QTransform.fromScale(self.scale, self.scale) *
+                            QTransform.fromTranslate(-rect.x(), -rect.y()))
+            self.draw_key(qp, key, self.styles, state[0], state[1])
+            qp.end()
+            key.tile = (rect.topLeft(), pixmap)
+            key.tile_state = state
+        return key.tile
+
+    def key_rect(self, key):
+        """ Area of the widget a key is drawn in, including the outline of a selected key """
+
+        b = key.bounds
+        # half of the scaled outline and a pixel of antialiasing
+        margin = math.ceil(self.scale) + 1
+        return QRectF(b.x() * self.scale, b.y() * self.scale, b.width() * self.scale,
+                      b.height() * self.scale).toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    def update_keys(self, keys):
+        """ Schedules a repaint of only the given keys """
+
+        for key in keys:
+            if key is not None:
+                self.update(self.key_rect(key))
+
+    def paintEvent(self, event):
+        qp = QPainter()
+        qp.begin(self)
+        qp.setRenderHint(QPainter.Antialiasing)
+
+        self.paint_styles()
+        dirty = event.rect()
+        partial = not dirty.contains(self.rect())
+
+        for key in self.widgets:
+            if partial and not dirty.intersects(self.key_rect(key)):
+                continue
+            pos, pixmap = self.key_tile(key)
+            qp.drawPixmap(pos, pixmap)
+
+        qp.end()
+
+
+class KeyboardWidget(KeyTilePainter, QWidget):
 
     clicked = pyqtSignal()
     deselected = pyqtSignal()
@@ -278,11 +254,24 @@ class KeyboardWidget(QWidget):
         self.active_key = None
         self.active_mask = False
 
+        # layout options the keys depend on
+        self.layout_indices = []
+        # what the keys were last placed for, see update_layout
+        self.geometry_inputs = None
+        self.geometry_generation = 0
+        self.grid = None
+        self.grid_generation = None
+
+        self.styles = None
+        self.styles_key = None
+
     def set_keys(self, keys, encoders):
         self.common_widgets = []
         self.widgets_for_layout = []
 
         self.add_keys([(x, KeyWidget) for x in keys] + [(x, EncoderWidget) for x in encoders])
+        self.layout_indices = sorted(set(w.desc.layout_index for w in self.widgets_for_layout))
+        self.geometry_inputs = None
         self.update_layout()
 
     def add_keys(self, keys):
@@ -337,8 +326,20 @@ class KeyboardWidget(QWidget):
             widget.update_position(widget.scale, widget.shift_x - top_x + self.padding,
                                    widget.shift_y - top_y + self.padding)
 
+    def layout_inputs(self):
+        """ Everything placing the keys depends on: font size, scale and the chosen layout options """
+
+        return (self.fontMetrics().height(), self.scale,
+                tuple(self.layout_editor.get_choice(idx) for idx in self.layout_indices))
+
     def update_layout(self):
-        """ Updates self.widgets for the currently active layout """
+        """ Updates self.widgets for the currently active layout, unless nothing it depends on changed """
+
+        inputs = self.layout_inputs()
+        if inputs == self.geometry_inputs:
+            return
+        self.geometry_inputs = inputs
+        self.geometry_generation += 1
 
         # determine widgets for current layout
         self.place_widgets()
@@ -359,118 +360,62 @@ class KeyboardWidget(QWidget):
         self.update()
         self.updateGeometry()
 
-    def paintEvent(self, event):
-        qp = QPainter()
-        qp.begin(self)
-        qp.setRenderHint(QPainter.Antialiasing)
-
-        # for regular keycaps
-        regular_pen = qp.pen()
-        regular_pen.setColor(QApplication.palette().color(QPalette.ButtonText))
-        qp.setPen(regular_pen)
-
-        background_brush = QBrush()
-        background_brush.setColor(QApplication.palette().color(QPalette.Button))
-        background_brush.setStyle(Qt.SolidPattern)
-
-        foreground_brush = QBrush()
-        foreground_brush.setColor(QApplication.palette().color(QPalette.Button).lighter(120))
-        foreground_brush.setStyle(Qt.SolidPattern)
-
-        mask_brush = QBrush()
-        mask_brush.setColor(QApplication.palette().color(QPalette.Button).lighter(Theme.mask_light_factor()))
-        mask_brush.setStyle(Qt.SolidPattern)
-
-        # for currently selected keycap
-        active_pen = qp.pen()
-        active_pen.setColor(QApplication.palette().color(QPalette.Highlight))
-        active_pen.setWidthF(1.5)
-
-        # for the encoder arrow
-        extra_pen = regular_pen
-        extra_brush = QBrush()
-        extra_brush.setColor(QApplication.palette().color(QPalette.ButtonText))
-        extra_brush.setStyle(Qt.SolidPattern)
-
-        # for pressed keycaps
-        background_pressed_brush = QBrush()
-        background_pressed_brush.setColor(QApplication.palette().color(QPalette.Highlight))
-        background_pressed_brush.setStyle(Qt.SolidPattern)
-
-        foreground_pressed_brush = QBrush()
-        foreground_pressed_brush.setColor(QApplication.palette().color(QPalette.Highlight).lighter(120))
-        foreground_pressed_brush.setStyle(Qt.SolidPattern)
-
-        background_on_brush = QBrush()
-        background_on_brush.setColor(QApplication.palette().color(QPalette.Highlight).darker(150))
-        background_on_brush.setStyle(Qt.SolidPattern)
-
-        foreground_on_brush = QBrush()
-        foreground_on_brush.setColor(QApplication.palette().color(QPalette.Highlight).darker(120))
-        foreground_on_brush.setStyle(Qt.SolidPattern)
-
-        mask_font = qp.font()
-        mask_font.setPointSize(round(mask_font.pointSize() * 0.8))
-
-        for idx, key in enumerate(self.widgets):
-            qp.save()
-
-            qp.scale(self.scale, self.scale)
-            qp.translate(key.shift_x, key.shift_y)
-            qp.translate(key.rotation_x, key.rotation_y)
-            qp.rotate(key.rotation_angle)
-            qp.translate(-key.rotation_x, -key.rotation_y)
-
-            active = key.active or (self.active_key == key and not self.active_mask)
-
-            # draw keycap background/drop-shadow
-            qp.setPen(active_pen if active else Qt.NoPen)
-            brush = background_brush
-            if key.pressed:
-                brush = background_pressed_brush
-            elif key.on:
-                brush = background_on_brush
-            qp.setBrush(brush)
-            qp.drawPath(key.background_draw_path)
-
-            # draw keycap foreground
-            qp.setPen(Qt.NoPen)
-            brush = foreground_brush
-            if key.pressed:
-                brush = foreground_pressed_brush
-            elif key.on:
-                brush = foreground_on_brush
-            qp.setBrush(brush)
-            qp.drawPath(key.foreground_draw_path)
-
-            # draw key text
-            if key.masked:
-                # draw the outer legend
-                qp.setFont(mask_font)
-                qp.setPen(key.color if key.color else regular_pen)
-                qp.drawText(key.nonmask_rect, Qt.AlignCenter, key.text)
-
-                # draw the inner highlight rect
-                qp.setPen(active_pen if self.active_key == key and self.active_mask else Qt.NoPen)
-                qp.setBrush(mask_brush)
-                qp.drawRoundedRect(key.mask_rect, key.corner, key.corner)
-
-                # draw the inner legend
-                qp.setPen(key.mask_color if key.mask_color else regular_pen)
-                qp.drawText(key.mask_rect, Qt.AlignCenter, key.mask_text)
-            else:
-                # draw the legend
-                qp.setPen(key.color if key.color else regular_pen)
-                qp.drawText(key.text_rect, Qt.AlignCenter, key.text)
-
-            # draw the extra shape (encoder arrow)
-            qp.setPen(extra_pen)
-            qp.setBrush(extra_brush)
-            qp.drawPath(key.extra_draw_path)
-
-            qp.restore()
+    def key_state(self, key):
+        """ Everything the drawing of a key depends on, besides its geometry """
+
+        return (key.active or (self.active_key == key and not self.active_mask),
+                self.active_key == key and self.active_mask,
+                key.pressed, key.on, key.masked, key.text, key.mask_text,
+                key.color.rgba() if key.color else None, key.mask_color.rgba() if key.mask_color else None,
+                self.styles_key)
+
+    def draw_key(self, qp, key, styles, active, active_mask):
+        qp.setFont(styles.font)
+
+        # draw keycap background/drop-shadow
+        qp.setPen(styles.active_pen if active else Qt.NoPen)
+        brush = styles.background_brush
+        if key.pressed:
+            brush = styles.background_pressed_brush
+        elif key.on:
+            brush = styles.background_on_brush
+        qp.setBrush(brush)
+        qp.drawPath(key.background_draw_path)
+
+        # draw keycap foreground
+        qp.setPen(Qt.NoPen)
+        brush = styles.foreground_brush
+        if key.pressed:
+            brush = styles.foreground_pressed_brush
+        elif key.on:
+            brush = styles.foreground_on_brush
+        qp.setBrush(brush)
+        qp.drawPath(key.foreground_draw_path)
+
+        # draw key text
+        if key.masked:
+            # draw the outer legend
+            qp.setFont(styles.mask_font)
+            qp.setPen(key.color if key.color else styles.regular_pen)
+            qp.drawText(key.nonmask_rect, Qt.AlignCenter, key.text)
+
+            # draw the inner highlight rect
+            qp.setPen(styles.active_pen if active_mask else Qt.NoPen)
+            qp.setBrush(styles.mask_brush)
+            qp.drawRoundedRect(key.mask_rect, key.corner, key.corner)
+
+            # draw the inner legend
+            qp.setPen(key.mask_color if key.mask_color else styles.regular_pen)
+            qp.drawText(key.mask_rect, Qt.AlignCenter, key.mask_text)
+        else:
+            # draw the legend
+            qp.setPen(key.color if key.color else styles.regular_pen)
+            qp.drawText(key.text_rect, Qt.AlignCenter, key.text)
 
-        qp.end()
+        # draw the extra shape (encoder arrow)
+        qp.setPen(styles.extra_pen)
+        qp.setBrush(styles.extra_brush)
+        qp.drawPath(key.extra_draw_path)
 
     def minimumSizeHint(self):
         return QSize(self.width, self.height)
@@ -478,10 +423,15 @@ class KeyboardWidget(QWidget):
     def hit_test(self, pos):
         """ Returns key, hit_masked_part """
 
-        for key in self.widgets:
-            if key.masked and key.mask_polygon.containsPoint(pos/self.scale, Qt.OddEvenFill):
+        if self.grid_generation != self.geometry_generation:
+            self.grid = KeyGrid(self.widgets)
+            self.grid_generation = self.geometry_generation
+
+        pos = QPointF(pos / self.scale)
+        for key in self.grid.candidates(pos):
+            if key.masked and key.mask_polygon.containsPoint(pos, Qt.OddEvenFill):
                 return key, True
-            if key.polygon.containsPoint(pos/self.scale, Qt.OddEvenFill):
+            if key.polygon.containsPoint(pos, Qt.OddEvenFill):
                 return key, False
 
         return None, False
@@ -490,12 +440,13 @@ class KeyboardWidget(QWidget):
         if not self.enabled:
             return
 
+        previous = self.active_key
         self.active_key, self.active_mask = self.hit_test(ev.pos())
         if self.active_key is not None:
             self.clicked.emit()
         else:
             self.deselected.emit()
-        self.update()
+        self.update_keys([previous, self.active_key])
 
     def resizeEvent(self, ev):
         if self.isEnabled():
@@ -1,261 +1,77 @@
 from collections import defaultdict
 
-from PyQt5.QtGui import QPainter, QColor, QPainterPath, QTransform, QBrush, QPolygonF, QPalette
+from PyQt5.QtGui import QColor, QBrush, QPalette, QPen, QFont
 from PyQt5.QtWidgets import QWidget, QToolTip, QApplication
-from PyQt5.QtCore import Qt, QSize, QRect, QPointF, pyqtSignal, QEvent, QRectF
+from PyQt5.QtCore import Qt, QSize, QPointF, pyqtSignal, QEvent
 
-from constants import KEY_SIZE_RATIO, KEY_SPACING_RATIO, KEYBOARD_WIDGET_PADDING, \
-    KEYBOARD_WIDGET_MASK_HEIGHT, KEY_ROUNDNESS, SHADOW_SIDE_PADDING, SHADOW_TOP_PADDING, SHADOW_BOTTOM_PADDING, \
-    KEYBOARD_WIDGET_NONMASK_PADDING
+from constants import KEYBOARD_WIDGET_PADDING
 from themes import Theme
+from widgets import keyboard_widget
+from widgets.keyboard_widget import KeyGrid, KeyTilePainter
 
 
-class KeyWidget:
+class KeyWidget(keyboard_widget.KeyWidget):
 
-    def __init__(self, desc, scale, shift_x=0, shift_y=0):
-        self.active = False
-        self.on = False
-        self.masked = False
-        self.pressed = False
-        self.desc = desc
-        self.text = ""
-        self.mask_text = ""
-        self.tooltip = ""
-        self.color = None
-        self.mask_color = None
-        self.scale = 0
-
-        self.rotation_angle = desc.rotation_angle
-
-        self.has2 = desc.width2 != desc.width or desc.height2 != desc.height or desc.x2 != 0 or desc.y2 != 0
-
-        self.update_position(scale, shift_x, shift_y)
+    __slots__ = ("state", "hover")
 
+    def __init__(self, desc, scale, shift_x=0, shift_y=0):
+        super().__init__(desc, scale, shift_x, shift_y)
         self.state = 0
         self.hover = False
 
-    def update_position(self, scale, shift_x=0, shift_y=0):
-        if self.scale != scale or self.shift_x != shift_x or self.shift_y != shift_y:
-            self.scale = scale
-            self.size = self.scale * (KEY_SIZE_RATIO + KEY_SPACING_RATIO)
-            spacing = self.scale * KEY_SPACING_RATIO
-
-            self.rotation_x = self.size * self.desc.rotation_x
-            self.rotation_y = self.size * self.desc.rotation_y
-
-            self.shift_x = shift_x
-            self.shift_y = shift_y
-            self.x = self.size * self.desc.x
-            self.y = self.size * self.desc.y
-            self.w = self.size * self.desc.width - spacing
-            self.h = self.size * self.desc.height - spacing
-
-            self.rect = QRect(
-                round(self.x),
-                round(self.y),
-                round(self.w),
-                round(self.h)
-            )
-            self.text_rect = QRect(
-                round(self.x),
-                round(self.y + self.size * SHADOW_TOP_PADDING),
-                round(self.w),
-                round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
-            )
-
-            self.x2 = self.x + self.size * self.desc.x2
-            self.y2 = self.y + self.size * self.desc.y2
-            self.w2 = self.size * self.desc.width2 - spacing
-            self.h2 = self.size * self.desc.height2 - spacing
-
-            self.rect2 = QRect(
-                round(self.x2),
-                round(self.y2),
-                round(self.w2),
-                round(self.h2)
-            )
-
-            self.bbox = self.calculate_bbox(self.rect)
-            self.bbox2 = self.calculate_bbox(self.rect2)
-            self.polygon = QPolygonF(self.bbox + [self.bbox[0]])
-            self.polygon2 = QPolygonF(self.bbox2 + [self.bbox2[0]])
-            self.polygon = self.polygon.united(self.polygon2)
-            self.corner = self.size * KEY_ROUNDNESS
-            self.background_draw_path = self.calculate_background_draw_path()
-            self.foreground_draw_path = self.calculate_foreground_draw_path()
-            self.extra_draw_path = self.calculate_extra_draw_path()
-
-            # calculate areas where the inner keycode will be located
-            # nonmask = outer (e.g. Rsft_T)
-            # mask = inner (e.g. KC_A)
-            self.nonmask_rect = QRect(
-                round(self.x),
-                round(self.y + self.size * KEYBOARD_WIDGET_NONMASK_PADDING),
-                round(self.w),
-                round(self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT))
-            )
-            self.mask_rect = QRect(
-                round(self.x + self.size * SHADOW_SIDE_PADDING),
-                round(self.y + self.h * (1 - KEYBOARD_WIDGET_MASK_HEIGHT)),
-                round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-                round(self.h * KEYBOARD_WIDGET_MASK_HEIGHT - self.size * SHADOW_BOTTOM_PADDING)
-            )
-            self.mask_bbox = self.calculate_bbox(self.mask_rect)
-            self.mask_polygon = QPolygonF(self.mask_bbox + [self.mask_bbox[0]])
-
-    def calculate_bbox(self, rect):
-        x1 = rect.topLeft().x()
-        y1 = rect.topLeft().y()
-        x2 = rect.bottomRight().x()
-        y2 = rect.bottomRight().y()
-        points = [(x1, y1), (x1, y2), (x2, y2), (x2, y1)]
-        bbox = []
-        for p in points:
-            t = QTransform()
-            t.translate(self.shift_x, self.shift_y)
-            t.translate(self.rotation_x, self.rotation_y)
-            t.rotate(self.rotation_angle)
-            t.translate(-self.rotation_x, -self.rotation_y)
-            p = t.map(QPointF(p[0], p[1]))
-            bbox.append(p)
-        return bbox
-
-    def calculate_background_draw_path(self):
-        path = QPainterPath()
-        path.addRoundedRect(
-            round(self.x),
-            round(self.y),
-            round(self.w),
-            round(self.h),
-            self.corner,
-            self.corner
-        )
-
-        # second part only considered if different from first
-        if self.has2:
-            path2 = QPainterPath()
-            path2.addRoundedRect(
-                round(self.x2),
-                round(self.y2),
-                round(self.w2),
-                round(self.h2),
-                self.corner,
-                self.corner
-            )
-            path = path.united(path2)
-
-        return path
-
-    def calculate_foreground_draw_path(self):
-        path = QPainterPath()
-        path.addRoundedRect(
-            round(self.x + self.size * SHADOW_SIDE_PADDING),
-            round(self.y + self.size * SHADOW_TOP_PADDING),
-            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
-            self.corner,
-            self.corner
-        )
-
-        # second part only considered if different from first
-        if self.has2:
-            path2 = QPainterPath()
-            path2.addRoundedRect(
-                round(self.x2 + self.size * SHADOW_SIDE_PADDING),
-                round(self.y2 + self.size * SHADOW_TOP_PADDING),
-                round(self.w2 - 2 * self.size * SHADOW_SIDE_PADDING),
-                round(self.h2 - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING)),
-                self.corner,
-                self.corner
-            )
-            path = path.united(path2)
-
-        return path
-
-    def calculate_extra_draw_path(self):
-        return QPainterPath()
-
-    def setText(self, text):
-        self.text = text
+    def setState(self, state: int):
+        """Set the visual state (0=normal, 1=rt, 2=crt)."""
+        self.state = state
 
-    def setMaskText(self, text):
-        self.mask_text = text
 
-    def setToolTip(self, tooltip):
-        self.tooltip = tooltip
+class EncoderWidget(KeyWidget, keyboard_widget.EncoderWidget):
 
-    def setActive(self, active):
-        self.active = active
+    __slots__ = ()
 
-    def setOn(self, on):
-        self.on = on
 
-    def setPressed(self, pressed):
-        self.pressed = pressed
+class PaintStyles:
 
-    def setState(self, state: int):
-        """Set the visual state (0=normal, 1=rt, 2=crt)."""
-        self.state = state
+    """ Pens, brushes and fonts keys are drawn with, derived from the application palette """
 
-    def setColor(self, color):
-        self.color = color
+    def __init__(self, font):
+        palette = QApplication.palette()
+        button = palette.color(QPalette.Button)
+        rt = QColor("#1A9FFF")
 
-    def setMaskColor(self, color):
-        self.mask_color = color
+        # for regular keycaps
+        self.regular_pen = QPen(palette.color(QPalette.ButtonText))
+        self.background_brush = QBrush(button)
+        self.foreground_brush = QBrush(button.lighter(120))
+        self.mask_brush = QBrush(button.lighter(Theme.mask_light_factor()))
+        self.mask_rt_brush = QBrush(rt)
+        self.mask_crt_brush = QBrush(rt.darker(140))
 
-    def __repr__(self):
-        qualifiers = ["KeyboardWidget"]
-        if self.desc.row is not None:
-            qualifiers.append("matrix:{},{}".format(self.desc.row, self.desc.col))
-        if self.desc.layout_index != -1:
-            qualifiers.append("layout:{},{}".format(self.desc.layout_index, self.desc.layout_option))
-        return " ".join(qualifiers)
+        # for currently selected keycap
+        self.active_pen = QPen(palette.color(QPalette.Highlight))
+        self.active_pen.setWidthF(1.5)
 
+        # for the encoder arrow
+        self.extra_pen = self.regular_pen
+        self.extra_brush = QBrush(palette.color(QPalette.ButtonText))
 
-class EncoderWidget(KeyWidget):
+        # for rt/crt
+        self.background_rt_brush = QBrush(rt.darker(120))
+        self.foreground_rt_brush = QBrush(rt)
+        self.background_crt_brush = QBrush(rt.darker(170))
+        self.foreground_crt_brush = QBrush(rt.darker(140))
 
-    def calculate_background_draw_path(self):
-        path = QPainterPath()
-        path.addEllipse(round(self.x), round(self.y), round(self.w), round(self.h))
-        return path
+        self.font = font
+        self.mask_font = QFont(font)
+        # self.mask_font.setPointSize(round(font.pointSize() * 0.8))
+        self.mask_font.setPointSize(round(font.pointSize()))
+        self.arrow_font = QFont(font)
+        self.arrow_font.setPointSize(16)
 
-    def calculate_foreground_draw_path(self):
-        path = QPainterPath()
-        path.addEllipse(
-            round(self.x + self.size * SHADOW_SIDE_PADDING),
-            round(self.y + self.size * SHADOW_TOP_PADDING),
-            round(self.w - 2 * self.size * SHADOW_SIDE_PADDING),
-            round(self.h - self.size * (SHADOW_BOTTOM_PADDING + SHADOW_TOP_PADDING))
-        )
-        return path
-
-    def calculate_extra_draw_path(self):
-        path = QPainterPath()
-        # midpoint of arrow triangle
-        p = self.h
-        x = self.x
-        y = self.y + p / 2
-        if self.desc.encoder_dir == 0:
-            # counterclockwise - pointing down
-            path.moveTo(round(x), round(y))
-            path.lineTo(round(x + p / 10), round(y - p / 10))
-            path.lineTo(round(x), round(y + p / 10))
-            path.lineTo(round(x - p / 10), round(y - p / 10))
-            path.lineTo(round(x), round(y))
-        else:
-            # clockwise - pointing up
-            path.moveTo(round(x), round(y))
-            path.lineTo(round(x + p / 10), round(y + p / 10))
-            path.lineTo(round(x), round(y - p / 10))
-            path.lineTo(round(x - p / 10), round(y + p / 10))
-            path.lineTo(round(x), round(y))
-        return path
 
-    def __repr__(self):
-        return "EncoderWidget"
+class KeyboardWidgetHE(KeyTilePainter, QWidget):
 
+    paint_styles_class = PaintStyles
 
-class KeyboardWidgetHE(QWidget):
 
     clicked = pyqtSignal()
     deselected = pyqtSignal()
@@ -285,6 +101,14 @@ class KeyboardWidgetHE(QWidget):
         self.active_key = None
         self.active_mask = False
 
+        # layout options the keys depend on
+        self.layout_indices = []
+        # what the keys were last placed for, see update_layout
+        self.geometry_inputs = None
+        self.geometry_generation = 0
+        self.grid = None
+        self.grid_generation = None
+
         self.selected_keys = []
         self.select_enabled = False
         self.input_priority_index = 0
@@ -294,11 +118,16 @@ class KeyboardWidgetHE(QWidget):
         self.tab_index = 0
         self.current_layer = 0
 
+        self.styles = None
+        self.styles_key = None
+
     def set_keys(self, keys, encoders):
         self.common_widgets = []
         self.widgets_for_layout = []
 
         self.add_keys([(x, KeyWidget) for x in keys] + [(x, EncoderWidget) for x in encoders])
+        self.layout_indices = sorted(set(w.desc.layout_index for w in self.widgets_for_layout))
+        self.geometry_inputs = None
         self.update_layout()
 
     def add_keys(self, keys):
@@ -353,8 +182,20 @@ class KeyboardWidgetHE(QWidget):
             widget.update_position(widget.scale, widget.shift_x - top_x + self.padding,
                                    widget.shift_y - top_y + self.padding)
 
+    def layout_inputs(self):
+        """ Everything placing the keys depends on: font size, scale and the chosen layout options """
+
+        return (self.fontMetrics().height(), self.scale,
+                tuple(self.layout_editor.get_choice(idx) for idx in self.layout_indices))
+
     def update_layout(self):
-        """ Updates self.widgets for the currently active layout """
+        """ Updates self.widgets for the currently active layout, unless nothing it depends on changed """
+
+        inputs = self.layout_inputs()
+        if inputs == self.geometry_inputs:
+            return
+        self.geometry_inputs = inputs
+        self.geometry_generation += 1
 
         # determine widgets for current layout
         self.place_widgets()
@@ -375,146 +216,57 @@ class KeyboardWidgetHE(QWidget):
         self.update()
         self.updateGeometry()
 
-    def paintEvent(self, event):
-        qp = QPainter()
-        qp.begin(self)
-        qp.setRenderHint(QPainter.Antialiasing)
-
-        # for regular keycaps
-        regular_pen = qp.pen()
-        regular_pen.setColor(QApplication.palette().color(QPalette.ButtonText))
-        qp.setPen(regular_pen)
-
-        background_brush = QBrush()
-        background_brush.setColor(QApplication.palette().color(QPalette.Button))
-        background_brush.setStyle(Qt.SolidPattern)
-
-        foreground_brush = QBrush()
-        foreground_brush.setColor(QApplication.palette().color(QPalette.Button).lighter(120))
-        foreground_brush.setStyle(Qt.SolidPattern)
-
-        mask_brush = QBrush()
-        mask_brush.setColor(QApplication.palette().color(QPalette.Button).lighter(Theme.mask_light_factor()))
-        mask_brush.setStyle(Qt.SolidPattern)
-
-        mask_rt_brush = QBrush()
-        mask_rt_brush.setColor(QColor("#1A9FFF"))
-        mask_rt_brush.setStyle(Qt.SolidPattern)
-
-        mask_crt_brush = QBrush()
-        mask_crt_brush.setColor(QColor("#1A9FFF").darker(140))
-        mask_crt_brush.setStyle(Qt.SolidPattern)
-
-        # for currently selected keycap
-        active_pen = qp.pen()
-        active_pen.setColor(QApplication.palette().color(QPalette.Highlight))
-        active_pen.setWidthF(1.5)
-
-        # for the encoder arrow
-        extra_pen = regular_pen
-        extra_brush = QBrush()
-        extra_brush.setColor(QApplication.palette().color(QPalette.ButtonText))
-        extra_brush.setStyle(Qt.SolidPattern)
-
-        # for rt/crt
-        background_rt_brush = QBrush()
-        background_rt_brush.setColor(QColor("#1A9FFF").darker(120))
-        background_rt_brush.setStyle(Qt.SolidPattern)
-
-        foreground_rt_brush = QBrush()
-        foreground_rt_brush.setColor(QColor("#1A9FFF"))
-        foreground_rt_brush.setStyle(Qt.SolidPattern)
-
-        background_crt_brush = QBrush()
-        background_crt_brush.setColor(QColor("#1A9FFF").darker(170))
-        background_crt_brush.setStyle(Qt.SolidPattern)
-
-        foreground_crt_brush = QBrush()
-        foreground_crt_brush.setColor(QColor("#1A9FFF").darker(140))
-        foreground_crt_brush.setStyle(Qt.SolidPattern)
-
-        mask_font = qp.font()
-        # mask_font.setPointSize(round(mask_font.pointSize() * 0.8))
-        mask_font.setPointSize(round(mask_font.pointSize()))
-
-        for idx, key in enumerate(self.widgets):
-            qp.save()
-
-            qp.scale(self.scale, self.scale)
-            qp.translate(key.shift_x, key.shift_y)
-            qp.translate(key.rotation_x, key.rotation_y)
-            qp.rotate(key.rotation_angle)
-            qp.translate(-key.rotation_x, -key.rotation_y)
-
-            active = key.active or (key in self.selected_keys) or (key in self.input_priority_pair)
-
-            # --- background ---
-            qp.setPen(active_pen if active else Qt.NoPen)
-            if key.state == 0:
-                qp.setBrush(background_brush)
-            elif key.state == 1:
-                qp.setBrush(background_rt_brush)
-            elif key.state == 2:
-                qp.setBrush(background_crt_brush)
-
-            if self.tab_index == 3:
-                qp.setBrush(background_brush)
-            
-            qp.drawPath(key.background_draw_path)
-
-            # --- foreground ---
-            qp.setPen(Qt.NoPen)
-            if key.state == 0:
-                qp.setBrush(foreground_brush)
-            elif key.state == 1:
-                qp.setBrush(foreground_rt_brush)
-            elif key.state == 2:
-                qp.setBrush(foreground_crt_brush)
-
-            if self.tab_index == 3:
-                qp.setBrush(foreground_brush)
-
-            qp.drawPath(key.foreground_draw_path)
-
-            # draw key text
-            if key.masked:
-                # draw the outer legend
-                qp.setFont(mask_font)
-                qp.setPen(key.color if key.color else regular_pen)
-                qp.drawText(key.nonmask_rect, Qt.AlignCenter, key.text)
-
-                # draw the inner highlight rect
-                qp.setPen(active_pen if self.active_key == key and self.active_mask else Qt.NoPen)
-                qp.setBrush(mask_brush)
-                if key.state == 0:
-                    qp.setBrush(mask_brush)
-                elif key.state == 1:
-                    qp.setBrush(mask_rt_brush)
-                elif key.state == 2:
-                    qp.setBrush(mask_crt_brush)
-                qp.drawRoundedRect(key.mask_rect, key.corner, key.corner)
-
-                # draw the inner legend
-                qp.setPen(key.mask_color if key.mask_color else regular_pen)
-                qp.drawText(key.mask_rect, Qt.AlignCenter, key.mask_text)
-            else:
-                # draw the legend
-                qp.setPen(key.color if key.color else regular_pen)
-                if key.text in ("⇷", "⇸"): #🡄🡆
-                    font = qp.font()
-                    font.setPointSize(16)   # adjust size here
-                    # font.setBold(True)
-                    qp.setFont(font)
-                qp.drawText(key.text_rect, Qt.AlignCenter, key.text)
-
-            # draw the extra shape (encoder arrow)
-            qp.setPen(extra_pen)
-            qp.setBrush(extra_brush)
-            qp.drawPath(key.extra_draw_path)
-
-            qp.restore()
+    def key_state(self, key):
+        """ Everything the drawing of a key depends on, besides its geometry """
+
+        state = key.state if key.state in (1, 2) else 0
+        return (key.active or (key in self.selected_keys) or (key in self.input_priority_pair),
+                self.active_key == key and self.active_mask,
+                0 if self.tab_index == 3 else state, state, key.masked, key.text, key.mask_text,
+                key.color.rgba() if key.color else None, key.mask_color.rgba() if key.mask_color else None,
+                self.styles_key)
+
+    def draw_key(self, qp, key, styles, active, active_mask):
+        mask_state = key.state if key.state in (1, 2) else 0
+        cap_state = 0 if self.tab_index == 3 else mask_state
+        qp.setFont(styles.font)
+
+        # --- background ---
+        qp.setPen(styles.active_pen if active else Qt.NoPen)
+        qp.setBrush([styles.background_brush, styles.background_rt_brush, styles.background_crt_brush][cap_state])
+        qp.drawPath(key.background_draw_path)
+
+        # --- foreground ---
+        qp.setPen(Qt.NoPen)
+        qp.setBrush([styles.foreground_brush, styles.foreground_rt_brush, styles.foreground_crt_brush][cap_state])
+        qp.drawPath(key.foreground_draw_path)
+
+        # draw key text
+        if key.masked:
+            # draw the outer legend
+            qp.setFont(styles.mask_font)
+            qp.setPen(key.color if key.color else styles.regular_pen)
+            qp.drawText(key.nonmask_rect, Qt.AlignCenter, key.text)
+
+            # draw the inner highlight rect
+            qp.setPen(styles.active_pen if active_mask else Qt.NoPen)
+            qp.setBrush([styles.mask_brush, styles.mask_rt_brush, styles.mask_crt_brush][mask_state])
+            qp.drawRoundedRect(key.mask_rect, key.corner, key.corner)
+
+            # draw the inner legend
+            qp.setPen(key.mask_color if key.mask_color else styles.regular_pen)
+            qp.drawText(key.mask_rect, Qt.AlignCenter, key.mask_text)
+        else:
+            # draw the legend
+            qp.setPen(key.color if key.color else styles.regular_pen)
+            if key.text in ("⇷", "⇸"): #🡄🡆
+                qp.setFont(styles.arrow_font)
+            qp.drawText(key.text_rect, Qt.AlignCenter, key.text)
 
-        qp.end()
+        # draw the extra shape (encoder arrow)
+        qp.setPen(styles.extra_pen)
+        qp.setBrush(styles.extra_brush)
+        qp.drawPath(key.extra_draw_path)
 
     def minimumSizeHint(self):
         return QSize(self.width, self.height)
@@ -522,10 +274,15 @@ class KeyboardWidgetHE(QWidget):
     def hit_test(self, pos):
         """ Returns key, hit_masked_part """
 
-        for key in self.widgets:
-            if key.masked and key.mask_polygon.containsPoint(pos/self.scale, Qt.OddEvenFill):
+        if self.grid_generation != self.geometry_generation:
+            self.grid = KeyGrid(self.widgets)
+            self.grid_generation = self.geometry_generation
+
+        pos = QPointF(pos / self.scale)
+        for key in self.grid.candidates(pos):
+            if key.masked and key.mask_polygon.containsPoint(pos, Qt.OddEvenFill):
                 return key, True
-            if key.polygon.containsPoint(pos/self.scale, Qt.OddEvenFill):
+            if key.polygon.containsPoint(pos, Qt.OddEvenFill):
                 return key, False
 
         return None, False
@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append("src/main/python")
+
+from protocol.macro import macro_deserialize_v1, macro_deserialize_v2
+
+
+def load_corpus(paths):
+    """ Reads every input of the given atheris corpus directories (or single files) """
+
+    inputs = []
+    for path in paths:
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        for fn in files:
+            with open(fn, "rb") as inf:
+                inputs.append(inf.read())
+    return inputs
+
+
+def synthetic_corpus(count, size, seed):
+    """ Random macros mixing long text runs with key, extended key and delay actions """
+
+    rnd = random.Random(seed)
+    inputs = []
+    for x in range(count):
+        out = bytearray()
+        while len(out) < size:
+            choice = rnd.random()
+            if choice < 0.4:
+                out += bytes(rnd.randint(0x20, 0x7E) for y in range(rnd.randint(1, 64)))
+            elif choice < 0.7:
+                out += bytes([1, rnd.randint(1, 3), rnd.randint(4, 0xE7)])
+            elif choice < 0.9:
+                out += bytes([1, rnd.randint(5, 7), rnd.randint(0, 255), rnd.randint(0, 255)])
+            else:
+                out += bytes([1, 4, rnd.randint(1, 255), rnd.randint(1, 255)])
+        inputs.append(bytes(out))
+    return inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the macro decoders over atheris corpora collected by "
+                                                 "util/macro_fuzzer_v1.py and util/macro_fuzzer_v2.py, or over "
+                                                 "generated macros when no corpus is given")
+    parser.add_argument("corpus", nargs="*", help="corpus directories or files")
+    parser.add_argument("--count", type=int, default=200, help="number of generated macros")
+    parser.add_argument("--size", type=int, default=4096, help="size of every generated macro")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    if args.corpus:
+        inputs = load_corpus(args.corpus)
+    else:
+        inputs = synthetic_corpus(args.count, args.size, args.seed)
+    total = sum(len(data) for data in inputs)
+
+    for decoder in [macro_deserialize_v1, macro_deserialize_v2]:
+        best = None
+        for x in range(args.repeat):
+            start = time.monotonic()
+            for data in inputs:
+                decoder(data)
+            elapsed = time.monotonic() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{}: {} inputs, {} bytes in {:.3f}s ({:.1f} MB/s)".format(
+            decoder.__name__, len(inputs), total, best, total / best / 1e6 if best else float("inf")))
+
+
+if __name__ == "__main__":
+    main()
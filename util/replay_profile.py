@@ -0,0 +1,40 @@
+import argparse
+import cProfile
+import pstats
+import sys
+import time
+
+sys.path.append("src/main/python")
+
+from protocol.keyboard_comm import Keyboard
+from protocol.transcript import TranscriptReplay
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a HID transcript recorded with VIAL_HID_TRANSCRIPT "
+                                                 "and profiles Keyboard.reload() against it")
+    parser.add_argument("transcript")
+    parser.add_argument("--realtime", action="store_true", help="serve responses at the recorded latency and pace")
+    parser.add_argument("--restore", help="also restore this .vil layout after reloading")
+    parser.add_argument("--top", type=int, default=25, help="number of profile entries to print")
+    args = parser.parse_args()
+
+    replay = TranscriptReplay.load(args.transcript, realtime=args.realtime)
+    keyboard = Keyboard(replay, usb_send=replay.usb_send)
+
+    profile = cProfile.Profile()
+    start = time.monotonic()
+    profile.enable()
+    keyboard.reload()
+    if args.restore:
+        with open(args.restore, "rb") as inf:
+            keyboard.restore_layout(inf.read())
+    profile.disable()
+
+    print("replayed {} of {} records in {:.3f}s, {} out-of-order requests".format(
+        replay.cursor, len(replay.records), time.monotonic() - start, replay.misses))
+    pstats.Stats(profile).sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
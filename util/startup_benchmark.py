@@ -0,0 +1,53 @@
+import argparse
+import os
+import subprocess
+import sys
+
+SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main", "python")
+
+SCENARIOS = [
+    ("keycodes", "import keycodes.keycodes"),
+    ("keymaps", "import keymaps"),
+    ("any_keycode", "import any_keycode"),
+    ("protocol 6 keycodes",
+     "from keycodes.keycodes import Keycode\nKeycode.protocol = 6\nKeycode.resolve('KC_A')"),
+    ("one keymap", "from keymaps import load_keymap\nload_keymap(13)"),
+    ("every keymap", "from keymaps import KEYMAPS, load_keymap\nfor x in range(len(KEYMAPS)): load_keymap(x)"),
+]
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+"""
+
+
+def measure(code, repeat):
+    """ Runs code in fresh interpreters, returns the best time it took """
+
+    best = None
+    for x in range(repeat):
+        out = subprocess.run([sys.executable, "-c", SCRIPT.format(code)], cwd=SOURCES, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        elapsed = float(out.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times importing the keycode and keyboard layout tables in a fresh "
+                                                 "interpreter, the way the application does on startup")
+    parser.add_argument("--repeat", type=int, default=10, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    # warm up the bytecode cache so that compiling the sources isn't measured
+    measure("import keymaps, any_keycode\nfrom keymaps import KEYMAPS, load_keymap\n"
+            "for x in range(len(KEYMAPS)): load_keymap(x)", 1)
+
+    for name, code in SCENARIOS:
+        print("{}: {:.1f}ms".format(name, measure(code, args.repeat) * 1000))
+
+
+if __name__ == "__main__":
+    main()